@@ -1,17 +1,31 @@
 """
 This file defines the ConceptNet web API responses.
 """
+import time
 
 from conceptnet5 import __version__ as VERSION
 from conceptnet5.nodes import ld_node, standardized_concept_uri
 from conceptnet5.db.config import DB_NAME
-from conceptnet5.db.query import AssertionFinder
+from conceptnet5.db.query import decode_page_token, get_assertion_finder
+from conceptnet5.util.singleflight import SingleFlight
 from conceptnet5.vectors.query import VectorSpaceWrapper
 
 VECTORS = VectorSpaceWrapper()
-FINDER = AssertionFinder(dbname=DB_NAME)
+FINDER = get_assertion_finder(dbname=DB_NAME)
 CONTEXT = ["http://api.conceptnet.io/ld/conceptnet5.7/context.ld.json"]
 VALID_KEYS = ['rel', 'start', 'end', 'node', 'other', 'source', 'uri']
+LOOKUP_PREFIXES = ('/a/', '/c/', '/d/', '/r/', '/s/')
+MAX_BATCH_SIZE = 100
+MAX_RELATEDNESS_NODES = 1000
+
+# Identical requests that arrive at the same time, such as the many requests
+# for a popular concept, share one computation of the response
+COALESCER = SingleFlight()
+
+# The parts of the API that `warm_up` loads, and how many seconds each of them
+# took to load in this process
+COMPONENTS = ('vectors', 'assertions')
+LOAD_TIMES = {}
 
 
 def success(response):
@@ -27,6 +41,67 @@ def error(response, status, details):
     return response
 
 
+def _load_component(name, load):
+    start = time.monotonic()
+    load()
+    LOAD_TIMES[name] = time.monotonic() - start
+
+
+def warm_up(before_fork=False):
+    """
+    Load everything the API needs to answer queries -- the term vectors with
+    their nearest-neighbor index, and the assertion store or the database
+    connections -- so that the first requests don't have to wait for it.
+
+    A server that forks worker processes can call this in its master process
+    with `before_fork=True`, so that the workers share the loaded arrays
+    copy-on-write. Database connections can't be shared that way, so they're
+    opened only to check that the database is reachable, and then closed.
+    Each worker should call `connect_after_fork` when it starts.
+    """
+    _load_component('vectors', VECTORS.load)
+    _load_component('assertions', FINDER.connect)
+    if before_fork:
+        FINDER.disconnect()
+
+
+def connect_after_fork():
+    """
+    Reopen the database connections in a worker process that was forked after
+    `warm_up(before_fork=True)`.
+    """
+    _load_component('assertions', FINDER.connect)
+
+
+def build_version():
+    """
+    Get an identifier for the data that the API is serving. It changes when
+    `cn5-db load_data` loads a new build, so responses that were computed from
+    the old data can be thrown away.
+    """
+    return '{}/{}'.format(VERSION, FINDER.build_version())
+
+
+def readiness():
+    """
+    Report which parts of the API have been loaded in this process and how
+    long each of them took. The 'ready' value is True when all of them have
+    been loaded, so that requests won't stall on loading them.
+    """
+    components = {}
+    for name in COMPONENTS:
+        seconds = LOAD_TIMES.get(name)
+        components[name] = {
+            'loaded': seconds is not None,
+            'seconds': None if seconds is None else round(seconds, 3),
+        }
+    if VECTORS.small_frame is not None:
+        components['vectors']['terms'] = len(VECTORS.small_frame)
+        components['vectors']['ann_index'] = VECTORS.ann_index is not None
+    ready = all(component['loaded'] for component in components.values())
+    return success({'ready': ready, 'components': components})
+
+
 def make_query_url(url, items):
     """
     Take a URL base and a list of key/value pairs representing parameters,
@@ -55,18 +130,26 @@ def groupkey_to_pairs(groupkey, term):
         return [('rel', rel), ('node', term)]
 
 
-def paginated_url(url, params, offset, limit):
+def paginated_url(url, params, offset, limit, after=None):
     """
     Take in a URL and set 'offset=' and 'limit=' parameters on its query string,
     replacing those parameters if they already existed.
+
+    If `after` is given, it's a continuation token that replaces the offset.
     """
     new_params = [
-        (key, val) for (key, val) in params if key != 'offset' and key != 'limit'
-    ] + [('offset', offset), ('limit', limit)]
+        (key, val) for (key, val) in params
+        if key != 'offset' and key != 'limit' and key != 'after'
+    ]
+    if after is None:
+        new_params.append(('offset', offset))
+    else:
+        new_params.append(('after', after))
+    new_params.append(('limit', limit))
     return make_query_url(url, new_params)
 
 
-def make_paginated_view(url, params, offset, limit, more):
+def make_paginated_view(url, params, offset, limit, more, after=None, next_token=None):
     """
     Create a JSON-LD structure that describes the fact that this is just
     one page of results and more pages exist.
@@ -75,11 +158,16 @@ def make_paginated_view(url, params, offset, limit, more):
     https://www.w3.org/community/hydra/wiki/Pagination. It now sort of resembles
     the "PartialCollectionView" proposal. This stuff is still not
     well-standardized.
+
+    `after` is the continuation token that this page was requested with, if
+    any. If `next_token` is given, the 'nextPage' link continues from it,
+    which lets the database seek directly to the next page instead of
+    skipping over `offset` results.
     """
     prev_offset = max(0, offset - limit)
     next_offset = offset + limit
     pager = {
-        '@id': paginated_url(url, params, offset, limit),
+        '@id': paginated_url(url, params, offset, limit, after),
         '@type': 'PartialCollectionView',
         'firstPage': paginated_url(url, params, 0, limit),
         'paginatedProperty': 'edges',
@@ -87,13 +175,14 @@ def make_paginated_view(url, params, offset, limit, more):
     if offset > 0:
         pager['previousPage'] = paginated_url(url, params, prev_offset, limit)
     if more:
-        pager['nextPage'] = paginated_url(url, params, next_offset, limit)
+        pager['nextPage'] = paginated_url(url, params, next_offset, limit, next_token)
         pager['comment'] = (
             "There are more results. Follow the 'nextPage' link for more."
         )
     return pager
 
 
+@COALESCER.coalesce
 def lookup_grouped_by_feature(term, filters=None, feature_limit=10):
     """
     Given a query for a concept, return assertions about that concept grouped by
@@ -105,6 +194,14 @@ def lookup_grouped_by_feature(term, filters=None, feature_limit=10):
         )
 
     found = FINDER.lookup_grouped_by_feature(term, limit=(feature_limit + 1))
+    return grouped_response(term, found, filters, feature_limit)
+
+
+def grouped_response(term, found, filters, feature_limit):
+    """
+    Build the response to `lookup_grouped_by_feature`, given the features
+    that the AssertionFinder found for the term.
+    """
     grouped = []
     for groupkey, assertions in found.items():
         direction, rel = groupkey
@@ -141,18 +238,150 @@ def lookup_grouped_by_feature(term, filters=None, feature_limit=10):
         return success(response)
 
 
-def lookup_paginated(term, limit=50, offset=0):
+@COALESCER.coalesce
+def lookup_paginated(term, limit=50, offset=0, after=None):
     """
     Look up edges associated with a particular URI, and return a paginated,
     flat list of results.
+
+    `after` is an optional continuation token, taken from the 'nextPage' link
+    of a previous page, that takes the place of `offset`.
     """
-    # Query one more edge than asked for, so we know if there are more
-    found = FINDER.lookup(term, limit=(limit + 1), offset=offset)
+    try:
+        if after is not None:
+            offset = decode_page_token(after)[2]
+        edges, next_token = FINDER.lookup_page(
+            term, limit=limit, offset=offset, after=after
+        )
+    except ValueError as e:
+        return error({'@id': term}, 400, str(e))
+    response = {'@id': term, 'edges': edges}
+    more = next_token is not None
+    if more or offset != 0:
+        response['view'] = make_paginated_view(
+            term, (), offset, limit, more=more, after=after, next_token=next_token
+        )
+    if not edges:
+        return error(response, 404, '%r is not a node in ConceptNet.' % term)
+    else:
+        return success(response)
+
+
+def batch(requests):
+    """
+    Answer a list of requests at once, returning a list of responses in the
+    same order. Each request is a dictionary in one of these forms:
+
+    - {'lookup': uri, 'limit': n}, the same as `lookup_paginated`
+    - {'lookup': uri, 'limit': n, 'grouped': True}, the same as
+      `lookup_grouped_by_feature` with a `feature_limit` of n
+    - {'query': {criteria}, 'limit': n, 'offset': n}, the same as
+      `query_paginated`
+
+    All the plain lookups with the same limit are answered with a single
+    database query, and so are all the grouped lookups with the same limit.
+    Queries aren't combined like this: each one is answered separately, as
+    `query_paginated` would answer it.
+
+    'grouped' is read the way the `/c/` endpoint reads it, so it can be a
+    boolean or the string 'true' or 'false'.
+    """
+    if not isinstance(requests, list):
+        return error({}, 400, 'A batch should be a list of requests.')
+    if len(requests) > MAX_BATCH_SIZE:
+        return error(
+            {}, 400, 'A batch can contain at most %d requests.' % MAX_BATCH_SIZE
+        )
+
+    responses = [None] * len(requests)
+    # Map (grouped, limit) to the list of (position, uri) lookups that
+    # can be answered together
+    lookups = {}
+    for i, request in enumerate(requests):
+        try:
+            if not isinstance(request, dict):
+                raise ValueError('Each request should be a JSON object.')
+            grouped = str(request.get('grouped', False)).lower() == 'true'
+            if grouped:
+                limit = _batch_int(request, 'limit', 20, 0, 100)
+            else:
+                limit = _batch_int(request, 'limit', 20, 0, 1000)
+
+            if 'lookup' in request:
+                uri = request['lookup']
+                if not isinstance(uri, str) or not uri.startswith(LOOKUP_PREFIXES):
+                    raise ValueError(
+                        "%r isn't a ConceptNet URI that can be looked up." % (uri,)
+                    )
+                if grouped and not uri.startswith('/c/'):
+                    raise ValueError(
+                        'Only concept nodes (starting with /c/) can be grouped by feature.'
+                    )
+                lookups.setdefault((grouped, limit), []).append((i, uri))
+            elif 'query' in request:
+                criteria = request['query']
+                if not isinstance(criteria, dict) or not all(
+                    isinstance(value, str) for value in criteria.values()
+                ):
+                    raise ValueError('A query should map criteria to URIs.')
+                criteria = {
+                    key: value for (key, value) in criteria.items() if key in VALID_KEYS
+                }
+                offset = _batch_int(request, 'offset', 0, 0, 100000)
+                responses[i] = query_paginated(criteria, offset=offset, limit=limit)
+            else:
+                raise ValueError("Each request should contain 'lookup' or 'query'.")
+        except ValueError as e:
+            responses[i] = error({}, 400, str(e))
+
+    for (grouped, limit), positions in lookups.items():
+        uris = [uri for (_, uri) in positions]
+        try:
+            if grouped:
+                found = FINDER.lookup_grouped_by_feature_many(uris, limit=(limit + 1))
+            else:
+                found = FINDER.lookup_many(uris, limit=(limit + 1))
+        except ValueError as e:
+            for i, uri in positions:
+                responses[i] = error({'@id': uri}, 400, str(e))
+            continue
+
+        for i, uri in positions:
+            if grouped:
+                responses[i] = grouped_response(uri, found[uri], None, limit)
+            else:
+                responses[i] = lookup_response(uri, found[uri], limit)
+
+    return success({'@id': '/batch', 'results': responses})
+
+
+def _batch_int(request, key, default, minimum, maximum):
+    """
+    Get an integer parameter of a batch request, clamped to the same range
+    that the individual API endpoints allow.
+    """
+    value = request.get(key, default)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError('%r should be an integer.' % key)
+    return max(minimum, min(maximum, value))
+
+
+def lookup_response(term, found, limit):
+    """
+    Build the response to a lookup of the first page of edges for a URI,
+    given up to `limit + 1` edges that were found.
+    """
+    if term.startswith('/a/'):
+        response = {'@id': term}
+        if not found:
+            return error(response, 404, '%r is not an assertion in ConceptNet.' % term)
+        response.update(found[0])
+        return success(response)
+
     edges = found[:limit]
     response = {'@id': term, 'edges': edges}
-    more = len(found) > len(edges)
-    if len(found) > len(edges) or offset != 0:
-        response['view'] = make_paginated_view(term, (), offset, limit, more=more)
+    if len(found) > len(edges):
+        response['view'] = make_paginated_view(term, (), 0, limit, more=True)
     if not found:
         return error(response, 404, '%r is not a node in ConceptNet.' % term)
     else:
@@ -195,7 +424,48 @@ def query_relatedness(node1, node2):
         )
 
 
+def query_relatedness_matrix(nodes_a, nodes_b=None):
+    """
+    Query for the similarity between every node in `nodes_a` and every node
+    in `nodes_b`, which defaults to `nodes_a`. The 'value' of the response
+    is a list with a row for each node in `nodes_a`, containing its cosine
+    similarities to each node in `nodes_b`, as `query_relatedness` would
+    find them.
+
+    The vectors for all the nodes are looked up at once, with out-of-vocabulary
+    nodes approximated as usual, and compared with one matrix product.
+    """
+    if nodes_b is None:
+        nodes_b = nodes_a
+    url = make_query_url(
+        '/relatedness/matrix',
+        [('nodes_a', ','.join(nodes_a or [])), ('nodes_b', ','.join(nodes_b or []))],
+    )
+    if not nodes_a or not nodes_b:
+        return error({'@id': url}, 400, 'Arguments should be called nodes_a and nodes_b.')
+    if not all(isinstance(node, str) for node in nodes_a + nodes_b):
+        return error({'@id': url}, 400, 'Each node should be a string.')
+    if max(len(nodes_a), len(nodes_b)) > MAX_RELATEDNESS_NODES:
+        return error(
+            {'@id': url},
+            400,
+            'Each list can contain at most %d nodes.' % MAX_RELATEDNESS_NODES,
+        )
+
+    vecs_a = VECTORS.get_vectors(nodes_a)
+    vecs_b = vecs_a if nodes_b == nodes_a else VECTORS.get_vectors(nodes_b)
+    relatedness = vecs_a @ vecs_b.T
+    response = {
+        '@id': url,
+        'nodes_a': nodes_a,
+        'nodes_b': nodes_b,
+        'value': [[round(float(value), 3) for value in row] for row in relatedness],
+    }
+    return success(response)
+
+
 # TODO: document querying for a list of terms
+@COALESCER.coalesce
 def query_related(uri, filter=None, limit=20):
     """
     Query for terms that are related to a term, or list of terms, according
@@ -225,7 +495,13 @@ def query_related(uri, filter=None, limit=20):
             '%r is not something that I can find related terms to.' % uri,
         )
 
-    found = VECTORS.similar_terms(query, filter=filter, limit=limit)
+    # Most queries are for a single term with no filter, and can be answered
+    # from the table of precomputed neighbors, if there is one
+    found = None
+    if filter is None and isinstance(query, str):
+        found = VECTORS.precomputed_similar_terms(query, limit=limit)
+    if found is None:
+        found = VECTORS.similar_terms(query, filter=filter, limit=limit)
     related = [
         {'@id': key, 'weight': round(float(weight), 3)}
         for (key, weight) in found.items()
@@ -234,24 +510,50 @@ def query_related(uri, filter=None, limit=20):
     return response
 
 
-def query_paginated(query, offset=0, limit=50):
+@COALESCER.coalesce
+def query_paginated(query, offset=0, limit=50, after=None):
     """
     Search ConceptNet for edges matching a query.
 
     The query should be provided as a dictionary of criteria. The `query`
     function in the `.api` module constructs such a dictionary.
+
+    `after` is an optional continuation token, taken from the 'nextPage' link
+    of a previous page, that takes the place of `offset`.
     """
-    found = FINDER.query(query, limit=limit + 1, offset=offset)
-    edges = found[:limit]
-    response = {'@id': make_query_url('/query', query.items()), 'edges': edges}
-    more = len(found) > len(edges)
-    if len(found) > len(edges) or offset != 0:
+    url = make_query_url('/query', query.items())
+    try:
+        if after is not None:
+            offset = decode_page_token(after)[2]
+        edges, next_token = FINDER.query_page(
+            query, limit=limit, offset=offset, after=after
+        )
+    except ValueError as e:
+        return error({'@id': url}, 400, str(e))
+    response = {'@id': url, 'edges': edges}
+    more = next_token is not None
+    if more or offset != 0:
         response['view'] = make_paginated_view(
-            '/query', sorted(query.items()), offset, limit, more=more
+            '/query',
+            sorted(query.items()),
+            offset,
+            limit,
+            more=more,
+            after=after,
+            next_token=next_token,
         )
     return success(response)
 
 
+def export_edges(query):
+    """
+    Iterate over every edge matching a query, which is a dictionary of
+    criteria like the one `query_paginated` takes, with no limit on how many
+    edges there are. This is what the /export endpoint streams.
+    """
+    return FINDER.iter_query(query)
+
+
 def standardize_uri(language, text):
     """
     Look up the URI for a given piece of text.
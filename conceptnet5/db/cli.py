@@ -1,8 +1,18 @@
+import time
+
 import click
 
-from .connection import check_db_connection, get_db_connection
-from .prepare_data import assertions_to_sql_csv, load_sql_csv
-from .schema import create_indices, create_tables
+from . import config
+from .connection import check_db_connection, get_db_connection, open_db_connection
+from .delta import apply_delta
+from .embedded import build_embedded_store
+from .prepare_data import assertions_to_sql_csv, load_sql_csv, load_sql_csv_parallel
+from .schema import (
+    create_indices_parallel,
+    create_tables,
+    record_build_version,
+    sample_edges,
+)
 
 
 @click.group()
@@ -15,8 +25,11 @@ def cli():
 @click.argument(
     'output_dir', type=click.Path(writable=True, dir_okay=True, file_okay=False)
 )
-def prepare_data(input_filename, output_dir):
-    assertions_to_sql_csv(input_filename, output_dir)
+@click.option(
+    '--jobs', '-j', type=int, default=1, help="Number of processes to prepare shards with"
+)
+def prepare_data(input_filename, output_dir, jobs):
+    assertions_to_sql_csv(input_filename, output_dir, jobs=jobs)
 
 
 @cli.command(name='load_data')
@@ -24,11 +37,78 @@ def prepare_data(input_filename, output_dir):
     'input_dir',
     type=click.Path(readable=True, writable=True, dir_okay=True, file_okay=False),
 )
-def load_data(input_dir):
+@click.option(
+    '--jobs', '-j', type=int, default=1,
+    help="Number of tables to load, and indices to build, at once",
+)
+@click.option(
+    '--maintenance-work-mem', type=int, default=None,
+    help="Megabytes of memory to divide among the jobs that build indices",
+)
+def load_data(input_dir, jobs, maintenance_work_mem):
+    """
+    Load the CSV files from `prepare_data` into PostgreSQL and index them,
+    reporting how long each step takes.
+    """
     conn = get_db_connection()
+
+    def report(name, seconds):
+        click.echo('{:<30} {:10.1f}s'.format(name, seconds))
+
+    start = time.monotonic()
     create_tables(conn)
-    load_sql_csv(conn, input_dir)
-    create_indices(conn)
+    report('create tables', time.monotonic() - start)
+
+    phase_start = time.monotonic()
+    if jobs > 1:
+        timings = load_sql_csv_parallel(config.DB_NAME, input_dir, jobs)
+    else:
+        timings = load_sql_csv(conn, input_dir)
+    for name, seconds in timings:
+        report('  load ' + name, seconds)
+    report('load tables', time.monotonic() - phase_start)
+
+    phase_start = time.monotonic()
+    sample_edges(conn)
+    report('sample edges', time.monotonic() - phase_start)
+
+    phase_start = time.monotonic()
+    if maintenance_work_mem is not None:
+        maintenance_work_mem = max(maintenance_work_mem // jobs, 64)
+    timings = create_indices_parallel(open_db_connection, jobs, maintenance_work_mem)
+    for name, seconds in timings:
+        report('  index ' + name, seconds)
+    report('create indices', time.monotonic() - phase_start)
+
+    record_build_version(conn)
+    report('total', time.monotonic() - start)
+
+
+@cli.command(name='apply_delta')
+@click.argument('input_filename', type=click.Path(readable=True, dir_okay=False))
+def run_apply_delta(input_filename):
+    """
+    Update the loaded database to match a new assertions.msgpack, changing
+    only the edges that were added, changed, or removed, while the API keeps
+    running.
+    """
+    counts = apply_delta(get_db_connection(), input_filename)
+    click.echo(
+        'Added {added}, changed {changed}, and removed {removed} edges'.format(**counts)
+    )
+
+
+@cli.command(name='build_embedded')
+@click.argument('input_filename', type=click.Path(readable=True, dir_okay=False))
+@click.argument(
+    'output_dir', type=click.Path(writable=True, dir_okay=True, file_okay=False)
+)
+def build_embedded(input_filename, output_dir):
+    """
+    Build an embedded edge store, which can be used instead of PostgreSQL by
+    setting CONCEPTNET_DB_BACKEND=embedded.
+    """
+    build_embedded_store(input_filename, output_dir)
 
 
 @cli.command(name='check')
@@ -7,6 +7,25 @@ environment variables:
     CONCEPTNET_DB_HOSTNAME - the host to connect to (default "localhost")
     CONCEPTNET_DB_PORT - the port number to connect to (default 5432)
     CONCEPTNET_DB_NAME - the database name to use (default "conceptnet5")
+
+The pool of connections that the API shares between threads can be tuned
+with these variables:
+
+    CONCEPTNET_DB_POOL_MIN - connections to open when the pool is filled ahead
+        of time (default 1)
+    CONCEPTNET_DB_POOL_MAX - the most connections to open at once (default 8)
+    CONCEPTNET_DB_POOL_TIMEOUT - seconds to wait for a free connection before
+        giving up (default 10)
+    CONCEPTNET_DB_POOL_CHECK_INTERVAL - connections that have been idle for
+        longer than this many seconds are checked with a trivial query before
+        they are handed out again (default 30)
+
+Instead of PostgreSQL, edges can be read from an embedded, read-only store of
+memory-mapped files, built with `cn5-db build_embedded`:
+
+    CONCEPTNET_DB_BACKEND - "postgres" (the default) or "embedded"
+    CONCEPTNET_EMBEDDED_DB - the directory containing the embedded store
+        (default "embedded" in the ConceptNet data directory)
 """
 import os
 
@@ -17,3 +36,13 @@ DB_USERNAME = os.environ.get('CONCEPTNET_DB_USER', os.environ.get('USER', 'postg
 DB_PASSWORD = os.environ.get('CONCEPTNET_DB_PASSWORD', '')
 DB_HOSTNAME = os.environ.get('CONCEPTNET_DB_HOSTNAME', 'localhost')
 DB_PORT = int(os.environ.get('CONCEPTNET_DB_PORT', '5432'))
+
+DB_POOL_MIN = int(os.environ.get('CONCEPTNET_DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('CONCEPTNET_DB_POOL_MAX', '8'))
+DB_POOL_TIMEOUT = float(os.environ.get('CONCEPTNET_DB_POOL_TIMEOUT', '10'))
+DB_POOL_CHECK_INTERVAL = float(
+    os.environ.get('CONCEPTNET_DB_POOL_CHECK_INTERVAL', '30')
+)
+
+DB_BACKEND = os.environ.get('CONCEPTNET_DB_BACKEND', 'postgres')
+EMBEDDED_DB_DIR = os.environ.get('CONCEPTNET_EMBEDDED_DB', '')
@@ -1,8 +1,23 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
 
 from conceptnet5.db import config
 
 _CONNECTIONS = {}
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """
+    Raised when no database connection became available within the pool's
+    checkout timeout.
+    """
+    pass
 
 
 def get_db_connection(dbname=None):
@@ -10,6 +25,10 @@ def get_db_connection(dbname=None):
     Get a global connection to the ConceptNet PostgreSQL database.
 
     `dbname` specifies the name of the database in PostgreSQL.
+
+    This single shared connection is meant for scripts such as the build
+    steps. Code that answers concurrent requests should borrow connections
+    from `get_db_pool` instead.
     """
     if dbname is None:
         dbname = config.DB_NAME
@@ -20,6 +39,17 @@ def get_db_connection(dbname=None):
         return _CONNECTIONS[dbname]
 
 
+def open_db_connection(dbname=None):
+    """
+    Open a new connection to the ConceptNet PostgreSQL database that isn't
+    shared with anything else, for build steps that work on several
+    connections at once.
+    """
+    if dbname is None:
+        dbname = config.DB_NAME
+    return _get_db_connection_inner(dbname)
+
+
 def _get_db_connection_inner(dbname):
     if config.DB_PASSWORD:
         conn = psycopg2.connect(
@@ -37,6 +67,201 @@ def _get_db_connection_inner(dbname):
     return conn
 
 
+def get_db_pool(dbname=None):
+    """
+    Get the global pool of connections to the ConceptNet PostgreSQL database
+    named `dbname`, creating it with the sizes and timeouts from
+    `conceptnet5.db.config` the first time it's asked for.
+    """
+    if dbname is None:
+        dbname = config.DB_NAME
+    with _POOLS_LOCK:
+        if dbname not in _POOLS:
+            _POOLS[dbname] = ConnectionPool(
+                dbname,
+                min_size=config.DB_POOL_MIN,
+                max_size=config.DB_POOL_MAX,
+                timeout=config.DB_POOL_TIMEOUT,
+                check_interval=config.DB_POOL_CHECK_INTERVAL,
+            )
+        return _POOLS[dbname]
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of connections to one PostgreSQL database.
+
+    Threads borrow a connection with `getconn()` (or, preferably, the
+    `connection()` context manager) and give it back with `putconn()`. At most
+    `max_size` connections are open at once; a thread that asks for one when
+    they're all in use waits up to `timeout` seconds, then gets a
+    `PoolTimeout`.
+
+    Connections that come back closed, or that are returned with
+    `discard=True` because they failed mid-query, are thrown away, and a new
+    connection is opened the next time one is needed. Connections that have
+    sat idle for more than `check_interval` seconds are tested with `SELECT 1`
+    before being handed out, so that a database restart doesn't surface as an
+    error on the next request.
+
+    `connect` is the function that opens a new connection given a database
+    name. It can be replaced for testing.
+    """
+
+    def __init__(
+        self,
+        dbname,
+        min_size=1,
+        max_size=8,
+        timeout=10.,
+        check_interval=30.,
+        connect=_get_db_connection_inner,
+    ):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(
+                "Invalid pool size: min_size=%r, max_size=%r" % (min_size, max_size)
+            )
+        self.dbname = dbname
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._connect = connect
+
+        # `_idle` holds (connection, time it was returned) pairs, most
+        # recently returned last. `_n_open` counts every open connection,
+        # whether it's idle or borrowed.
+        self._idle = deque()
+        self._n_open = 0
+        self._cond = threading.Condition()
+
+    def fill(self):
+        """
+        Open connections until at least `min_size` of them exist.
+        """
+        with self._cond:
+            while self._n_open < self.min_size:
+                self._idle.append((self._connect(self.dbname), time.monotonic()))
+                self._n_open += 1
+            self._cond.notify_all()
+
+    def getconn(self):
+        """
+        Borrow a working connection, opening one if there's room in the pool,
+        or waiting for another thread to return one.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._n_open >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            "No connection to %r became available within %s "
+                            "seconds" % (self.dbname, self.timeout)
+                        )
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    # Reserve our spot in the pool before connecting, so
+                    # that we don't hold the lock while waiting on the
+                    # network
+                    conn, idle_since = None, None
+                    self._n_open += 1
+
+            if conn is None:
+                try:
+                    return self._connect(self.dbname)
+                except Exception:
+                    self._forget()
+                    raise
+
+            if self._is_healthy(conn, idle_since):
+                return conn
+            self._close(conn)
+
+    def putconn(self, conn, discard=False):
+        """
+        Give a borrowed connection back to the pool. If `discard` is True, or
+        the connection has been closed, it's closed and forgotten instead of
+        being reused.
+        """
+        if discard or conn.closed:
+            self._close(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a `with` block. If the block
+        raises a database-level error (such as the server going away), the
+        connection is discarded rather than returned to the pool.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.putconn(conn, discard=True)
+            raise
+        except Exception:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        """
+        Close all the idle connections. Connections that are currently
+        borrowed will be closed when they're returned.
+        """
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._n_open -= 1
+                _close_quietly(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Report how many connections are open and how many of those are idle.
+        """
+        with self._cond:
+            return {'open': self._n_open, 'idle': len(self._idle)}
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _close(self, conn):
+        _close_quietly(conn)
+        self._forget()
+
+    def _forget(self):
+        with self._cond:
+            self._n_open -= 1
+            self._cond.notify()
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
 def check_db_connection(dbname=None):
     """
     Raise an error early if we can't access the database. This is intended
@@ -0,0 +1,369 @@
+"""
+Update a loaded ConceptNet database to match a new build of the assertions,
+changing only the rows that differ, so that a small fix to the data doesn't
+mean reloading everything.
+
+The new assertions are compared to the loaded edges by their URIs. An edge
+whose data changed is removed and inserted again with a new ID, like an edge
+that's new. This all happens in one transaction, so the API can keep serving
+the old data until it's committed. The transaction also records a new build
+version, so that cached responses are dropped as soon as the data changes.
+"""
+import os
+import time
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from conceptnet5.db.prepare_data import (
+    EDGE_TABLES,
+    TABLE_FILENAMES,
+    AssertionTables,
+    ChunkReader,
+    edge_json,
+    renumber_shard,
+    sanitize,
+)
+from conceptnet5.db.schema import (
+    DELTA_INDICES,
+    EDGE_SAMPLE_SIZE,
+    EDGE_SAMPLE_TABLE,
+    SAMPLE_EDGES,
+    record_build_version,
+)
+from conceptnet5.formats.msgpack_stream import read_msgpack_stream
+from conceptnet5.relations import SYMMETRIC_RELATIONS
+
+STAGE_EDGES = """
+CREATE TEMPORARY TABLE delta_edges (
+    uri   text NOT NULL PRIMARY KEY,
+    data  jsonb NOT NULL
+) ON COMMIT DROP
+"""
+
+# Loaded edges that aren't in the new assertions, or whose data changed
+REMOVED_EDGES_QUERY = """
+SELECT e.id, e.uri FROM edges e LEFT JOIN delta_edges d ON d.uri = e.uri
+WHERE d.data IS DISTINCT FROM e.data
+"""
+
+# New assertions that aren't loaded, or whose data changed
+ADDED_EDGES_QUERY = """
+SELECT d.uri FROM delta_edges d LEFT JOIN edges e ON e.uri = d.uri
+WHERE e.data IS DISTINCT FROM d.data
+"""
+
+# The nodes that the removed edges refer to, which may no longer be needed
+REMOVED_NODES_QUERY = """
+SELECT start_id FROM edges WHERE id = ANY(%(ids)s::integer[])
+UNION SELECT end_id FROM edges WHERE id = ANY(%(ids)s::integer[])
+UNION SELECT node_id FROM edge_features WHERE edge_id = ANY(%(ids)s::integer[])
+"""
+
+REMOVED_PREFIXES_QUERY = """
+SELECT prefix_id, count(*) FROM edge_prefixes
+WHERE edge_id = ANY(%(ids)s::integer[]) GROUP BY prefix_id
+"""
+
+DELETE_EDGES = [
+    "DELETE FROM edge_sample WHERE edge_id = ANY(%(ids)s::integer[])",
+    "DELETE FROM edges_gin WHERE edge_id = ANY(%(ids)s::integer[])",
+    "DELETE FROM edge_features WHERE edge_id = ANY(%(ids)s::integer[])",
+    "DELETE FROM edge_prefixes WHERE edge_id = ANY(%(ids)s::integer[])",
+    "DELETE FROM edges WHERE id = ANY(%(ids)s::integer[])",
+]
+
+DELETE_UNUSED_NODES = """
+DELETE FROM nodes n WHERE n.id = ANY(%(ids)s::integer[])
+AND NOT EXISTS (SELECT 1 FROM edges WHERE start_id = n.id)
+AND NOT EXISTS (SELECT 1 FROM edges WHERE end_id = n.id)
+AND NOT EXISTS (SELECT 1 FROM edge_features WHERE node_id = n.id)
+"""
+
+# Add a sample of the new edges, taken at the same rate as the loaded ones, to
+# the end of `edge_sample` in a random order
+APPEND_EDGE_SAMPLE = """
+INSERT INTO edge_sample (id, edge_id)
+SELECT
+    (SELECT coalesce(max(id), -1) FROM edge_sample) + row_number() OVER (ORDER BY random()),
+    id
+FROM edges WHERE id >= %(first_id)s AND random() < %(rate)s
+"""
+
+# Number the rows of `edge_sample` from 0 again, in the same order, after
+# removed edges have left gaps. `random_edges` picks a start ID uniformly up
+# to the largest ID, so gaps would make it favor the edges after them. The
+# rows go through negative IDs first, so that no two rows ever share an ID.
+RENUMBER_EDGE_SAMPLE = [
+    """
+    UPDATE edge_sample s SET id = -numbered.position
+    FROM (
+        SELECT id, row_number() OVER (ORDER BY id) AS position FROM edge_sample
+    ) numbered
+    WHERE s.id = numbered.id
+    """,
+    "UPDATE edge_sample SET id = -id - 1",
+]
+
+REFRESH_RANKED_FEATURES = 'REFRESH MATERIALIZED VIEW CONCURRENTLY ranked_features'
+
+# How many times to try refreshing `ranked_features` after the edges change
+REFRESH_ATTEMPTS = 3
+
+UPDATE_PREFIX_COUNTS = """
+UPDATE prefixes p SET edge_count = p.edge_count + v.change
+FROM (VALUES %s) AS v (id, change) WHERE p.id = v.id
+"""
+
+
+def assign_ids(values, existing_ids, next_id):
+    """
+    Find the database IDs of a list of values, given a dictionary of the ones
+    that are already in the database. The others are given new IDs starting
+    from `next_id`.
+
+    Returns an array of the IDs, in the same order as `values`, and a list of
+    (id, value) pairs for the values that need to be inserted.
+
+    >>> ids, new_rows = assign_ids(['a', 'b', 'c'], {'b': 5}, 10)
+    >>> ids.tolist()
+    [10, 5, 11]
+    >>> new_rows
+    [(10, 'a'), (11, 'c')]
+    """
+    ids = np.zeros(len(values), dtype=np.int64)
+    new_rows = []
+    for i, value in enumerate(values):
+        if value in existing_ids:
+            ids[i] = existing_ids[value]
+        else:
+            ids[i] = next_id
+            new_rows.append((next_id, value))
+            next_id += 1
+    return ids, new_rows
+
+
+def _next_id(cursor, table):
+    cursor.execute("SELECT coalesce(max(id), -1) + 1 FROM {}".format(table))
+    return cursor.fetchone()[0]
+
+
+def _existing_ids(cursor, table, uris):
+    cursor.execute(
+        "SELECT uri, id FROM {} WHERE uri = ANY(%(uris)s::text[])".format(table),
+        {'uris': list(uris)},
+    )
+    return dict(cursor.fetchall())
+
+
+def _lookup_or_insert(cursor, table, uris):
+    """
+    Get the IDs of the given URIs in a table of unique IDs, inserting the
+    ones it doesn't have yet. Returns the array of IDs and the new rows.
+    """
+    uris = list(uris)
+    return assign_ids(uris, _existing_ids(cursor, table, uris), _next_id(cursor, table))
+
+
+def _stage_assertions(cursor, msgpack_filename):
+    lines = (
+        '{}\t{}\n'.format(
+            sanitize(assertion['uri']), sanitize(edge_json(assertion))
+        ).encode('utf-8')
+        for assertion in read_msgpack_stream(msgpack_filename)
+    )
+    cursor.execute(STAGE_EDGES)
+    cursor.copy_expert('COPY delta_edges (uri, data) FROM STDIN', ChunkReader(lines))
+    cursor.execute('ANALYZE delta_edges')
+
+
+def _remove_edges(cursor, edge_ids):
+    """
+    Delete edges and the rows that refer to them. Returns the IDs of the
+    nodes they referred to, and how much the edge count of each prefix
+    changed.
+    """
+    params = {'ids': edge_ids}
+    cursor.execute(REMOVED_NODES_QUERY, params)
+    node_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute(REMOVED_PREFIXES_QUERY, params)
+    prefix_changes = {prefix_id: -count for (prefix_id, count) in cursor.fetchall()}
+    for cmd in DELETE_EDGES:
+        cursor.execute(cmd, params)
+    return node_ids, prefix_changes
+
+
+def _add_edges(cursor, msgpack_filename, uris, prefix_changes):
+    """
+    Insert the assertions from `msgpack_filename` whose URIs are in `uris`,
+    adding the nodes, relations, sources, and prefixes they need, and
+    counting their prefixes in `prefix_changes`. Returns the ID of the first
+    edge that was inserted.
+
+    The rows are written with `AssertionTables`, like a shard of
+    `sharded_assertions_to_sql_csv`, then renumbered with database IDs.
+    """
+    with TemporaryDirectory(prefix='conceptnet-delta') as tmpdir:
+        tables = AssertionTables()
+        tables.write_edge_rows(
+            (
+                assertion for assertion in read_msgpack_stream(msgpack_filename)
+                if assertion['uri'] in uris
+            ),
+            tmpdir,
+        )
+
+        node_ids, new_nodes = _lookup_or_insert(cursor, 'nodes', tables.node_list)
+        execute_values(cursor, "INSERT INTO nodes (id, uri) VALUES %s", new_nodes)
+        _source_ids, new_sources = _lookup_or_insert(cursor, 'sources', tables.source_list)
+        execute_values(cursor, "INSERT INTO sources (id, uri) VALUES %s", new_sources)
+        rel_ids, new_rels = _lookup_or_insert(cursor, 'relations', tables.relation_list)
+        execute_values(
+            cursor,
+            "INSERT INTO relations (id, uri, directed) VALUES %s",
+            [(rel_id, rel, rel not in SYMMETRIC_RELATIONS) for (rel_id, rel) in new_rels],
+        )
+        prefix_ids, new_prefixes = _lookup_or_insert(cursor, 'prefixes', tables.prefix_list)
+        execute_values(
+            cursor,
+            "INSERT INTO prefixes (id, uri, edge_count) VALUES %s",
+            [(prefix_id, prefix, 0) for (prefix_id, prefix) in new_prefixes],
+        )
+        for prefix_id, count in zip(prefix_ids.tolist(), tables.prefix_counts):
+            prefix_changes[prefix_id] = prefix_changes.get(prefix_id, 0) + count
+
+        id_map = {
+            'offset': _next_id(cursor, 'edges'),
+            'relations': rel_ids,
+            'nodes': node_ids,
+            'prefixes': prefix_ids,
+        }
+        renumber_shard((tmpdir, id_map))
+        for table in EDGE_TABLES:
+            filename = os.path.join(tmpdir, TABLE_FILENAMES[table]) + '.renumbered'
+            with open(filename, 'rb') as file:
+                cursor.copy_from(file, table)
+    return id_map['offset']
+
+
+def sample_rate(n_edges, sample_size=EDGE_SAMPLE_SIZE):
+    """
+    Get the fraction of edges that are in `edge_sample`, when it holds
+    `sample_size` edges out of `n_edges`, so that new edges can be sampled
+    at the same rate and every edge stays equally likely to be chosen.
+
+    >>> sample_rate(34000000, 1000000)
+    0.029411764705882353
+    >>> sample_rate(500, 1000000)
+    1.0
+    """
+    if n_edges <= sample_size:
+        return 1.0
+    return sample_size / n_edges
+
+
+def _update_edge_sample(cursor, first_id):
+    """
+    Add a sample of the edges numbered from `first_id` on, if any were
+    inserted, to `edge_sample`, and renumber it if removed edges left gaps
+    in its IDs. Fill it instead if it's empty because the database was
+    loaded without it.
+    """
+    cursor.execute('SELECT EXISTS (SELECT 1 FROM edge_sample)')
+    if cursor.fetchone()[0]:
+        if first_id is not None:
+            cursor.execute('SELECT count(*) FROM edges')
+            rate = sample_rate(cursor.fetchone()[0])
+            cursor.execute(APPEND_EDGE_SAMPLE, {'first_id': first_id, 'rate': rate})
+        cursor.execute('SELECT count(*), coalesce(max(id), -1) + 1 FROM edge_sample')
+        n_rows, n_ids = cursor.fetchone()
+        if n_rows != n_ids:
+            for cmd in RENUMBER_EDGE_SAMPLE:
+                cursor.execute(cmd)
+    else:
+        cursor.execute(SAMPLE_EDGES, {'size': EDGE_SAMPLE_SIZE})
+
+
+def refresh_ranked_features(connection, attempts=REFRESH_ATTEMPTS):
+    """
+    Refresh the `ranked_features` view, trying again, after a pause, if it
+    fails. Raises a RuntimeError if every attempt fails, because the view
+    then refers to edges that no longer exist.
+    """
+    for attempt in range(attempts):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(REFRESH_RANKED_FEATURES)
+            connection.commit()
+            return
+        except psycopg2.Error as err:
+            connection.rollback()
+            if attempt == attempts - 1:
+                raise RuntimeError(
+                    "The edges were updated, but ranked_features could not be "
+                    "refreshed. Run 'REFRESH MATERIALIZED VIEW ranked_features' "
+                    "to bring it up to date."
+                ) from err
+            time.sleep(2 ** attempt)
+
+
+def apply_delta(connection, msgpack_filename):
+    """
+    Change the edges in the database to match the assertions in
+    `msgpack_filename`, updating the tables that refer to them, then refresh
+    `ranked_features`.
+
+    A new build version is recorded along with the changed edges, and again
+    once `ranked_features` is refreshed, so that responses computed from the
+    view while it was out of date aren't cached.
+
+    Returns a dictionary counting the edges that were added, changed, and
+    removed.
+    """
+    autocommit = connection.autocommit
+    connection.autocommit = False
+    try:
+        with connection.cursor() as cursor:
+            # Keep two updates from running at once, without blocking reads
+            cursor.execute('LOCK TABLE edges IN SHARE ROW EXCLUSIVE MODE')
+            cursor.execute(EDGE_SAMPLE_TABLE)
+            for cmd in DELTA_INDICES:
+                cursor.execute(cmd)
+            _stage_assertions(cursor, msgpack_filename)
+
+            cursor.execute(REMOVED_EDGES_QUERY)
+            removed = dict(cursor.fetchall())
+            cursor.execute(ADDED_EDGES_QUERY)
+            added_uris = {row[0] for row in cursor.fetchall()}
+
+            first_id = None
+            if removed or added_uris:
+                node_ids, prefix_changes = _remove_edges(cursor, list(removed))
+                first_id = _add_edges(cursor, msgpack_filename, added_uris, prefix_changes)
+                execute_values(
+                    cursor,
+                    UPDATE_PREFIX_COUNTS,
+                    [item for item in prefix_changes.items() if item[1] != 0],
+                )
+                cursor.execute(DELETE_UNUSED_NODES, {'ids': node_ids})
+                record_build_version(connection, commit=False)
+            _update_edge_sample(cursor, first_id)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.autocommit = autocommit
+
+    if removed or added_uris:
+        refresh_ranked_features(connection)
+        record_build_version(connection)
+
+    changed = added_uris.intersection(removed.values())
+    return {
+        'added': len(added_uris) - len(changed),
+        'changed': len(changed),
+        'removed': len(removed) - len(changed),
+    }
@@ -0,0 +1,491 @@
+"""
+An embedded, read-only store of ConceptNet edges, which can answer the same
+queries as the PostgreSQL database without a database server.
+
+The store is a directory of files that are built from `assertions.msgpack`
+by `build_embedded_store`, and memory-mapped by `EmbeddedAssertionFinder`:
+
+- `edges.jsonl`: the JSON data of each edge, in the Linked Data form that the
+  API returns, one per line
+- `edge_offsets.npy`: the (start, end) byte offsets of each edge's line
+- `edge_weights.npy`: the weight of each edge
+- `edge_rels.npy`: the prefix ID of each edge's relation
+- `edge_uris.marisa`: a trie of assertion URIs
+- `edge_uri_rows.npy`: the edge number for each key ID in `edge_uris.marisa`
+- `prefixes.marisa`: a trie of the URI prefixes that edges can be queried by,
+  whose key IDs are the prefix IDs
+- `prefix_offsets.npy`, `prefix_edges.npy`, `prefix_slots.npy`: the edges
+  that have each prefix, in compressed sparse row form. The edges with prefix
+  ID `i` are `prefix_edges[prefix_offsets[i]:prefix_offsets[i + 1]]`, and
+  `prefix_slots` says which slot of the edge the prefix is in, using the same
+  codes as the `edge_prefixes` table.
+- `build_version.txt`: an identifier for this build of the store, like the
+  one that `cn5-db load_data` records in the database
+
+Edges are numbered in order of descending weight, with ties broken by their
+order in the input, which is the order the database returns them in. So the
+edges for each prefix are sorted by weight just by being sorted by number,
+and they can be intersected with binary search.
+"""
+import json
+import mmap
+import os
+import threading
+from array import array
+
+import marisa_trie
+import numpy as np
+
+from conceptnet5.db.config import EMBEDDED_DB_DIR
+from conceptnet5.db.prepare_data import edge_json, gin_indexable_edge, prefix_slots
+from conceptnet5.db.query import (
+    END_SLOTS,
+    START_SLOTS,
+    AssertionFinder,
+    criteria_prefixes,
+    decode_page_token,
+    gin_jsonb_value,
+    group_by_feature,
+)
+from conceptnet5.db.schema import SLOT_END, SLOT_START, new_build_version
+from conceptnet5.edges import transform_for_linked_data
+from conceptnet5.formats.msgpack_stream import read_msgpack_stream
+from conceptnet5.relations import SYMMETRIC_RELATIONS
+from conceptnet5.uri import uri_prefixes
+from conceptnet5.util import get_data_filename
+from ftfy.fixes import remove_control_chars
+
+# How many candidate edges to check against the other criteria of a query
+# at a time
+CHUNK_SIZE = 4096
+
+
+def build_embedded_store(msgpack_filename, output_dir):
+    """
+    Read the list of assertions from `msgpack_filename`, and write the files
+    of an embedded edge store to `output_dir`.
+
+    This makes two passes over the assertions: the first writes the edge data
+    and collects their URIs, weights, and prefixes, and the second, once we
+    know the ID of every prefix and the rank of every edge, lists the edges
+    for each prefix.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    def output_path(name):
+        return os.path.join(output_dir, name)
+
+    uris = []
+    weights = []
+    offsets = []
+    prefixes = set()
+    with open(output_path('edges.jsonl'), 'wb') as edge_file:
+        position = 0
+        for assertion in read_msgpack_stream(msgpack_filename):
+            line = edge_json(assertion)
+            line_bytes = line.encode('utf-8') + b'\n'
+            edge_file.write(line_bytes)
+            offsets.append((position, position + len(line_bytes) - 1))
+            position += len(line_bytes)
+
+            uris.append(assertion['uri'])
+            weights.append(assertion['weight'])
+            prefixes.update(
+                prefix for prefix, _slot in prefix_slots(gin_indexable_edge(assertion))
+            )
+
+    uri_trie = marisa_trie.Trie(uris)
+    if len(uri_trie) < len(uris):
+        raise ValueError("Duplicate assertions in %r" % msgpack_filename)
+    prefix_trie = marisa_trie.Trie(prefixes)
+    uri_trie.save(output_path('edge_uris.marisa'))
+    prefix_trie.save(output_path('prefixes.marisa'))
+
+    # Number the edges by descending weight, using the same precision that
+    # the database stores weights with. The sort is stable, so ties stay in
+    # input order.
+    n_edges = len(uris)
+    weight_array = np.array(weights, dtype=np.float32).reshape(n_edges)
+    order = np.argsort(-weight_array, kind='stable')
+    edge_rows = np.empty(n_edges, dtype=np.int64)
+    edge_rows[order] = np.arange(n_edges)
+    np.save(output_path('edge_weights.npy'), weight_array[order])
+    offset_array = np.array(offsets, dtype=np.int64).reshape(n_edges, 2)
+    np.save(output_path('edge_offsets.npy'), offset_array[order])
+    uri_rows = np.empty(n_edges, dtype=np.int32)
+    for input_idx, uri in enumerate(uris):
+        uri_rows[uri_trie[uri]] = edge_rows[input_idx]
+    np.save(output_path('edge_uri_rows.npy'), uri_rows)
+    del uris, weights, offsets, prefixes
+
+    # Pack each (prefix ID, edge number, slot) triple into one integer, so
+    # that sorting the integers sorts the triples
+    packed = array('q')
+    edge_rels = np.empty(n_edges, dtype=np.int32)
+    for input_idx, assertion in enumerate(read_msgpack_stream(msgpack_filename)):
+        row = int(edge_rows[input_idx])
+        edge_rels[row] = prefix_trie[assertion['rel']]
+        for prefix, slot in prefix_slots(gin_indexable_edge(assertion)):
+            packed.append((prefix_trie[prefix] << 34) | (row << 2) | slot)
+    np.save(output_path('edge_rels.npy'), edge_rels)
+
+    packed_array = np.sort(np.frombuffer(packed, dtype=np.int64))
+    prefix_ids = packed_array >> 34
+    counts = np.bincount(prefix_ids, minlength=len(prefix_trie))
+    prefix_offsets = np.zeros(len(prefix_trie) + 1, dtype=np.int64)
+    np.cumsum(counts, out=prefix_offsets[1:])
+    np.save(output_path('prefix_offsets.npy'), prefix_offsets)
+    np.save(
+        output_path('prefix_edges.npy'),
+        ((packed_array >> 2) & 0xFFFFFFFF).astype(np.int32),
+    )
+    np.save(output_path('prefix_slots.npy'), (packed_array & 3).astype(np.int8))
+
+    with open(output_path('build_version.txt'), 'w', encoding='utf-8') as out:
+        print(new_build_version(), file=out)
+
+
+class EmbeddedAssertionFinder(AssertionFinder):
+    """
+    An AssertionFinder that reads edges from an embedded store built by
+    `build_embedded_store`, instead of from PostgreSQL.
+
+    The files are memory-mapped the first time they're needed, so that
+    processes can share them through the operating system's page cache.
+    """
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path or EMBEDDED_DB_DIR or get_data_filename('embedded')
+        self._load_lock = threading.Lock()
+        self._loaded = False
+
+    def load(self):
+        """
+        Memory-map the files of the store, if they aren't mapped already.
+        """
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+
+            def load_array(name):
+                return np.load(os.path.join(self.path, name), mmap_mode='r')
+
+            self.edge_offsets = load_array('edge_offsets.npy')
+            self.edge_weights = load_array('edge_weights.npy')
+            self.edge_rels = load_array('edge_rels.npy')
+            self.edge_uri_rows = load_array('edge_uri_rows.npy')
+            self.prefix_offsets = load_array('prefix_offsets.npy')
+            self.prefix_edges = load_array('prefix_edges.npy')
+            self.prefix_slots = load_array('prefix_slots.npy')
+            self.edge_uris = marisa_trie.Trie()
+            self.edge_uris.mmap(os.path.join(self.path, 'edge_uris.marisa'))
+            self.prefixes = marisa_trie.Trie()
+            self.prefixes.mmap(os.path.join(self.path, 'prefixes.marisa'))
+
+            # An empty file can't be memory-mapped, but it also has no edges
+            with open(os.path.join(self.path, 'edges.jsonl'), 'rb') as edge_file:
+                if os.fstat(edge_file.fileno()).st_size:
+                    self.edge_data = mmap.mmap(
+                        edge_file.fileno(), 0, access=mmap.ACCESS_READ
+                    )
+                else:
+                    self.edge_data = b''
+
+            version_path = os.path.join(self.path, 'build_version.txt')
+            if os.path.exists(version_path):
+                with open(version_path, encoding='utf-8') as version_file:
+                    self._build_version = version_file.read().strip()
+            else:
+                self._build_version = None
+
+            self.symmetric_rels = np.zeros(len(self.prefixes), dtype=bool)
+            for rel in SYMMETRIC_RELATIONS:
+                rel_id = self.prefixes.get(rel)
+                if rel_id is not None:
+                    self.symmetric_rels[rel_id] = True
+            self._loaded = True
+
+    def build_version(self):
+        """
+        Get the identifier of the build of the store that's loaded. A new
+        build is only seen after the process restarts.
+        """
+        self.load()
+        return self._build_version
+
+    def connect(self):
+        """
+        Map the store's files now, instead of when the first query arrives.
+        """
+        self.load()
+
+    def disconnect(self):
+        # Memory-mapped files can be shared by forked processes, so there's
+        # nothing to close
+        pass
+
+    def _edge_row(self, edge_num):
+        """
+        Get the (id, uri, data, weight) row for an edge, in the same form as
+        the rows that `AssertionFinder` gets from the database.
+        """
+        start, end = self.edge_offsets[edge_num]
+        data = json.loads(self.edge_data[start:end].decode('utf-8'))
+        return int(edge_num), data['@id'], data, float(self.edge_weights[edge_num])
+
+    def _prefix_range(self, uri):
+        """
+        Get the slice of `prefix_edges` that lists the edges with the prefix
+        `uri`, or None if no edges have that prefix.
+        """
+        prefix_id = self.prefixes.get(uri)
+        if prefix_id is None:
+            return None
+        return slice(
+            int(self.prefix_offsets[prefix_id]), int(self.prefix_offsets[prefix_id + 1])
+        )
+
+    def _prefix_edges(self, span, slots):
+        """
+        Get the edge numbers in a range of `prefix_edges`, keeping only the
+        ones where the prefix is in one of the given `slots`, unless `slots`
+        is None.
+        """
+        edges = self.prefix_edges[span]
+        if slots is not None:
+            edges = edges[np.isin(self.prefix_slots[span], slots)]
+        return edges
+
+    def _has_prefix(self, edge_nums, span, slots):
+        """
+        Check which of the sorted array of `edge_nums` appear in a range of
+        `prefix_edges`, in one of the given `slots`. Returns a boolean mask.
+        """
+        edges = self.prefix_edges[span]
+        if len(edges) == 0:
+            return np.zeros(len(edge_nums), dtype=bool)
+        positions = np.minimum(np.searchsorted(edges, edge_nums), len(edges) - 1)
+        mask = edges[positions] == edge_nums
+        if slots is not None:
+            mask &= np.isin(self.prefix_slots[span][positions], slots)
+        return mask
+
+    def _matches_gin_query(self, edge_nums, gin_query):
+        """
+        Check which edges match a query in the form that `gin_jsonb_value`
+        produces, the way the JSONB @> operator would on the `edges_gin`
+        table.
+        """
+        mask = np.ones(len(edge_nums), dtype=bool)
+        for key, (uri,) in gin_query.items():
+            span = self._prefix_range(uri)
+            if span is None:
+                return np.zeros(len(edge_nums), dtype=bool)
+            if key == 'start':
+                slots = START_SLOTS
+            elif key == 'end':
+                slots = END_SLOTS
+            else:
+                slots = None
+            mask &= self._has_prefix(edge_nums, span, slots)
+        return mask
+
+    def _query_rows(self, criteria, limit, offset, after):
+        """
+        Find the edges that match the given criteria, returning rows of
+        (id, uri, data, weight) in the same order as the database would.
+        """
+        self.load()
+        first_edge = 0
+        if after is not None:
+            first_edge = decode_page_token(after)[1] + 1
+            offset = 0
+
+        # Take chunks of matches until we have enough
+        needed = offset + limit
+        found = []
+        n_found = 0
+        for chunk in self._matching_edges(criteria, first_edge):
+            if n_found >= needed:
+                break
+            found.append(chunk)
+            n_found += len(chunk)
+        if not found:
+            return []
+        matches = np.concatenate(found)[offset:needed]
+        return [self._edge_row(edge_num) for edge_num in matches]
+
+    def _matching_edges(self, criteria, first_edge=0):
+        """
+        Iterate over the numbers of the edges that match the given criteria,
+        starting from `first_edge`, in order. They come in arrays of the
+        matches among up to CHUNK_SIZE candidates at a time.
+        """
+        criteria = {key: remove_control_chars(value) for (key, value) in criteria.items()}
+        prefixes = criteria_prefixes(criteria)
+        if not prefixes:
+            n_edges = len(self.edge_weights)
+            for chunk_start in range(first_edge, n_edges, CHUNK_SIZE):
+                yield np.arange(chunk_start, min(chunk_start + CHUNK_SIZE, n_edges))
+            return
+
+        spans = {}
+        for uri, _slots in prefixes:
+            span = self._prefix_range(uri)
+            if span is None:
+                return
+            spans[uri] = span
+
+        # Scan by the prefix that appears on the fewest edges
+        scan_uri, scan_slots = min(
+            prefixes, key=lambda pair: spans[pair[0]].stop - spans[pair[0]].start
+        )
+        candidates = self._prefix_edges(spans[scan_uri], scan_slots)
+        candidates = candidates[np.searchsorted(candidates, first_edge):]
+
+        # If there are other criteria, check them the way the database checks
+        # them on the GIN form of the edge
+        gin_queries = []
+        if len(prefixes) > 1:
+            if 'node' in criteria:
+                gin_queries = [
+                    gin_jsonb_value(criteria, node_forward=True),
+                    gin_jsonb_value(criteria, node_forward=False),
+                ]
+            else:
+                gin_queries = [gin_jsonb_value(criteria)]
+
+        for chunk_start in range(0, len(candidates), CHUNK_SIZE):
+            chunk = np.asarray(candidates[chunk_start:chunk_start + CHUNK_SIZE])
+            if gin_queries:
+                mask = np.zeros(len(chunk), dtype=bool)
+                for gin_query in gin_queries:
+                    mask |= self._matches_gin_query(chunk, gin_query)
+                chunk = chunk[mask]
+            yield chunk
+
+    def iter_query(self, criteria, batch_size=None):
+        """
+        Iterate over every edge that matches the criteria, in the same order
+        as `query`, with no limit. Edges are read from the store as they're
+        needed, so `batch_size` doesn't apply.
+        """
+        self.load()
+        for chunk in self._matching_edges(criteria):
+            for edge_num in chunk:
+                yield transform_for_linked_data(self._edge_row(edge_num)[2])
+
+    def _feature_rows(self, uri, limit):
+        """
+        Get the (direction, relation, edge data) rows of the top edges for
+        each feature of the node `uri`, in the order that
+        NODE_TO_FEATURE_QUERY would return them.
+        """
+        # Features are only indexed for nodes with at least three pieces
+        if uri not in uri_prefixes(uri, min_pieces=3):
+            return []
+        span = self._prefix_range(uri)
+        if span is None:
+            return []
+        edges = np.asarray(self.prefix_edges[span])
+        slots = np.asarray(self.prefix_slots[span])
+        rels = np.asarray(self.edge_rels[edges])
+        symmetric = self.symmetric_rels[rels]
+
+        # An edge has a forward feature if the node is its start, and a
+        # backward feature if the node is its end. If its relation is
+        # symmetric, both of these have direction 0.
+        is_start = (slots & SLOT_START) != 0
+        is_end = (slots & SLOT_END) != 0
+        directions = np.concatenate(
+            [
+                np.where(symmetric[is_start], 0, 1),
+                np.where(symmetric[is_end], 0, -1),
+            ]
+        )
+        feature_rels = np.concatenate([rels[is_start], rels[is_end]])
+        feature_edges = np.concatenate([edges[is_start], edges[is_end]])
+        if len(feature_edges) == 0:
+            return []
+
+        # Sort by feature, then by edge number, and keep the first `limit`
+        # edges of each feature
+        order = np.lexsort((feature_edges, feature_rels, directions))
+        directions = directions[order]
+        feature_rels = feature_rels[order]
+        feature_edges = feature_edges[order]
+        new_feature = np.ones(len(order), dtype=bool)
+        new_feature[1:] = (directions[1:] != directions[:-1]) | (
+            feature_rels[1:] != feature_rels[:-1]
+        )
+        feature_starts = np.flatnonzero(new_feature)
+        feature_sizes = np.diff(np.append(feature_starts, len(order)))
+        ranks = np.arange(len(order)) - np.repeat(feature_starts, feature_sizes)
+        keep = ranks < limit
+
+        rows = []
+        for direction, rel_id, edge_num in zip(
+            directions[keep], feature_rels[keep], feature_edges[keep]
+        ):
+            rel = self.prefixes.restore_key(int(rel_id))
+            rows.append((int(direction), rel, self._edge_row(edge_num)[2]))
+        return rows
+
+    def lookup_grouped_by_feature(self, uri, limit=20):
+        """
+        The query used by the browseable interface, which groups its results
+        by what 'feature' they describe of the queried node.
+        """
+        self.load()
+        uri = remove_control_chars(uri)
+        return group_by_feature(uri, self._feature_rows(uri, limit))
+
+    def lookup_grouped_by_feature_many(self, uris, limit=20):
+        """
+        Get the results of `lookup_grouped_by_feature` for many URIs.
+        """
+        return {uri: self.lookup_grouped_by_feature(uri, limit) for uri in uris}
+
+    def lookup_many(self, uris, limit=100):
+        """
+        Get the results of `lookup` for many URIs. Returns a dictionary from
+        each of the given URIs to a list of its edges.
+        """
+        for uri in uris:
+            if not uri.startswith('/a/'):
+                # Check that this is a URI we know how to look up
+                self._lookup_criteria(uri)
+        return {
+            uri: self.lookup(remove_control_chars(uri), limit=limit) for uri in uris
+        }
+
+    def lookup_assertion(self, uri):
+        """
+        Get a single assertion, given its URI starting with /a/.
+        """
+        self.load()
+        uri = remove_control_chars(uri)
+        key_id = self.edge_uris.get(uri)
+        if key_id is None:
+            return []
+        _id, _uri, data, _weight = self._edge_row(self.edge_uri_rows[key_id])
+        return [transform_for_linked_data(data)]
+
+    def random_edges(self, limit=20):
+        """
+        Get a collection of distinct, randomly-selected edges.
+        """
+        self.load()
+        n_edges = len(self.edge_weights)
+        # A Generator chooses distinct values in time proportional to
+        # `limit`, where np.random.choice would shuffle every edge number
+        edge_nums = np.random.default_rng().choice(
+            n_edges, min(limit, n_edges), replace=False
+        )
+        return [
+            transform_for_linked_data(self._edge_row(edge_num)[2])
+            for edge_num in edge_nums
+        ]
@@ -1,5 +1,17 @@
 import json
-
+import os
+import shutil
+import time
+from collections import OrderedDict
+from multiprocessing import Pool
+from tempfile import TemporaryDirectory
+
+import msgpack
+import numpy as np
+
+from conceptnet5.db.connection import open_db_connection
+from conceptnet5.db.schema import SLOT_END, SLOT_OTHER, SLOT_START
+from conceptnet5.edges import transform_for_linked_data
 from conceptnet5.formats.msgpack_stream import read_msgpack_stream
 from conceptnet5.relations import SYMMETRIC_RELATIONS
 from conceptnet5.uri import uri_prefixes
@@ -10,7 +22,7 @@ def write_row(outfile, items):
     """
     Write a tab-separated row to a file.
     """
-    print('\t'.join(sanitize(str(x)) for x in items), file=outfile)
+    outfile.write('\t'.join(sanitize(str(x)) for x in items) + '\n')
 
 
 def write_ordered_set(filename, oset):
@@ -37,6 +49,17 @@ def write_relations(filename, oset):
             print('%d\t%s\t%s' % (i, sanitize(rel), directed_str), file=outfile)
 
 
+def write_prefixes(filename, oset, edge_counts):
+    """
+    To create the `prefixes` table, we add a column to `write_ordered_set`
+    that counts the edges each prefix appears on. `AssertionFinder` uses
+    these counts to decide which criterion of a query to scan by.
+    """
+    with open(filename, 'w', encoding='utf-8') as outfile:
+        for i, prefix in enumerate(oset):
+            print('%d\t%s\t%d' % (i, sanitize(prefix), edge_counts[i]), file=outfile)
+
+
 def sanitize(text):
     """
     We're using a very simple approach to writing a CSV (which is actually
@@ -63,6 +86,24 @@ def sanitize(text):
     )
 
 
+def edge_json(assertion):
+    """
+    Get the JSON that's stored in the `data` column of the `edges` table for
+    an assertion. It's already in the Linked Data form that the API returns,
+    so that the API doesn't have to transform every edge it looks up, and it
+    leaves out the 'features' list, which the API doesn't return.
+
+    The assertion itself isn't modified.
+    """
+    edge = dict(assertion, sources=[dict(source) for source in assertion['sources']])
+    return json.dumps(
+        transform_for_linked_data(edge),
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+
+
 def gin_indexable_edge(edge):
     """
     Convert an edge into a dictionary that can be matched with the JSONB @>
@@ -96,7 +137,231 @@ def gin_indexable_edge(edge):
     return gin_edge
 
 
-def assertions_to_sql_csv(msgpack_filename, output_dir):
+def prefix_slots(gin_edge):
+    """
+    Get the URI prefixes that can be used to query for an edge, as a list of
+    (prefix, slot) pairs, given the prefix lists from `gin_indexable_edge`.
+
+    A prefix that appears in both the start and end nodes is listed once,
+    with both of their slot flags set:
+
+    >>> prefix_slots({
+    ...     'start': ['/c/en', '/c/en/dog'],
+    ...     'end': ['/c/en', '/c/en/bark'],
+    ...     'rel': ['/r/CapableOf'],
+    ...     'dataset': ['/d/conceptnet', '/d/conceptnet/4'],
+    ...     'sources': ['/s/contributor/omcs'],
+    ... })  # doctest: +NORMALIZE_WHITESPACE
+    [('/c/en', 3), ('/c/en/dog', 1), ('/c/en/bark', 2), ('/r/CapableOf', 0),
+     ('/d/conceptnet', 0), ('/d/conceptnet/4', 0), ('/s/contributor/omcs', 0)]
+    """
+    node_slots = OrderedDict()
+    for prefix in gin_edge['start']:
+        node_slots[prefix] = node_slots.get(prefix, 0) | SLOT_START
+    for prefix in gin_edge['end']:
+        node_slots[prefix] = node_slots.get(prefix, 0) | SLOT_END
+    slots = list(node_slots.items())
+    for key in ('rel', 'dataset', 'sources'):
+        slots.extend((prefix, SLOT_OTHER) for prefix in gin_edge[key])
+    return slots
+
+
+# The names of the CSV files that are written for each table
+TABLE_FILENAMES = {
+    'nodes': 'nodes.csv',
+    'edges': 'edges.csv',
+    'relations': 'relations.csv',
+    'sources': 'sources.csv',
+    'edge_features': 'edge_features.csv',
+    'edges_gin': 'edges_gin.csv',
+    'prefixes': 'prefixes.csv',
+    'edge_prefixes': 'edge_prefixes.csv',
+}
+
+# The tables that get a row (or several) for each edge, in the order that
+# `AssertionTables` writes them
+EDGE_TABLES = ['edges', 'edges_gin', 'edge_features', 'edge_prefixes']
+
+
+class AssertionTables(object):
+    """
+    The IDs and rows that `assertions_to_sql_csv` produces from a sequence of
+    assertions.
+
+    We can't rely on Postgres to assign IDs, because we need to know the
+    IDs to refer to them _before_ they're in Postgres. So we track our own
+    unique IDs using OrderedSet, numbering each value in the order we first
+    see it.
+    """
+
+    def __init__(self):
+        self.node_list = OrderedSet()
+        self.source_list = OrderedSet()
+        self.assertion_list = OrderedSet()
+        self.relation_list = OrderedSet()
+        self.prefix_list = OrderedSet()
+        self.prefix_counts = []
+
+    def write_edge_rows(self, assertions, output_dir):
+        """
+        Write the rows of the tables that have rows for each edge, in the
+        given directory, while assigning IDs to everything they refer to.
+        """
+
+        def output_file(table):
+            return open(
+                os.path.join(output_dir, TABLE_FILENAMES[table]), 'w', encoding='utf-8'
+            )
+
+        # The syntax restrictions on 'with' leave me with no way to format
+        # this that satisfies my style checker and auto-formatter.
+        with output_file('edges') as edge_file,\
+             output_file('edges_gin') as edge_gin_file,\
+             output_file('edge_features') as feature_file,\
+             output_file('edge_prefixes') as edge_prefix_file:
+            for assertion in assertions:
+                self._write_assertion(
+                    assertion, edge_file, edge_gin_file, feature_file, edge_prefix_file
+                )
+
+    def _write_assertion(self, assertion, edge_file, edge_gin_file, feature_file, edge_prefix_file):
+        # Assertions are supposed to be unique. If they're not, we should
+        # find out and the build should fail.
+        if assertion['uri'] in self.assertion_list:
+            raise ValueError("Duplicate assertion: {!r}".format(assertion))
+
+        # Get unique IDs for the relation, start, and end, and the assertion
+        # itself. The relation, start, and end IDs may already exists; this is
+        # handled by OrderedSet.
+        assertion_idx = self.assertion_list.add(assertion['uri'])
+        rel_idx = self.relation_list.add(assertion['rel'])
+        start_idx = self.node_list.add(assertion['start'])
+        end_idx = self.node_list.add(assertion['end'])
+
+        # Also get unique IDs for each of the sources listed as contributing
+        # to this assertion.
+        sources = assertion['sources']
+        for source in sources:
+            for sourceval in sorted(source.values()):
+                self.source_list.add(sourceval)
+
+        # Write the edge data to the `edge_file`.
+        jsondata = edge_json(assertion)
+        weight = assertion['weight']
+        write_row(
+            edge_file,
+            [
+                assertion_idx,
+                assertion['uri'],
+                rel_idx,
+                start_idx,
+                end_idx,
+                weight,
+                jsondata,
+            ],
+        )
+
+        # Convert the edge to the form that we can easily filter using GIN
+        # indexing, and write that to the `edge_gin_file`.
+        gin_edge = gin_indexable_edge(assertion)
+        write_row(
+            edge_gin_file,
+            [
+                assertion_idx,
+                weight,
+                json.dumps(gin_edge, ensure_ascii=False, sort_keys=True),
+            ],
+        )
+
+        # Write a row for each prefix that can be used to find this edge,
+        # so that the edges matching any prefix can be read off an index
+        # in order of weight.
+        for prefix, slot in prefix_slots(gin_edge):
+            prefix_idx = self.prefix_list.add(prefix)
+            if prefix_idx == len(self.prefix_counts):
+                self.prefix_counts.append(0)
+            self.prefix_counts[prefix_idx] += 1
+            write_row(edge_prefix_file, [prefix_idx, slot, weight, assertion_idx])
+
+        # Extract the 'features' (combinations of the relation and one node)
+        # that are present in the edge. We may need to match the node using
+        # a prefix of that node, so store the feature separately for each
+        # prefix.
+        features = []
+
+        # Get the IDs in the node table for each prefix of the nodes
+        start_p_indices = [
+            self.node_list.add(prefix) for prefix in uri_prefixes(assertion['start'], 3)
+        ]
+        end_p_indices = [
+            self.node_list.add(prefix) for prefix in uri_prefixes(assertion['end'], 3)
+        ]
+
+        # Write the feature data, the 'direction' (forward, backward, or
+        # symmetric), and the edge ID to the feature table.
+        if assertion['rel'] in SYMMETRIC_RELATIONS:
+            for start_p_idx in start_p_indices:
+                features.append((0, start_p_idx))
+            for end_p_idx in end_p_indices:
+                features.append((0, end_p_idx))
+        else:
+            for start_p_idx in start_p_indices:
+                features.append((1, start_p_idx))
+            for end_p_idx in end_p_indices:
+                features.append((-1, end_p_idx))
+
+        for direction, node_idx in features:
+            write_row(feature_file, [rel_idx, direction, node_idx, assertion_idx])
+
+    def merge(self, other):
+        """
+        Add the IDs from the tables of a later shard of the assertions,
+        returning a dictionary of arrays that map each of its local IDs to
+        our IDs, plus the number of assertions that came before it.
+
+        Adding a shard's values in the order it first saw them numbers them
+        in the same order as if all the assertions had been read in one
+        pass.
+        """
+        offset = len(self.assertion_list)
+        for uri in other.assertion_list:
+            if uri in self.assertion_list:
+                raise ValueError("Duplicate assertion: {!r}".format(uri))
+            self.assertion_list.add(uri)
+        for source in other.source_list:
+            self.source_list.add(source)
+        prefix_map = np.array(
+            [self.prefix_list.add(prefix) for prefix in other.prefix_list], dtype=np.int64
+        )
+        self.prefix_counts.extend([0] * (len(self.prefix_list) - len(self.prefix_counts)))
+        for local_idx, count in enumerate(other.prefix_counts):
+            self.prefix_counts[prefix_map[local_idx]] += count
+        return {
+            'offset': offset,
+            'relations': np.array(
+                [self.relation_list.add(rel) for rel in other.relation_list], dtype=np.int64
+            ),
+            'nodes': np.array(
+                [self.node_list.add(node) for node in other.node_list], dtype=np.int64
+            ),
+            'prefixes': prefix_map,
+        }
+
+    def write_id_tables(self, output_dir):
+        """
+        Write our tables of unique IDs.
+        """
+
+        def output_path(table):
+            return os.path.join(output_dir, TABLE_FILENAMES[table])
+
+        write_ordered_set(output_path('nodes'), self.node_list)
+        write_ordered_set(output_path('sources'), self.source_list)
+        write_relations(output_path('relations'), self.relation_list)
+        write_prefixes(output_path('prefixes'), self.prefix_list, self.prefix_counts)
+
+
+def assertions_to_sql_csv(msgpack_filename, output_dir, jobs=1):
     """
     Scan through the list of assertions (edges that are unique in their
     start, end, and relation) and produce CSV files that can be loaded
@@ -104,133 +369,259 @@ def assertions_to_sql_csv(msgpack_filename, output_dir):
 
     The columns of these CSV files are unlabeled, but they correspond
     to the order of the table columns defined in schema.py.
+
+    With `jobs` greater than 1, the assertions are processed in shards by
+    that many processes, producing the same files. See
+    `sharded_assertions_to_sql_csv`.
     """
-    # Construct the filenames of the CSV files, one per table
-    output_nodes = output_dir + '/nodes.csv'
-    output_edges = output_dir + '/edges.csv'
-    output_relations = output_dir + '/relations.csv'
-    output_sources = output_dir + '/sources.csv'
-    output_features = output_dir + '/edge_features.csv'
-    output_edges_gin = output_dir + '/edges_gin.csv'
-
-    # We can't rely on Postgres to assign IDs, because we need to know the
-    # IDs to refer to them _before_ they're in Postgres. So we track our own
-    # unique IDs using OrderedSet.
-    node_list = OrderedSet()
-    source_list = OrderedSet()
-    assertion_list = OrderedSet()
-    relation_list = OrderedSet()
-
-    # These are three files that we will write incrementally as we iterate
-    # through the edges. The syntax restrictions on 'with' leave me with no
-    # way to format this that satisfies my style checker and auto-formatter.
-    with open(output_edges, 'w', encoding='utf-8') as edge_file,\
-         open(output_edges_gin, 'w', encoding='utf-8') as edge_gin_file,\
-         open(output_features, 'w', encoding='utf-8') as feature_file:
-        for assertion in read_msgpack_stream(msgpack_filename):
-            # Assertions are supposed to be unique. If they're not, we should
-            # find out and the build should fail.
-            if assertion['uri'] in assertion_list:
-                raise ValueError("Duplicate assertion: {!r}".format(assertion))
-
-            # Get unique IDs for the relation, start, and end, and the assertion
-            # itself. The relation, start, and end IDs may already exists; this is
-            # handled by OrderedSet.
-            assertion_idx = assertion_list.add(assertion['uri'])
-            rel_idx = relation_list.add(assertion['rel'])
-            start_idx = node_list.add(assertion['start'])
-            end_idx = node_list.add(assertion['end'])
-
-            # Also get unique IDs for each of the sources listed as contributing
-            # to this assertion.
-            source_indices = []
-            sources = assertion['sources']
-            for source in sources:
-                for sourceval in sorted(source.values()):
-                    source_idx = source_list.add(sourceval)
-                    source_indices.append(source_idx)
-
-            # Write the edge data to the `edge_file`.
-            jsondata = json.dumps(assertion, ensure_ascii=False, sort_keys=True)
-            weight = assertion['weight']
-            write_row(
-                edge_file,
-                [
-                    assertion_idx,
-                    assertion['uri'],
-                    rel_idx,
-                    start_idx,
-                    end_idx,
-                    weight,
-                    jsondata,
-                ],
-            )
+    if jobs > 1:
+        sharded_assertions_to_sql_csv(msgpack_filename, output_dir, jobs)
+        return
+    tables = AssertionTables()
+    tables.write_edge_rows(read_msgpack_stream(msgpack_filename), output_dir)
+    tables.write_id_tables(output_dir)
 
-            # Convert the edge to the form that we can easily filter using GIN
-            # indexing, and write that to the `edge_gin_file`.
-            write_row(
-                edge_gin_file,
-                [
-                    assertion_idx,
-                    weight,
-                    json.dumps(
-                        gin_indexable_edge(assertion),
-                        ensure_ascii=False,
-                        sort_keys=True,
-                    ),
-                ],
-            )
 
-            # Extract the 'features' (combinations of the relation and one node)
-            # that are present in the edge. We may need to match the node using
-            # a prefix of that node, so store the feature separately for each
-            # prefix.
-            features = []
+def msgpack_shard_ranges(msgpack_filename, n_shards):
+    """
+    Divide a msgpack stream into at most `n_shards` byte ranges of about the
+    same size that start and end between values, as a list of (start, end)
+    offsets.
 
-            # Get the IDs in the node table for each prefix of the nodes
-            start_p_indices = [
-                node_list.add(prefix) for prefix in uri_prefixes(assertion['start'], 3)
-            ]
-            end_p_indices = [
-                node_list.add(prefix) for prefix in uri_prefixes(assertion['end'], 3)
-            ]
+    The boundaries between values can only be found by reading the stream
+    from the beginning, but the values are skipped over without being
+    decoded.
+    """
+    size = os.path.getsize(msgpack_filename)
+    targets = [size * i // n_shards for i in range(1, n_shards)]
+    boundaries = [0]
+    with open(msgpack_filename, 'rb') as stream:
+        unpacker = msgpack.Unpacker(stream, raw=False)
+        while targets:
+            try:
+                unpacker.skip()
+            except msgpack.OutOfData:
+                break
+            position = unpacker.tell()
+            if position >= targets[0]:
+                boundaries.append(position)
+                while targets and targets[0] <= position:
+                    targets.pop(0)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def read_msgpack_range(msgpack_filename, start, end):
+    """
+    Read the values in a byte range of a msgpack stream from
+    `msgpack_shard_ranges`.
+    """
+    with open(msgpack_filename, 'rb') as stream:
+        stream.seek(start)
+        unpacker = msgpack.Unpacker(stream, raw=False)
+        position = start
+        while position < end:
+            yield unpacker.unpack()
+            position = start + unpacker.tell()
 
-            # Write the feature data, the 'direction' (forward, backward, or
-            # symmetric), and the edge ID to the feature table.
-            if assertion['rel'] in SYMMETRIC_RELATIONS:
-                for start_p_idx in start_p_indices:
-                    features.append((0, start_p_idx))
-                for end_p_idx in end_p_indices:
-                    features.append((0, end_p_idx))
-            else:
-                for start_p_idx in start_p_indices:
-                    features.append((1, start_p_idx))
-                for end_p_idx in end_p_indices:
-                    features.append((-1, end_p_idx))
 
-            for direction, node_idx in features:
-                write_row(feature_file, [rel_idx, direction, node_idx, assertion_idx])
+def _prepare_shard(args):
+    msgpack_filename, start, end, shard_dir = args
+    os.makedirs(shard_dir, exist_ok=True)
+    tables = AssertionTables()
+    tables.write_edge_rows(read_msgpack_range(msgpack_filename, start, end), shard_dir)
+    return tables
+
+
+def _renumber_row(table, row, id_map):
+    """
+    Replace the local IDs in a row that was written for a shard with global
+    IDs. Only the leading columns, which never contain tabs, are split off.
+    """
+    offset = id_map['offset']
+    if table == 'edges':
+        assertion_idx, uri, rel_idx, start_idx, end_idx, rest = row.split('\t', 5)
+        nodes = id_map['nodes']
+        return '\t'.join([
+            str(int(assertion_idx) + offset),
+            uri,
+            str(id_map['relations'][int(rel_idx)]),
+            str(nodes[int(start_idx)]),
+            str(nodes[int(end_idx)]),
+            rest,
+        ])
+    elif table == 'edges_gin':
+        assertion_idx, rest = row.split('\t', 1)
+        return '%d\t%s' % (int(assertion_idx) + offset, rest)
+    elif table == 'edge_features':
+        rel_idx, direction, node_idx, assertion_idx = row.split('\t')
+        return '%d\t%s\t%d\t%d' % (
+            id_map['relations'][int(rel_idx)],
+            direction,
+            id_map['nodes'][int(node_idx)],
+            int(assertion_idx) + offset,
+        )
+    elif table == 'edge_prefixes':
+        prefix_idx, slot, weight, assertion_idx = row.split('\t')
+        return '%d\t%s\t%s\t%d' % (
+            id_map['prefixes'][int(prefix_idx)], slot, weight, int(assertion_idx) + offset
+        )
+    raise ValueError(table)
+
+
+def renumber_shard(args):
+    """
+    Rewrite the edge rows that `AssertionTables` wrote in `shard_dir` with
+    the IDs from `id_map`, as `.renumbered` files. The arguments come as one
+    tuple, `(shard_dir, id_map)`, so this can be used with `Pool.map`.
+    """
+    shard_dir, id_map = args
+    for table in EDGE_TABLES:
+        local_path = os.path.join(shard_dir, TABLE_FILENAMES[table])
+        global_path = local_path + '.renumbered'
+        with open(local_path, encoding='utf-8') as infile:
+            with open(global_path, 'w', encoding='utf-8') as outfile:
+                for line in infile:
+                    outfile.write(_renumber_row(table, line[:-1], id_map) + '\n')
+        os.remove(local_path)
+
+
+def sharded_assertions_to_sql_csv(msgpack_filename, output_dir, jobs, n_shards=None):
+    """
+    Produce the same CSV files as `assertions_to_sql_csv`, using `jobs`
+    processes.
+
+    The msgpack stream is split into `n_shards` byte ranges (by default, four
+    per process), which are processed in parallel, numbering everything
+    with IDs that are local to each shard. A merge pass then assigns global
+    IDs by adding each shard's values in order, the processes rewrite their
+    rows with the global IDs, and the shards' files are concatenated.
+    """
+    if n_shards is None:
+        n_shards = jobs * 4
+    ranges = msgpack_shard_ranges(msgpack_filename, n_shards)
+    with TemporaryDirectory(prefix='shards-', dir=output_dir) as tmpdir:
+        shard_dirs = [os.path.join(tmpdir, str(i)) for i in range(len(ranges))]
+        with Pool(jobs) as pool:
+            shard_tables = pool.map(
+                _prepare_shard,
+                [
+                    (msgpack_filename, start, end, shard_dir)
+                    for ((start, end), shard_dir) in zip(ranges, shard_dirs)
+                ],
+                chunksize=1,
+            )
+            tables = AssertionTables()
+            id_maps = [tables.merge(shard) for shard in shard_tables]
+            del shard_tables
+            pool.map(renumber_shard, list(zip(shard_dirs, id_maps)), chunksize=1)
+
+        for table in EDGE_TABLES:
+            with open(
+                os.path.join(output_dir, TABLE_FILENAMES[table]), 'wb'
+            ) as outfile:
+                for shard_dir in shard_dirs:
+                    shard_path = os.path.join(shard_dir, TABLE_FILENAMES[table])
+                    with open(shard_path + '.renumbered', 'rb') as infile:
+                        shutil.copyfileobj(infile, outfile)
+    tables.write_id_tables(output_dir)
+
+
+# The tables that `load_sql_csv` loads, with the files they're loaded from,
+# in stages. Each table refers only to tables in earlier stages, so the
+# tables in a stage can be loaded at the same time.
+LOAD_STAGES = [
+    [
+        ('relations', 'relations.csv'),
+        ('nodes', 'nodes.csv'),
+        ('sources', 'sources.csv'),
+        ('prefixes', 'prefixes.csv'),
+    ],
+    [('edges', 'edges.csv')],
+    [
+        ('edges_gin', 'edges_gin.shuf.csv'),
+        ('edge_features', 'edge_features.csv'),
+        ('edge_prefixes', 'edge_prefixes.csv'),
+    ],
+]
+
+class ChunkReader(object):
+    """
+    A read-only file-like object over an iterator of bytes, which can be
+    passed to `copy_expert`.
+    """
 
-    # Write our tables of unique IDs
-    write_ordered_set(output_nodes, node_list)
-    write_ordered_set(output_sources, source_list)
-    write_relations(output_relations, relation_list)
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def read(self, size=-1):
+        pieces = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                break
+            pieces.append(chunk)
+            length += len(chunk)
+        data = b''.join(pieces)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_table(connection, tablename, filename):
+    """
+    Load one of our CSV files into a table, using the `copy_from` method.
+    """
+    with connection.cursor() as cursor:
+        with open(filename, 'rb') as file:
+            cursor.copy_from(file, tablename)
+    connection.commit()
 
 
 def load_sql_csv(connection, input_dir):
     """
     Load the CSV files we created into PostgreSQL using the `copy_from`
     method, which is the same as the COPY command at the psql command line.
+
+    Returns a list of (table, seconds) pairs saying how long each table took.
     """
-    for (filename, tablename) in [
-        (input_dir + '/relations.csv', 'relations'),
-        (input_dir + '/nodes.csv', 'nodes'),
-        (input_dir + '/edges.csv', 'edges'),
-        (input_dir + '/sources.csv', 'sources'),
-        (input_dir + '/edges_gin.shuf.csv', 'edges_gin'),
-        (input_dir + '/edge_features.csv', 'edge_features'),
-    ]:
-        with connection.cursor() as cursor:
-            with open(filename, 'rb') as file:
-                cursor.copy_from(file, tablename)
-        connection.commit()
+    timings = []
+    for stage in LOAD_STAGES:
+        for tablename, filename in stage:
+            start = time.monotonic()
+            copy_table(connection, tablename, os.path.join(input_dir, filename))
+            timings.append((tablename, time.monotonic() - start))
+    return timings
+
+
+def _load_table_job(args):
+    dbname, tablename, filename = args
+    connection = open_db_connection(dbname)
+    try:
+        start = time.monotonic()
+        copy_table(connection, tablename, filename)
+        return tablename, time.monotonic() - start
+    finally:
+        connection.close()
+
+
+def load_sql_csv_parallel(dbname, input_dir, jobs):
+    """
+    Load the CSV files like `load_sql_csv`, loading up to `jobs` tables at
+    once, each in its own process with its own connection to the database
+    named `dbname`.
+    """
+    timings = []
+    with Pool(jobs) as pool:
+        for stage in LOAD_STAGES:
+            tasks = [
+                (dbname, tablename, os.path.join(input_dir, filename))
+                for (tablename, filename) in stage
+            ]
+            timings.extend(pool.map(_load_table_job, tasks, chunksize=1))
+    return timings
@@ -1,8 +1,14 @@
+import base64
+import binascii
 import itertools
 import json
+import math
 
-from conceptnet5.db.config import DB_NAME
-from conceptnet5.db.connection import get_db_connection
+import psycopg2
+
+from conceptnet5.db.config import DB_BACKEND
+from conceptnet5.db.connection import get_db_pool
+from conceptnet5.db.schema import SLOT_END, SLOT_START
 from conceptnet5.edges import transform_for_linked_data
 from ftfy.fixes import remove_control_chars
 
@@ -21,34 +27,173 @@ AND rank <= %(limit)s
 ORDER BY direction, uri, rank;
 """
 
-# Queries that match arbitrary criteria using a GIN index. The @> operator
-# tests whether one JSONB structure includes all the values in another.
-GIN_QUERY_1WAY = """
-WITH matched_edges AS (
-    SELECT edge_id FROM edges_gin
-    WHERE data @> %(query)s
-    LIMIT 10000
-)
-SELECT e.uri, e.data, e.weight
-FROM matched_edges m, edges e
-WHERE m.edge_id = e.id
-ORDER BY weight DESC
-OFFSET %(offset)s LIMIT %(limit)s;
+# The same query for many nodes at once.
+NODES_TO_FEATURES_QUERY = """
+SELECT n.uri AS node, rf.direction, r.uri AS rel, e.data
+FROM nodes n, ranked_features rf, edges e, relations r
+WHERE n.uri = ANY(%(nodes)s)
+AND rf.node_id = n.id
+AND rf.edge_id = e.id
+AND rf.rel_id = r.id
+AND rank <= %(limit)s
+ORDER BY node, direction, rel, rank;
 """
 
-GIN_QUERY_2WAY = """
-WITH matched_edges AS (
-    SELECT edge_id FROM edges_gin
-    WHERE data @> %(query_forward)s OR data @> %(query_backward)s
-    LIMIT 10000
+# Get the top edges for each of a list of URIs, in the same order that
+# `AssertionFinder.lookup` would return them.
+LOOKUP_MANY_QUERY = """
+SELECT p.uri, e.data
+FROM prefixes p
+CROSS JOIN LATERAL (
+    SELECT ep.edge_id, ep.weight FROM edge_prefixes ep
+    WHERE ep.prefix_id = p.id
+    ORDER BY ep.weight DESC, ep.edge_id
+    LIMIT %(limit)s
+) top, edges e
+WHERE p.uri = ANY(%(uris)s)
+AND e.id = top.edge_id
+ORDER BY p.uri, top.weight DESC, top.edge_id;
+"""
+
+# Read consecutive rows of the shuffled `edge_sample` table, starting from a
+# random ID and wrapping around to the start of the table if necessary.
+RANDOM_EDGES_QUERY = """
+WITH start AS (
+    SELECT floor(random() * (coalesce(max(id), 0) + 1))::integer AS id
+    FROM edge_sample
+)
+(
+    SELECT e.uri, e.data, e.weight FROM edge_sample s, edges e
+    WHERE s.id >= (SELECT id FROM start) AND e.id = s.edge_id
+    ORDER BY s.id LIMIT %(limit)s
 )
-SELECT e.uri, e.data, e.weight
-FROM matched_edges m, edges e
-WHERE m.edge_id = e.id
-ORDER BY weight DESC
-OFFSET %(offset)s LIMIT %(limit)s;
+UNION ALL
+(
+    SELECT e.uri, e.data, e.weight FROM edge_sample s, edges e
+    WHERE s.id < (SELECT id FROM start) AND e.id = s.edge_id
+    ORDER BY s.id LIMIT %(limit)s
+)
+LIMIT %(limit)s
+"""
+
+# Find the IDs and edge counts of URI prefixes, so we can choose which
+# criterion of a query to scan by.
+PREFIX_LOOKUP_QUERY = """
+SELECT uri, id, edge_count FROM prefixes WHERE uri = ANY(%(uris)s);
 """
 
+# Queries that match arbitrary criteria. We scan the `edge_prefixes` index for
+# the rarest URI in the criteria, which produces the edges with that prefix in
+# order of descending weight, with ties broken by the edge ID. Any other
+# criteria are checked on the rows we find using the JSONB @> operator, which
+# tests whether one JSONB structure includes all the values in another.
+#
+# The pieces in braces are filled in from the fragments below, depending on
+# which criteria there are.
+PREFIX_QUERY = """
+SELECT e.id, e.uri, e.data, e.weight
+FROM edge_prefixes p{gin_join}, edges e
+WHERE p.prefix_id = %(prefix_id)s
+AND e.id = p.edge_id
+{conditions}
+ORDER BY p.weight DESC, p.edge_id
+{paging};
+"""
+
+GIN_JOIN = ", edges_gin g"
+SLOT_CONDITION = "AND p.slot IN %(slots)s"
+GIN_CONDITION_1WAY = "AND g.edge_id = p.edge_id AND g.data @> %(query)s"
+GIN_CONDITION_2WAY = """AND g.edge_id = p.edge_id
+AND (g.data @> %(query_forward)s OR g.data @> %(query_backward)s)"""
+PREFIX_SEEK_CONDITION = """AND (p.weight < %(after_weight)s::real
+     OR (p.weight = %(after_weight)s::real AND p.edge_id > %(after_id)s))"""
+
+# When every criterion is a prefix of many edges, such as {'start': '/c/en',
+# 'end': '/c/ja'}, scanning the rarest one's edges could read millions of
+# rows before enough of them match the others. Instead, we use the GIN index
+# on `edges_gin` to find the edges that match all the criteria at once, and
+# sort just those by weight.
+GIN_QUERY = """
+SELECT e.id, e.uri, e.data, e.weight
+FROM (
+    SELECT g.edge_id, g.weight FROM edges_gin g
+    WHERE {gin_match}
+    {conditions}
+    ORDER BY g.weight DESC, g.edge_id
+    {paging}
+) top, edges e
+WHERE e.id = top.edge_id
+ORDER BY top.weight DESC, top.edge_id;
+"""
+
+GIN_MATCH_1WAY = "g.data @> %(query)s"
+GIN_MATCH_2WAY = "(g.data @> %(query_forward)s OR g.data @> %(query_backward)s)"
+GIN_SEEK_CONDITION = """AND (g.weight < %(after_weight)s::real
+     OR (g.weight = %(after_weight)s::real AND g.edge_id > %(after_id)s))"""
+
+# A query with several criteria scans the edges of its rarest prefix if that
+# prefix has at most this many edges, and uses GIN_QUERY otherwise
+MAX_PREFIX_SCAN_EDGES = 100000
+
+# When there are no criteria at all, we list all edges in the same order.
+ALL_EDGES_QUERY = """
+SELECT e.id, e.uri, e.data, e.weight
+FROM edges e
+{conditions}
+ORDER BY e.weight DESC, e.id
+{paging};
+"""
+ALL_EDGES_SEEK_CONDITION = """WHERE (e.weight < %(after_weight)s::real
+     OR (e.weight = %(after_weight)s::real AND e.id > %(after_id)s))"""
+
+OFFSET_PAGING = "OFFSET %(offset)s LIMIT %(limit)s"
+SEEK_PAGING = "LIMIT %(limit)s"
+
+# How many rows `iter_query` fetches from its server-side cursor at a time
+EXPORT_BATCH_SIZE = 1000
+
+# Which slots of `edge_prefixes` a criterion can match, or None if it can
+# match any slot.
+START_SLOTS = (SLOT_START, SLOT_START | SLOT_END)
+END_SLOTS = (SLOT_END, SLOT_START | SLOT_END)
+
+
+def encode_page_token(weight, edge_id, offset):
+    """
+    Make an opaque continuation token that points just past the edge with the
+    given weight and ID. We also record the offset of the next result, which
+    isn't needed to run the query, but lets us describe where the page is.
+
+    >>> encode_page_token(2.0, 1234, 50)
+    'Mi4wLDEyMzQsNTA'
+    """
+    token = '%r,%d,%d' % (float(weight), edge_id, offset)
+    return base64.urlsafe_b64encode(token.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_page_token(token):
+    """
+    Get the (weight, edge ID, offset) position that a continuation token
+    points to. Raises a ValueError if the token can't be decoded.
+
+    >>> decode_page_token('Mi4wLDEyMzQsNTA')
+    (2.0, 1234, 50)
+    >>> decode_page_token('bogus')
+    Traceback (most recent call last):
+        ...
+    ValueError: 'bogus' is not a valid page token
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        text = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii')
+        weight_str, edge_id_str, offset_str = text.split(',')
+        weight = float(weight_str)
+        if not math.isfinite(weight):
+            raise ValueError(weight)
+        return weight, int(edge_id_str), int(offset_str)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise ValueError('%r is not a valid page token' % token) from None
+
 
 def jsonify(value):
     """
@@ -62,6 +207,39 @@ def jsonify(value):
     return json.dumps(value, ensure_ascii=False).replace("\\u0000", "")
 
 
+def criteria_prefixes(criteria):
+    """
+    Get the URI prefixes that an edge must have to match the given criteria,
+    as a list of (uri, slots) pairs, where `slots` is a tuple of the slot
+    codes in `edge_prefixes` that the prefix may appear in, or None if it may
+    appear in any slot.
+
+    Each of these prefixes narrows down the results on its own, so a query
+    can start by scanning the edges that have any one of them.
+
+    >>> criteria_prefixes({'node': '/c/en/dog', 'other': '/c/en/cat'})
+    [('/c/en/dog', None), ('/c/en/cat', None)]
+    >>> criteria_prefixes({'start': '/c/en/dog', 'rel': '/r/IsA'})
+    [('/c/en/dog', (1, 3)), ('/r/IsA', None)]
+    """
+    prefixes = []
+    for key, value in criteria.items():
+        if key == 'start':
+            slots = START_SLOTS
+        elif key == 'end':
+            slots = END_SLOTS
+        elif key == 'other' and 'node' not in criteria:
+            # Without a 'node', 'other' is the end of the edge, matching what
+            # `gin_jsonb_value` does
+            slots = END_SLOTS
+        elif key in ('node', 'other', 'rel', 'dataset', 'source', 'sources'):
+            slots = None
+        else:
+            continue
+        prefixes.append((value, slots))
+    return prefixes
+
+
 def gin_jsonb_value(criteria, node_forward=True):
     """
     Convert the given criteria into a query that matches the `edges_gin`
@@ -114,6 +292,39 @@ def gin_jsonb_value(criteria, node_forward=True):
     return query
 
 
+def group_by_feature(uri, rows):
+    """
+    Group the rows that a feature query returned for the node `uri`, which
+    are (direction, relation, edge data) tuples, into a dictionary from
+    (direction, relation) features to lists of edges.
+    """
+
+    def extract_feature(row):
+        return tuple(row[:2])
+
+    def feature_data(row):
+        direction, _, data = row
+        data = transform_for_linked_data(data)
+
+        # Hacky way to figure out what the 'other' node is, the one that
+        # (in most cases) didn't match the URI. If both start with our
+        # given URI, take the longer one, which is either a more specific
+        # sense or a different, longer word.
+        shorter, longer = sorted(
+            [data['start'], data['end']], key=lambda node: len(node['@id'])
+        )
+        if shorter['@id'].startswith(uri):
+            data['other'] = longer
+        else:
+            data['other'] = shorter
+        return data
+
+    results = {}
+    for feature, feature_rows in itertools.groupby(rows, extract_feature):
+        results[feature] = [feature_data(row) for row in feature_rows]
+    return results
+
+
 class AssertionFinder(object):
     """
     The object that interacts with the database to find ConceptNet assertions
@@ -121,28 +332,98 @@ class AssertionFinder(object):
     """
 
     def __init__(self, dbname=None):
-        self.connection = None
+        self.pool = None
         self.dbname = dbname
 
-    def lookup(self, uri, limit=100, offset=0):
+    def connect(self):
+        """
+        Open the pool's connections now, instead of when the first query
+        arrives. This raises an error if the database can't be reached.
+        """
+        if self.pool is None:
+            self.pool = get_db_pool(self.dbname)
+        self.pool.fill()
+
+    def disconnect(self):
+        """
+        Close the pool's idle connections. A server that loads the API before
+        forking its worker processes should call this before they fork,
+        because a PostgreSQL connection can't be shared between processes.
+        """
+        if self.pool is not None:
+            self.pool.closeall()
+
+    def build_version(self):
+        """
+        Get the identifier that `cn5-db load_data` recorded for the build of
+        the data in the database, or None if there isn't one (because the
+        database was loaded by an older version of ConceptNet).
+        """
+        try:
+            rows = self._fetch("SELECT value FROM build_info WHERE key = 'version'", {})
+        except psycopg2.ProgrammingError:
+            return None
+        if rows:
+            return rows[0][0]
+        return None
+
+    def _fetch(self, query, params):
+        """
+        Run a query on a connection borrowed from the pool, and return all the
+        rows it produces. The connection goes back to the pool before the
+        rows are processed, so other threads can use it.
+
+        If the connection turns out to have been dropped (for example, because
+        PostgreSQL restarted), the pool discards it, and we try the query once
+        more on a fresh connection.
+        """
+        if self.pool is None:
+            self.pool = get_db_pool(self.dbname)
+        for attempt in range(2):
+            with self.pool.connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(query, params)
+                        return cursor.fetchall()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    # A closed connection will be discarded when it's
+                    # returned to the pool
+                    if attempt > 0 or not conn.closed:
+                        raise
+
+    def lookup(self, uri, limit=100, offset=0, after=None):
         """
         A query that returns all the edges that include a certain URI.
         """
-        if self.connection is None:
-            self.connection = get_db_connection(self.dbname)
+        if uri.startswith('/a/'):
+            return self.lookup_assertion(uri)
+        return self.query(self._lookup_criteria(uri), limit, offset, after)
+
+    def lookup_page(self, uri, limit=100, offset=0, after=None):
+        """
+        Get one page of the edges that include a certain URI, as a pair of
+        the list of edges and a continuation token for the next page. See
+        `query_page`.
+        """
+        if uri.startswith('/a/'):
+            return self.lookup_assertion(uri)[:limit], None
+        return self.query_page(self._lookup_criteria(uri), limit, offset, after)
+
+    @staticmethod
+    def _lookup_criteria(uri):
+        """
+        Get the query criteria for looking up edges that include a URI.
+        """
         if uri.startswith('/c/') or uri.startswith('http'):
-            criteria = {'node': uri}
+            return {'node': uri}
         elif uri.startswith('/r/'):
-            criteria = {'rel': uri}
+            return {'rel': uri}
         elif uri.startswith('/s/'):
-            criteria = {'source': uri}
+            return {'source': uri}
         elif uri.startswith('/d/'):
-            criteria = {'dataset': uri}
-        elif uri.startswith('/a/'):
-            return self.lookup_assertion(uri)
+            return {'dataset': uri}
         else:
-            raise ValueError("%r isn't a ConceptNet URI that can be looked up")
-        return self.query(criteria, limit, offset)
+            raise ValueError("%r isn't a ConceptNet URI that can be looked up" % uri)
 
     def lookup_grouped_by_feature(self, uri, limit=20):
         """
@@ -153,34 +434,57 @@ class AssertionFinder(object):
         (incoming or outgoing).
         """
         uri = remove_control_chars(uri)
-        if self.connection is None:
-            self.connection = get_db_connection(self.dbname)
-
-        def extract_feature(row):
-            return tuple(row[:2])
-
-        def feature_data(row):
-            direction, _, data = row
-
-            # Hacky way to figure out what the 'other' node is, the one that
-            # (in most cases) didn't match the URI. If both start with our
-            # given URI, take the longer one, which is either a more specific
-            # sense or a different, longer word.
-            shorter, longer = sorted([data['start'], data['end']], key=len)
-            if shorter.startswith(uri):
-                data['other'] = longer
+        rows = self._fetch(NODE_TO_FEATURE_QUERY, {'node': uri, 'limit': limit})
+        return group_by_feature(uri, rows)
+
+    def lookup_grouped_by_feature_many(self, uris, limit=20):
+        """
+        Get the results of `lookup_grouped_by_feature` for many URIs with a
+        single database query. Returns a dictionary from each of the given
+        URIs to its dictionary of features.
+        """
+        clean_uris = {uri: remove_control_chars(uri) for uri in uris}
+        rows = self._fetch(
+            NODES_TO_FEATURES_QUERY,
+            {'nodes': sorted(set(clean_uris.values())), 'limit': limit},
+        )
+        found = {}
+        for node, node_rows in itertools.groupby(rows, lambda row: row[0]):
+            found[node] = group_by_feature(node, [row[1:] for row in node_rows])
+        return {uri: found.get(clean_uri, {}) for (uri, clean_uri) in clean_uris.items()}
+
+    def lookup_many(self, uris, limit=100):
+        """
+        Get the results of `lookup` for many URIs, using one database query
+        for the assertion URIs and one for all the others. Returns a
+        dictionary from each of the given URIs to a list of its edges.
+        """
+        clean_uris = {uri: remove_control_chars(uri) for uri in uris}
+        assertion_uris = set()
+        prefix_uris = set()
+        for uri, clean_uri in clean_uris.items():
+            if uri.startswith('/a/'):
+                assertion_uris.add(clean_uri)
             else:
-                data['other'] = shorter
-            return data
-
-        cursor = self.connection.cursor()
-        cursor.execute(NODE_TO_FEATURE_QUERY, {'node': uri, 'limit': limit})
-        results = {}
-        for feature, rows in itertools.groupby(cursor.fetchall(), extract_feature):
-            results[feature] = [
-                transform_for_linked_data(feature_data(row)) for row in rows
-            ]
-        return results
+                # Check that this is a URI we know how to look up
+                self._lookup_criteria(uri)
+                prefix_uris.add(clean_uri)
+
+        found = {}
+        if prefix_uris:
+            rows = self._fetch(
+                LOOKUP_MANY_QUERY, {'uris': sorted(prefix_uris), 'limit': limit}
+            )
+            for uri, uri_rows in itertools.groupby(rows, lambda row: row[0]):
+                found[uri] = [transform_for_linked_data(data) for (_, data) in uri_rows]
+        if assertion_uris:
+            rows = self._fetch(
+                "SELECT uri, data FROM edges WHERE uri = ANY(%(uris)s)",
+                {'uris': sorted(assertion_uris)},
+            )
+            for uri, data in rows:
+                found[uri] = [transform_for_linked_data(data)]
+        return {uri: found.get(clean_uri, []) for (uri, clean_uri) in clean_uris.items()}
 
     def lookup_assertion(self, uri):
         """
@@ -189,71 +493,176 @@ class AssertionFinder(object):
         # Sanitize URIs to remove control characters such as \x00. The postgres driver would
         # remove \x00 anyway, but this avoids reporting a server error when that happens.
         uri = remove_control_chars(uri)
-        if self.connection is None:
-            self.connection = get_db_connection(self.dbname)
-        cursor = self.connection.cursor()
-        cursor.execute("SELECT data FROM edges WHERE uri=%(uri)s", {'uri': uri})
-        results = [transform_for_linked_data(data) for (data,) in cursor.fetchall()]
+        rows = self._fetch("SELECT data FROM edges WHERE uri=%(uri)s", {'uri': uri})
+        results = [transform_for_linked_data(data) for (data,) in rows]
         return results
 
     def random_edges(self, limit=20):
         """
         Get a collection of distinct, randomly-selected edges.
         """
-        if self.connection is None:
-            self.connection = get_db_connection(self.dbname)
-
-        if self.dbname == 'conceptnet-test':
-            # Random queries sample 10% of edges. This makes sure we get matches in
-            # the test database, where there isn't much data.
-            random_query = """
-                SELECT uri, data, weight FROM edges
-                TABLESAMPLE SYSTEM(10)
-                ORDER BY random() LIMIT %(limit)s
-            """
-        else:
-            # In the real database, random queries sample 0.01% of edges.
-            random_query = """
-                SELECT uri, data, weight FROM edges
-                TABLESAMPLE SYSTEM(0.01)
-                ORDER BY random() LIMIT %(limit)s
-            """
-
-        cursor = self.connection.cursor()
-        cursor.execute(random_query, {'limit': limit})
-        results = [
-            transform_for_linked_data(data) for uri, data, weight in cursor.fetchall()
-        ]
+        rows = self._fetch(RANDOM_EDGES_QUERY, {'limit': limit})
+        results = [transform_for_linked_data(data) for uri, data, weight in rows]
         return results
 
-    def query(self, criteria, limit=20, offset=0):
+    def query(self, criteria, limit=20, offset=0, after=None):
         """
         The most general way to query based on a set of criteria.
+
+        Results can be paged through either with an `offset`, or by passing a
+        continuation token from `query_page` as `after`. If `after` is given,
+        `offset` is ignored.
         """
-        if self.connection is None:
-            self.connection = get_db_connection(self.dbname)
-
-        cursor = self.connection.cursor()
-        if 'node' in criteria:
-            query_forward = gin_jsonb_value(criteria, node_forward=True)
-            query_backward = gin_jsonb_value(criteria, node_forward=False)
-            cursor.execute(
-                GIN_QUERY_2WAY,
-                {
-                    'query_forward': jsonify(query_forward),
-                    'query_backward': jsonify(query_backward),
-                    'limit': limit,
-                    'offset': offset,
-                },
-            )
+        rows = self._query_rows(criteria, limit, offset, after)
+        return [transform_for_linked_data(data) for _id, uri, data, weight in rows]
+
+    def iter_query(self, criteria, batch_size=EXPORT_BATCH_SIZE):
+        """
+        Iterate over every edge that matches the criteria, in the same order
+        as `query`, with no limit.
+
+        The edges come from a named (server-side) cursor, `batch_size` rows
+        at a time, so memory use stays constant however many edges match,
+        and rows are only fetched as fast as the caller consumes them. A
+        pooled connection is borrowed until the iteration ends or the
+        iterator is closed.
+        """
+        params = {}
+        query = self._criteria_query(criteria, '', params)
+        if query is None:
+            return
+        if self.pool is None:
+            self.pool = get_db_pool(self.dbname)
+        conn = self.pool.getconn()
+        discard = False
+        try:
+            # A named cursor only lasts as long as its transaction
+            conn.autocommit = False
+            with conn.cursor(name='conceptnet_export') as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(query, params)
+                for _id, _uri, data, _weight in cursor:
+                    yield transform_for_linked_data(data)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            if not discard and not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+            self.pool.putconn(conn, discard=discard)
+
+    def query_page(self, criteria, limit=20, offset=0, after=None):
+        """
+        Get one page of results for `query`, as a pair of the list of edges
+        and a continuation token. The token can be passed as `after` to get
+        the next page, which costs as much as getting the first page. It's
+        None if there are no more results.
+        """
+        if after is not None:
+            offset = decode_page_token(after)[2]
+        rows = self._query_rows(criteria, limit + 1, offset, after)
+        next_token = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_id, _uri, _data, last_weight = rows[-1]
+            next_token = encode_page_token(last_weight, last_id, offset + limit)
+        edges = [transform_for_linked_data(data) for _id, uri, data, weight in rows]
+        return edges, next_token
+
+    def _query_rows(self, criteria, limit, offset, after):
+        """
+        Run the query that matches the given criteria, returning rows of
+        (id, uri, data, weight).
+        """
+        params = {'limit': limit, 'offset': offset}
+        if after is None:
+            paging = OFFSET_PAGING
         else:
-            query = gin_jsonb_value(criteria)
-            cursor.execute(
-                GIN_QUERY_1WAY,
-                {'query': jsonify(query), 'limit': limit, 'offset': offset},
+            paging = SEEK_PAGING
+            params['after_weight'], params['after_id'], _ = decode_page_token(after)
+        query = self._criteria_query(criteria, paging, params, seek=(after is not None))
+        if query is None:
+            return []
+        return self._fetch(query, params)
+
+    def _criteria_query(self, criteria, paging, params, seek=False):
+        """
+        Build the SQL query that finds the edges matching the given criteria,
+        ending with the `paging` clause, and add the values it needs to
+        `params`. With `seek=True`, the query starts after the edge given by
+        the 'after_weight' and 'after_id' parameters.
+
+        Returns None if we can already tell that nothing matches.
+        """
+        criteria = {key: remove_control_chars(value) for (key, value) in criteria.items()}
+        prefixes = criteria_prefixes(criteria)
+        if not prefixes:
+            conditions = ALL_EDGES_SEEK_CONDITION if seek else ''
+            return ALL_EDGES_QUERY.format(conditions=conditions, paging=paging)
+
+        # Look up all the prefixes. If one of them isn't in the database,
+        # nothing can match.
+        found = {
+            uri: (prefix_id, edge_count)
+            for (uri, prefix_id, edge_count) in self._fetch(
+                PREFIX_LOOKUP_QUERY, {'uris': [uri for (uri, _slots) in prefixes]}
             )
+        }
+        if any(uri not in found for (uri, _slots) in prefixes):
+            return None
+
+        # Scan by the prefix that appears on the fewest edges
+        scan_uri, scan_slots = min(prefixes, key=lambda pair: found[pair[0]][1])
+        if len(prefixes) > 1:
+            # The other criteria are checked using the GIN form of the edge
+            if 'node' in criteria:
+                query_forward = gin_jsonb_value(criteria, node_forward=True)
+                query_backward = gin_jsonb_value(criteria, node_forward=False)
+                params['query_forward'] = jsonify(query_forward)
+                params['query_backward'] = jsonify(query_backward)
+            else:
+                params['query'] = jsonify(gin_jsonb_value(criteria))
+
+            if found[scan_uri][1] > MAX_PREFIX_SCAN_EDGES:
+                return GIN_QUERY.format(
+                    gin_match=(GIN_MATCH_2WAY if 'node' in criteria else GIN_MATCH_1WAY),
+                    conditions=(GIN_SEEK_CONDITION if seek else ''),
+                    paging=paging,
+                )
+
+        params['prefix_id'] = found[scan_uri][0]
+        conditions = []
+        if scan_slots is not None:
+            conditions.append(SLOT_CONDITION)
+            params['slots'] = scan_slots
+        if seek:
+            conditions.append(PREFIX_SEEK_CONDITION)
+
+        gin_join = ''
+        if len(prefixes) > 1:
+            gin_join = GIN_JOIN
+            if 'node' in criteria:
+                conditions.append(GIN_CONDITION_2WAY)
+            else:
+                conditions.append(GIN_CONDITION_1WAY)
 
-        results = [
-            transform_for_linked_data(data) for uri, data, weight in cursor.fetchall()
-        ]
-        return results
+        return PREFIX_QUERY.format(
+            gin_join=gin_join, conditions='\n'.join(conditions), paging=paging
+        )
+
+
+def get_assertion_finder(dbname=None):
+    """
+    Get an AssertionFinder for the backend that's configured by the
+    CONCEPTNET_DB_BACKEND environment variable: either the PostgreSQL
+    database, or an embedded store (see `conceptnet5.db.embedded`).
+    """
+    if DB_BACKEND == 'embedded':
+        from conceptnet5.db.embedded import EmbeddedAssertionFinder
+
+        return EmbeddedAssertionFinder()
+    elif DB_BACKEND == 'postgres':
+        return AssertionFinder(dbname=dbname)
+    else:
+        raise ValueError("Unknown database backend: %r" % DB_BACKEND)
@@ -1,5 +1,43 @@
+import re
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+from queue import Queue
+
+# Codes for the `slot` column of `edge_prefixes`, which say which part of an
+# edge a prefix came from. The codes for node prefixes are bit flags, so a
+# prefix of both the start and the end node (such as '/c/en' on an edge
+# between two English terms) appears once, with the code SLOT_START | SLOT_END.
+# Relations, datasets, and sources have URIs that can't be confused with
+# nodes, so their prefixes all get SLOT_OTHER.
+SLOT_OTHER = 0
+SLOT_START = 1
+SLOT_END = 2
+
+# How many edges to put in the `edge_sample` table that `random_edges` reads
+EDGE_SAMPLE_SIZE = 1000000
+
+# The `edge_sample` table holds a random sample of edges in a random order,
+# numbered from 0, so that `random_edges` can read consecutive rows starting
+# from a random ID. `apply_delta` creates it if an older database lacks it.
+EDGE_SAMPLE_TABLE = """CREATE TABLE IF NOT EXISTS edge_sample (
+        id       integer NOT NULL PRIMARY KEY,
+        edge_id  integer NOT NULL REFERENCES edges (id)
+    )
+    """
+
+SAMPLE_EDGES = """
+INSERT INTO edge_sample (id, edge_id)
+SELECT row_number() OVER (ORDER BY random()) - 1, id
+FROM (SELECT id FROM edges ORDER BY random() LIMIT %(size)s) sampled
+"""
+
 TABLES = [
+    "DROP TABLE IF EXISTS build_info",
+    "DROP TABLE IF EXISTS edge_sample",
     "DROP MATERIALIZED VIEW IF EXISTS ranked_features",
+    "DROP TABLE IF EXISTS edge_prefixes",
+    "DROP TABLE IF EXISTS prefixes",
     "DROP TABLE IF EXISTS edge_features",
     "DROP TABLE IF EXISTS edge_sources",
     "DROP TABLE IF EXISTS edges_gin",
@@ -8,6 +46,10 @@ TABLES = [
     "DROP TABLE IF EXISTS nodes",
     "DROP TABLE IF EXISTS sources",
     "DROP TABLE IF EXISTS relations",
+    """CREATE TABLE build_info (
+        key    text NOT NULL PRIMARY KEY,
+        value  text NOT NULL
+    )""",
     """CREATE TABLE nodes (
         id     integer NOT NULL PRIMARY KEY,
         uri    text NOT NULL
@@ -32,6 +74,7 @@ TABLES = [
         data           jsonb NOT NULL
     )
     """,
+    EDGE_SAMPLE_TABLE,
     """CREATE TABLE edges_gin (
         edge_id   integer NOT NULL REFERENCES edges (id),
         weight    real NOT NULL,
@@ -45,6 +88,19 @@ TABLES = [
         edge_id   integer NOT NULL REFERENCES edges (id)
     )
     """,
+    """CREATE TABLE prefixes (
+        id          integer NOT NULL PRIMARY KEY,
+        uri         text NOT NULL,
+        edge_count  integer NOT NULL
+    )
+    """,
+    """CREATE TABLE edge_prefixes (
+        prefix_id  integer NOT NULL REFERENCES prefixes (id),
+        slot       smallint NOT NULL,
+        weight     real NOT NULL,
+        edge_id    integer NOT NULL REFERENCES edges (id)
+    )
+    """,
 ]
 
 INDICES = [
@@ -55,9 +111,13 @@ INDICES = [
     "CREATE INDEX edge_relation ON edges (relation_id)",
     "CREATE INDEX edge_start ON edges (start_id)",
     "CREATE INDEX edge_end ON edges (end_id)",
-    "CREATE INDEX edge_weight ON edges (weight)",
+    "CREATE INDEX edge_weight ON edges (weight DESC, id)",
     "CREATE INDEX ef_feature ON edge_features (rel_id, direction, node_id)",
     "CREATE INDEX ef_node ON edge_features (node_id)",
+    # These indices let `apply_delta` find the rows that belong to the edges
+    # it removes. It creates them if a database was loaded without them.
+    "CREATE INDEX IF NOT EXISTS ef_edge ON edge_features (edge_id)",
+    "CREATE INDEX IF NOT EXISTS ep_edge ON edge_prefixes (edge_id)",
     """
     CREATE MATERIALIZED VIEW ranked_features AS (
     SELECT ef.rel_id, ef.direction, ef.node_id, ef.edge_id, e.weight,
@@ -69,7 +129,58 @@ INDICES = [
     ) WITH DATA
     """,
     "CREATE INDEX rf_node ON ranked_features (node_id)",
+    # REFRESH MATERIALIZED VIEW CONCURRENTLY, which `apply_delta` uses,
+    # needs a unique index on the view, so it also creates this if needed.
+    # The rank is unique within each feature, but an edge can have the same
+    # feature twice.
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS rf_unique
+    ON ranked_features (node_id, rel_id, direction, rank)
+    """,
+    "CREATE INDEX edges_gin_edge ON edges_gin (edge_id)",
+    # Queries with several criteria that are all common prefixes use this
+    # index to find the edges that have all of them
     "CREATE INDEX edges_gin_index ON edges_gin USING gin (data jsonb_path_ops)",
+    "ALTER TABLE prefixes ADD CONSTRAINT prefixes_unique_uri UNIQUE (uri)",
+    # This index returns the edges with a given prefix in order of descending
+    # weight. The slot is included so that it can be filtered on without
+    # visiting the table.
+    "CREATE INDEX ep_prefix ON edge_prefixes (prefix_id, weight DESC, edge_id, slot)",
+]
+
+# The commands in INDICES, in stages whose commands can run at the same time
+# on separate connections. The indices on `ranked_features` have to wait for
+# the view to exist, and the view is the slowest command, so it goes first.
+INDEX_STAGES = [
+    sorted(
+        [cmd for cmd in INDICES if 'ON ranked_features' not in cmd],
+        key=lambda cmd: 'MATERIALIZED VIEW' not in cmd,
+    ),
+    [cmd for cmd in INDICES if 'ON ranked_features' in cmd],
+]
+
+
+def command_name(cmd):
+    """
+    Get the name of the index, constraint, or view that a command in INDICES
+    creates, for reporting how long it took.
+
+    >>> command_name("CREATE INDEX edge_start ON edges (start_id)")
+    'edge_start'
+    >>> command_name("CREATE INDEX IF NOT EXISTS ef_edge ON edge_features (edge_id)")
+    'ef_edge'
+    """
+    match = re.search(r'(?:INDEX|CONSTRAINT|VIEW) (?:IF NOT EXISTS )?(\w+)', cmd)
+    if match is None:
+        return cmd.strip()
+    return match.group(1)
+
+
+# The indices that `apply_delta` needs, which a database loaded by an older
+# version may not have
+DELTA_INDICES = [
+    cmd for cmd in INDICES
+    if re.search(r'INDEX IF NOT EXISTS (ef_edge|ep_edge|rf_unique)', cmd)
 ]
 
 
@@ -86,3 +197,83 @@ def create_tables(connection):
 
 def create_indices(connection):
     run_commands(connection, INDICES)
+
+
+def create_indices_parallel(connect, jobs, maintenance_work_mem=None):
+    """
+    Create the indices and the materialized view, running up to `jobs`
+    commands at once, each on its own connection from calling `connect()`.
+    `maintenance_work_mem`, if given, is the number of megabytes each
+    connection may use to build an index.
+
+    Returns a list of (name, seconds) pairs saying how long each command took.
+    """
+    connections = Queue()
+    try:
+        for _ in range(jobs):
+            conn = connect()
+            conn.autocommit = True
+            if maintenance_work_mem is not None:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "SET maintenance_work_mem = %s", ('{}MB'.format(maintenance_work_mem),)
+                    )
+            connections.put(conn)
+
+        def run_command(cmd):
+            conn = connections.get()
+            try:
+                start = time.monotonic()
+                with conn.cursor() as cursor:
+                    cursor.execute(cmd)
+                return command_name(cmd), time.monotonic() - start
+            finally:
+                connections.put(conn)
+
+        timings = []
+        with ThreadPool(jobs) as pool:
+            for stage in INDEX_STAGES:
+                timings.extend(pool.map(run_command, stage, chunksize=1))
+        return timings
+    finally:
+        while not connections.empty():
+            connections.get().close()
+
+
+def sample_edges(connection, size=EDGE_SAMPLE_SIZE):
+    """
+    Fill the `edge_sample` table, once the edges are loaded.
+    """
+    cursor = connection.cursor()
+    cursor.execute(SAMPLE_EDGES, {'size': size})
+    connection.commit()
+
+
+def new_build_version():
+    """
+    Make an identifier for a newly loaded build of the data: the UTC time,
+    plus some random digits in case two builds are loaded in the same second.
+    """
+    timestamp = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    return '{}-{}'.format(timestamp, uuid.uuid4().hex[:8])
+
+
+def record_build_version(connection, version=None, commit=True):
+    """
+    Record the version of the data that was just loaded in the `build_info`
+    table, so that the API can tell when it changes. Returns the version.
+
+    If `commit` is False, the version is recorded as part of the current
+    transaction, so it changes exactly when the data does.
+    """
+    if version is None:
+        version = new_build_version()
+    cursor = connection.cursor()
+    cursor.execute(
+        "INSERT INTO build_info (key, value) VALUES ('version', %(version)s) "
+        "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value",
+        {'version': version},
+    )
+    if commit:
+        connection.commit()
+    return version
@@ -138,7 +138,12 @@ def transform_for_linked_data(edge):
       URI. Without this, we get RDF blank nodes, which are awful.
     - Set '@type' on objects representing edges and sources. (Nodes get their
       @type from the `ld_node` function.)
+
+    An edge that already has an '@id' has already been transformed, as the
+    edges stored in the database are, and is returned as it is.
     """
+    if '@id' in edge:
+        return edge
     if 'features' in edge:
         del edge['features']
     for source in edge['sources']:
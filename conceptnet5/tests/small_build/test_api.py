@@ -13,3 +13,21 @@ def test_related_query_malformed(run_build):
     # there are simply no results
     result = api.query_related('/c/en,test', limit=3)
     assert len(result['related']) == 0
+
+
+def test_batch(run_build):
+    result = api.batch([
+        {'lookup': '/c/en/test', 'limit': 5},
+        {'lookup': '/c/en/quiz', 'grouped': True},
+        {'query': {'node': '/c/en/quiz', 'other': '/c/en/test'}},
+        {'lookup': 'test'},
+        {'lookup': '/c/en/quiz', 'grouped': 'false'},
+        {'lookup': '/c/en/quiz', 'grouped': 'true'},
+    ])
+    responses = result['results']
+    assert responses[0]['edges'] == api.lookup_paginated('/c/en/test', limit=5)['edges']
+    assert responses[1] == api.lookup_grouped_by_feature('/c/en/quiz', feature_limit=20)
+    assert len(responses[2]['edges']) == 3
+    assert responses[3]['error']['status'] == 400
+    assert responses[4]['edges'] == api.lookup_paginated('/c/en/quiz', limit=20)['edges']
+    assert responses[5] == responses[1]
@@ -0,0 +1,245 @@
+"""
+Test that applying a delta to the small test database, with one edge added,
+one changed, and one removed, gives the same results as loading the changed
+assertions from scratch.
+"""
+import os
+import subprocess
+from collections import Counter
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from conceptnet5.db.connection import open_db_connection
+from conceptnet5.db.delta import apply_delta
+from conceptnet5.db.prepare_data import assertions_to_sql_csv, load_sql_csv
+from conceptnet5.db.query import AssertionFinder
+from conceptnet5.db.schema import (
+    create_indices,
+    create_tables,
+    record_build_version,
+    sample_edges,
+)
+from conceptnet5.edges import make_edge
+from conceptnet5.formats.msgpack_stream import MsgpackStreamWriter, read_msgpack_stream
+from conceptnet5.tests.conftest import run_build
+from conceptnet5.uri import Licenses, uri_prefixes
+
+TEST_DB = 'conceptnet-test'
+FRESH_DB = 'conceptnet-delta-test'
+ASSERTIONS_FILENAME = 'testdata/current/assertions/assertions.msgpack'
+
+CHANGED_URI = '/a/[/r/RelatedTo/,/c/en/test/,/c/en/quiz/]'
+ADDED_EDGE = make_edge(
+    '/r/RelatedTo',
+    '/c/en/quiz',
+    '/c/en/delta_test',
+    dataset='/d/verbosity',
+    license=Licenses.cc_attribution,
+    sources=[{'contributor': '/s/resource/verbosity'}],
+    weight=2.0,
+)
+
+
+def edge_nodes(assertion):
+    """
+    The nodes that `prepare_data` puts in the `nodes` table for an assertion.
+    """
+    return (
+        {assertion['start'], assertion['end']}
+        | set(uri_prefixes(assertion['start'], 3))
+        | set(uri_prefixes(assertion['end'], 3))
+    )
+
+
+def choose_removed_edge(assertions):
+    """
+    Choose an edge to remove that has a node no other edge needs, so that
+    removing it should also remove that node.
+    """
+    node_counts = Counter()
+    for assertion in assertions:
+        node_counts.update(edge_nodes(assertion))
+    for assertion in assertions:
+        if assertion['uri'] == CHANGED_URI:
+            continue
+        if any(node_counts[node] == 1 for node in edge_nodes(assertion)):
+            return assertion
+    raise AssertionError("No edge in the test data has a node of its own")
+
+
+def write_msgpack(assertions, filename):
+    writer = MsgpackStreamWriter(filename)
+    for assertion in assertions:
+        writer.write(assertion)
+    writer.close()
+
+
+def load_fresh(msgpack_filename, tmpdir):
+    """
+    Load assertions into an empty database, the way `cn5-db load_data` does.
+    """
+    subprocess.run(["dropdb", FRESH_DB, "--if-exists"], check=True)
+    subprocess.run(["createdb", FRESH_DB], check=True)
+    csv_dir = os.path.join(tmpdir, 'psql')
+    os.makedirs(csv_dir)
+    assertions_to_sql_csv(msgpack_filename, csv_dir)
+    os.rename(
+        os.path.join(csv_dir, 'edges_gin.csv'), os.path.join(csv_dir, 'edges_gin.shuf.csv')
+    )
+    conn = open_db_connection(FRESH_DB)
+    try:
+        create_tables(conn)
+        load_sql_csv(conn, csv_dir)
+        sample_edges(conn)
+        create_indices(conn)
+        record_build_version(conn)
+    finally:
+        conn.close()
+
+
+def read_state(dbname):
+    """
+    Read the parts of a database that `apply_delta` changes, in terms of URIs
+    instead of IDs, which differ between a delta and a fresh load.
+    """
+    conn = open_db_connection(dbname)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT uri, data FROM edges")
+            edges = dict(cursor.fetchall())
+            cursor.execute("SELECT uri FROM nodes")
+            nodes = {row[0] for row in cursor.fetchall()}
+            cursor.execute("SELECT uri, edge_count FROM prefixes WHERE edge_count > 0")
+            prefix_counts = dict(cursor.fetchall())
+            cursor.execute("SELECT uri FROM prefixes WHERE edge_count <= 0")
+            empty_prefixes = {row[0] for row in cursor.fetchall()}
+            # Edges with the same weight are ranked by ID, so compare which
+            # edges each feature has, and the weights at each rank
+            cursor.execute(
+                "SELECT n.uri, r.uri, rf.direction, e.uri, rf.rank, rf.weight "
+                "FROM ranked_features rf, nodes n, relations r, edges e "
+                "WHERE n.id = rf.node_id AND r.id = rf.rel_id AND e.id = rf.edge_id"
+            )
+            rows = cursor.fetchall()
+            cursor.execute(
+                "SELECT e.uri FROM edge_sample s LEFT JOIN edges e ON e.id = s.edge_id"
+            )
+            sampled = [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+    features = sorted(
+        (node, rel, direction, edge) for (node, rel, direction, edge, _rank, _weight) in rows
+    )
+    feature_ranks = sorted(
+        (node, rel, direction, rank, weight)
+        for (node, rel, direction, _edge, rank, weight) in rows
+    )
+    return {
+        'edges': edges,
+        'nodes': nodes,
+        'prefix_counts': prefix_counts,
+        'empty_prefixes': empty_prefixes,
+        'features': features,
+        'feature_ranks': feature_ranks,
+        'sampled': sampled,
+    }
+
+
+@pytest.fixture(scope='module')
+def delta(run_build):
+    """
+    Apply a delta to the test database, and put the original assertions back
+    afterward so that the other tests see the data they expect.
+    """
+    original = list(read_msgpack_stream(ASSERTIONS_FILENAME))
+    removed = choose_removed_edge(original)
+    modified = []
+    for assertion in original:
+        if assertion['uri'] == removed['uri']:
+            continue
+        if assertion['uri'] == CHANGED_URI:
+            assertion = dict(assertion, weight=100.0)
+        modified.append(assertion)
+    modified.append(ADDED_EDGE)
+
+    with TemporaryDirectory(prefix='conceptnet-delta-test') as tmpdir:
+        modified_filename = os.path.join(tmpdir, 'assertions.msgpack')
+        write_msgpack(modified, modified_filename)
+        load_fresh(modified_filename, tmpdir)
+
+        version_before = AssertionFinder(TEST_DB).build_version()
+        conn = open_db_connection(TEST_DB)
+        try:
+            counts = apply_delta(conn, modified_filename)
+            yield {
+                'counts': counts,
+                'removed': removed,
+                'kept_nodes': set.union(*[edge_nodes(a) for a in modified]),
+                'version_before': version_before,
+            }
+        finally:
+            apply_delta(conn, ASSERTIONS_FILENAME)
+            conn.close()
+
+
+def test_delta_counts(delta):
+    assert delta['counts'] == {'added': 1, 'changed': 1, 'removed': 1}
+
+
+def test_delta_lookups(delta):
+    finder = AssertionFinder(TEST_DB)
+    assert finder.build_version() != delta['version_before']
+
+    added = finder.lookup(ADDED_EDGE['uri'])
+    assert len(added) == 1
+    assert added[0]['weight'] == 2.0
+    assert [edge['@id'] for edge in finder.lookup('/c/en/delta_test')] == [ADDED_EDGE['uri']]
+
+    quiz = finder.lookup('/c/en/quiz')
+    assert quiz[0]['@id'] == CHANGED_URI
+    assert quiz[0]['weight'] == 100.0
+    assert ADDED_EDGE['uri'] in {edge['@id'] for edge in quiz}
+
+    assert finder.lookup(delta['removed']['uri']) == []
+
+
+def test_delta_removes_unused_nodes(delta):
+    nodes = read_state(TEST_DB)['nodes']
+    unused = edge_nodes(delta['removed']) - delta['kept_nodes']
+    assert unused
+    assert not (unused & nodes)
+
+
+def test_delta_matches_fresh_load(delta):
+    updated = read_state(TEST_DB)
+    fresh = read_state(FRESH_DB)
+    assert updated['edges'] == fresh['edges']
+    assert updated['nodes'] == fresh['nodes']
+    assert updated['prefix_counts'] == fresh['prefix_counts']
+    assert not (updated['empty_prefixes'] & set(fresh['prefix_counts']))
+    assert updated['prefix_counts']['/c/en/delta_test'] == 1
+    assert updated['features'] == fresh['features']
+    assert updated['feature_ranks'] == fresh['feature_ranks']
+
+
+def test_delta_edge_sample(delta):
+    # The test database has fewer edges than the sample size, so new edges
+    # are sampled at a rate of 1, and the sample stays the set of all edges
+    updated = read_state(TEST_DB)
+    assert None not in updated['sampled']
+    assert sorted(updated['sampled']) == sorted(updated['edges'])
+    assert ADDED_EDGE['uri'] in updated['sampled']
+
+
+def test_delta_edge_sample_ids(delta):
+    # Removing edges from the sample leaves gaps in its IDs, which are closed
+    # up so that `random_edges` can start from any ID with equal chances
+    conn = open_db_connection(TEST_DB)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM edge_sample ORDER BY id")
+            ids = [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+    assert ids == list(range(len(ids)))
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from conceptnet5.api import lookup_grouped_by_feature, lookup_paginated
+from conceptnet5.tests.conftest import run_build
+from conceptnet_web.json_rendering import (
+    HIGHLIGHT_MAX_LENGTH,
+    encode_json_orjson,
+    encode_json_stdlib,
+    highlight_and_link_json,
+)
+
+pytest.importorskip('orjson')
+
+
+@pytest.fixture
+def responses(run_build):
+    return [
+        lookup_paginated('/c/en/test', limit=50),
+        lookup_grouped_by_feature('/c/en/test', feature_limit=10),
+    ]
+
+
+def test_backends_agree(responses):
+    for response in responses:
+        for indent in (False, True):
+            stdlib = encode_json_stdlib(response, indent)
+            fast = encode_json_orjson(response, indent)
+            assert json.loads(fast.decode('utf-8')) == json.loads(stdlib.decode('utf-8'))
+        # The numbers in a real response are written the same way by both,
+        # so the pretty-printed JSON that gets highlighted is identical
+        assert encode_json_orjson(response, True) == encode_json_stdlib(response, True)
+
+
+def test_backends_agree_at_highlight_limit(responses):
+    small = responses[0]
+    # Repeat a real response until its pretty-printed JSON is over the
+    # length that gets highlighted
+    n_copies = HIGHLIGHT_MAX_LENGTH // len(encode_json_stdlib(small, True)) + 1
+    large = {'responses': [small] * n_copies}
+    for response, highlighted in [(small, True), (large, False)]:
+        html = [
+            highlight_and_link_json(encode(response, True).decode('utf-8'))
+            for encode in (encode_json_stdlib, encode_json_orjson)
+        ]
+        assert html[0] == html[1]
+        assert ('<span' in html[0]) == highlighted
+
+
+def test_backends_differ_on_nan():
+    assert encode_json_stdlib({'weight': float('nan')}) == b'{"weight": NaN}'
+    assert encode_json_orjson({'weight': float('nan')}) == b'{"weight":null}'
@@ -1,4 +1,8 @@
+import psycopg2
 import pytest
+from conceptnet5.db import query as db_query
+from conceptnet5.db.connection import ConnectionPool, open_db_connection
+from conceptnet5.db.schema import EDGE_SAMPLE_SIZE
 from conceptnet5.tests.conftest import run_build, test_finder
 
 
@@ -34,6 +38,25 @@ def test_random_edges(test_finder, run_build):
     assert len(results) == 10
 
 
+def test_random_edges_from_sample(test_finder, run_build):
+    conn = open_db_connection('conceptnet-test')
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM edges')
+            n_edges = cursor.fetchone()[0]
+            cursor.execute('SELECT e.uri FROM edge_sample s, edges e WHERE e.id = s.edge_id')
+            sampled = [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+    assert len(sampled) == len(set(sampled)) == min(n_edges, EDGE_SAMPLE_SIZE)
+
+    # Asking for the whole sample, from whatever random ID the read starts
+    # at, wraps around and returns every sampled edge once
+    for _ in range(5):
+        results = [edge['@id'] for edge in test_finder.random_edges(limit=len(sampled))]
+        assert sorted(results) == sorted(sampled)
+
+
 def test_strip_control_chars(test_finder, run_build):
     assert test_finder.lookup('/c/en/test\x00') == test_finder.lookup('/c/en/test')
     assert not test_finder.lookup('/s/\x1a')
@@ -96,3 +119,102 @@ def test_lookup_external(test_finder, run_build):
     found = list(test_finder.lookup('http://dbpedia.org/resource/Test_(assessment)'))
     assert len(found) == 1
     assert found[0]['start']['@id'] == '/c/en/test/n/wp/assessment'
+
+
+def test_query_page(test_finder, run_build):
+    query = {'node': '/c/en/test'}
+    first_four = get_query_ids(query, test_finder)[:4]
+    page1, token = test_finder.query_page(query, limit=2)
+    assert token is not None
+    page2, _ = test_finder.query_page(query, limit=2, after=token)
+    assert [edge['@id'] for edge in page1 + page2] == first_four
+
+    offset_page = test_finder.query(query, limit=2, offset=2)
+    assert page2 == offset_page
+
+
+def test_query_common_prefix_by_weight(test_finder, run_build):
+    # Queries for very common prefixes should come back heaviest-first
+    weights = [edge['weight'] for edge in test_finder.query({'start': '/c/en'}, limit=50)]
+    assert len(weights) == 50
+    assert weights == sorted(weights, reverse=True)
+    assert weights[0] == max(
+        edge['weight'] for edge in test_finder.query({'node': '/c/en'}, limit=1000)
+        if edge['start']['@id'].startswith('/c/en/')
+    )
+
+
+def test_lookup_many(test_finder, run_build):
+    uris = ['/c/en/quiz', '/d/verbosity', '/c/en/test\x00', '/c/xx/nothing']
+    found = test_finder.lookup_many(uris, limit=10)
+    assert found['/c/en/quiz'] == test_finder.lookup('/c/en/quiz', limit=10)
+    assert found['/d/verbosity'] == test_finder.lookup('/d/verbosity', limit=10)
+    assert found['/c/en/test\x00'] == test_finder.lookup('/c/en/test', limit=10)
+    assert found['/c/xx/nothing'] == []
+
+    grouped = test_finder.lookup_grouped_by_feature_many(['/c/en/test', '/c/en/quiz'])
+    assert grouped['/c/en/quiz'] == test_finder.lookup_grouped_by_feature('/c/en/quiz')
+
+
+ITER_QUERY_CRITERIA = [
+    {'node': '/c/en/test'},
+    {'node': '/c/en/test', 'other': '/c/en/quiz'},
+    {'rel': '/r/Synonym'},
+    {'start': '/c/es', 'end': '/c/en'},
+    {'node': '/c/en/unicorn_test_missing'},
+]
+
+
+@pytest.mark.parametrize('criteria', ITER_QUERY_CRITERIA)
+def test_iter_query(test_finder, run_build, criteria):
+    exported = list(test_finder.iter_query(criteria, batch_size=3))
+    assert exported == test_finder.query(criteria, limit=10000)
+
+
+def test_iter_query_closed_early(test_finder, run_build):
+    # With one connection in the pool, the export has to give back the same
+    # connection that the later queries use
+    test_finder.pool = ConnectionPool('conceptnet-test', max_size=1, timeout=1.)
+    try:
+        edges = test_finder.iter_query({'node': '/c/en/test'}, batch_size=2)
+        next(edges)
+        edges.close()
+        assert test_finder.pool.stats() == {'open': 1, 'idle': 1}
+
+        conn = test_finder.pool.getconn()
+        try:
+            assert conn.autocommit
+            assert (
+                conn.get_transaction_status()
+                == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+            )
+        finally:
+            test_finder.pool.putconn(conn)
+
+        # The named cursor is gone, so another export can use its name
+        criteria = {'node': '/c/en/test'}
+        assert list(test_finder.iter_query(criteria)) == test_finder.query(criteria, limit=10000)
+    finally:
+        test_finder.pool.closeall()
+
+
+MULTI_PREFIX_CRITERIA = [
+    {'start': '/c/en', 'end': '/c/es'},
+    {'node': '/c/en', 'other': '/c/es'},
+    {'node': '/c/en/test', 'rel': '/r/Synonym'},
+    {'start': '/c/es', 'end': '/c/es', 'rel': '/r/Synonym'},
+]
+
+
+@pytest.mark.parametrize('criteria', MULTI_PREFIX_CRITERIA)
+def test_gin_query_plan(test_finder, run_build, monkeypatch, criteria):
+    # Queries whose prefixes are all common use the GIN index instead of
+    # scanning a prefix, and should get the same results in the same order
+    scanned = test_finder.query(criteria, limit=1000)
+    scanned_page, scanned_token = test_finder.query_page(criteria, limit=2)
+    monkeypatch.setattr(db_query, 'MAX_PREFIX_SCAN_EDGES', 0)
+    assert test_finder.query(criteria, limit=1000) == scanned
+    assert test_finder.query_page(criteria, limit=2) == (scanned_page, scanned_token)
+    if scanned_token is not None:
+        assert test_finder.query(criteria, limit=1000, after=scanned_token) == scanned[2:]
+    assert list(test_finder.iter_query(criteria)) == scanned
@@ -0,0 +1,135 @@
+import os
+from tempfile import TemporaryDirectory
+
+import flask
+import pytest
+
+from conceptnet5.tests.conftest import run_build
+from conceptnet_web.response_cache import ResponseCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class Versions(object):
+    """
+    A `version_func` whose version can be changed, or made to fail like a
+    database that's down.
+    """
+
+    def __init__(self):
+        self.version = 'v1'
+        self.fail = False
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("The database is unavailable")
+        return self.version
+
+
+def make_app(response_cache):
+    app = flask.Flask('test_response_cache')
+    app.view_calls = 0
+
+    @app.route('/count')
+    @response_cache.cached
+    def count():
+        app.view_calls += 1
+        return flask.Response(str(app.view_calls), mimetype='application/json')
+
+    return app
+
+
+@pytest.fixture
+def versions():
+    return Versions()
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_etag_304(run_build):
+    from conceptnet_web.api import app
+
+    client = app.test_client()
+    first = client.get('/c/en/test?format=json')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag
+
+    second = client.get('/c/en/test?format=json', headers={'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+    assert not second.get_data()
+
+    other = client.get('/c/en/test?format=json', headers={'If-None-Match': '"other"'})
+    assert other.status_code == 200
+    assert other.get_data() == first.get_data()
+
+
+def test_version_change_invalidates(versions, clock):
+    cache = ResponseCache(versions, check_interval=30., clock=clock)
+    client = make_app(cache).test_client()
+
+    assert client.get('/count').get_data() == b'1'
+    assert client.get('/count').get_data() == b'1'
+
+    # The version isn't checked again until the interval has passed
+    versions.version = 'v2'
+    clock.now = 10.
+    assert client.get('/count').get_data() == b'1'
+    clock.now = 40.
+    assert client.get('/count').get_data() == b'2'
+    assert cache.version == 'v2'
+
+
+def test_version_check_failure(versions, clock):
+    cache = ResponseCache(versions, check_interval=30., clock=clock)
+    client = make_app(cache).test_client()
+    assert client.get('/count').get_data() == b'1'
+
+    # If the version can't be checked, the last known version is kept, and
+    # cached responses are still served
+    versions.fail = True
+    clock.now = 40.
+    assert client.get('/count').get_data() == b'1'
+    assert cache.version == 'v1'
+    calls = versions.calls
+    clock.now = 50.
+    client.get('/count')
+    assert versions.calls == calls
+
+    versions.fail = False
+    versions.version = 'v2'
+    clock.now = 80.
+    assert client.get('/count').get_data() == b'2'
+
+
+def test_disk_cache_eviction(versions, clock):
+    with TemporaryDirectory(prefix='conceptnet-test') as tmpdir:
+        app1 = make_app(ResponseCache(versions, disk_path=tmpdir, clock=clock))
+        cache2 = ResponseCache(versions, disk_path=tmpdir, clock=clock)
+        app2 = make_app(cache2)
+
+        assert app1.test_client().get('/count').get_data() == b'1'
+        # Another process finds the response on disk, without rendering it
+        assert app2.test_client().get('/count').get_data() == b'1'
+        assert app2.view_calls == 0
+        assert len(os.listdir(tmpdir)) == 1
+
+        # When the version changes, responses for the old one are deleted
+        versions.version = 'v2'
+        clock.now = 100.
+        assert app2.test_client().get('/count').get_data() == b'1'
+        assert app2.view_calls == 1
+        assert len(os.listdir(tmpdir)) == 1
+        assert cache2.get('v1', ('/count', (), True)) is None
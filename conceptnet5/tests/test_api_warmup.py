@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conceptnet5 import api
+from conceptnet5.vectors.query import VectorSpaceWrapper
+
+
+class FakeFinder(object):
+    """
+    An assertion finder that only keeps track of whether it's connected.
+    """
+
+    def __init__(self):
+        self.connected = False
+        self.connections = 0
+
+    def connect(self):
+        self.connected = True
+        self.connections += 1
+
+    def disconnect(self):
+        self.connected = False
+
+    def build_version(self):
+        return 'test'
+
+
+@pytest.fixture
+def finder(monkeypatch):
+    frame = pd.DataFrame(
+        np.ones((3, 4)), index=['/c/en/cat', '/c/en/dog', '/c/fr/chien']
+    )
+    finder = FakeFinder()
+    monkeypatch.setattr(api, 'VECTORS', VectorSpaceWrapper(frame=frame))
+    monkeypatch.setattr(api, 'FINDER', finder)
+    monkeypatch.setattr(api, 'LOAD_TIMES', {})
+    return finder
+
+
+def test_readiness_before_warm_up(finder):
+    status = api.readiness()
+    assert not status['ready']
+    assert not status['components']['vectors']['loaded']
+    assert not status['components']['assertions']['loaded']
+    assert status['components']['assertions']['seconds'] is None
+
+
+def test_warm_up(finder):
+    api.warm_up()
+    status = api.readiness()
+    assert status['ready']
+    assert status['components']['vectors']['terms'] == 3
+    assert status['components']['assertions']['seconds'] >= 0
+    assert finder.connected
+
+
+def test_warm_up_before_fork(finder):
+    # The master process checks that it can connect, but doesn't keep
+    # connections that its workers would share
+    api.warm_up(before_fork=True)
+    assert api.readiness()['ready']
+    assert finder.connections == 1
+    assert not finder.connected
+
+    api.connect_after_fork()
+    assert finder.connections == 2
+    assert finder.connected
+    assert api.build_version() == '{}/test'.format(api.VERSION)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from conceptnet5.util.cache import LRUCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def test_byte_limit():
+    vec = np.zeros(1000, dtype='f')
+    cache = LRUCache(max_items=None, max_bytes=10000)
+    for i in range(5):
+        cache.put(i, vec.copy())
+    assert 0 < len(cache) < 5
+    assert cache.n_bytes <= 10000
+    assert 4 in cache
+    assert 0 not in cache
+    assert cache.stats()['evictions'] == 5 - len(cache)
+
+    # A value that could never fit isn't cached
+    cache.put('big', np.zeros(10000, dtype='f'))
+    assert 'big' not in cache
+
+
+def test_ttl():
+    clock = FakeClock()
+    cache = LRUCache(ttl=10, clock=clock)
+    cache.put('a', 1)
+    clock.now = 5.
+    assert cache.get('a') == 1
+    clock.now = 11.
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert stats['expirations'] == 1
+    assert stats['items'] == 0
+    assert (stats['hits'], stats['misses']) == (1, 1)
@@ -0,0 +1,111 @@
+import threading
+
+import psycopg2
+import pytest
+
+from conceptnet5.db.connection import ConnectionPool, PoolTimeout
+
+
+class FakeCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=None):
+        if self.conn.dropped:
+            self.conn.closed = 2
+            raise psycopg2.OperationalError("server closed the connection")
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = 0
+        self.dropped = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def opened():
+    return []
+
+
+@pytest.fixture
+def make_pool(opened):
+    def _make_pool(**kwargs):
+        def connect(dbname):
+            conn = FakeConnection()
+            opened.append(conn)
+            return conn
+
+        return ConnectionPool('conceptnet-test', connect=connect, **kwargs)
+
+    return _make_pool
+
+
+def test_reuse(make_pool, opened):
+    pool = make_pool(max_size=2)
+    with pool.connection() as conn1:
+        pass
+    with pool.connection() as conn2:
+        pass
+    assert conn1 is conn2
+    assert len(opened) == 1
+
+
+def test_fill(make_pool, opened):
+    pool = make_pool(min_size=3, max_size=4)
+    pool.fill()
+    assert pool.stats() == {'open': 3, 'idle': 3}
+
+
+def test_timeout(make_pool):
+    pool = make_pool(max_size=1, timeout=0.05)
+    conn = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_wait_for_return(make_pool):
+    pool = make_pool(max_size=1, timeout=5)
+    conn = pool.getconn()
+    timer = threading.Timer(0.05, pool.putconn, [conn])
+    timer.start()
+    assert pool.getconn() is conn
+    timer.join()
+
+
+def test_reconnect_after_drop(make_pool, opened):
+    pool = make_pool(max_size=1, check_interval=0)
+    with pool.connection() as conn:
+        pass
+    conn.dropped = True
+
+    # The idle connection fails its health check, so it's replaced
+    with pool.connection() as new_conn:
+        pass
+    assert new_conn is not conn
+    assert conn.closed
+    assert pool.stats() == {'open': 1, 'idle': 1}
+
+
+def test_discard_on_error(make_pool, opened):
+    pool = make_pool(max_size=1)
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection() as conn:
+            raise psycopg2.OperationalError("connection lost")
+    assert conn.closed
+    assert pool.stats() == {'open': 0, 'idle': 0}
+    with pool.connection() as new_conn:
+        assert new_conn is not conn
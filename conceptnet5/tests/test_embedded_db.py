@@ -0,0 +1,133 @@
+import copy
+import os
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from conceptnet5.db.embedded import EmbeddedAssertionFinder, build_embedded_store
+from conceptnet5.edges import make_edge, transform_for_linked_data
+from conceptnet5.formats.msgpack_stream import MsgpackStreamWriter
+from conceptnet5.uri import Licenses
+
+SOURCE = {'contributor': '/s/contributor/omcs'}
+
+
+def edge(rel, start, end, dataset, sources, weight):
+    return make_edge(rel, start, end, dataset=dataset, license=Licenses.cc_attribution,
+                     sources=sources, weight=weight)
+
+
+EDGES = [
+    edge('/r/IsA', '/c/en/dog', '/c/en/animal', '/d/conceptnet/4/en',
+         [SOURCE], 2.0),
+    edge('/r/CapableOf', '/c/en/dog', '/c/en/bark', '/d/conceptnet/4/en',
+         [SOURCE], 1.0),
+    edge('/r/IsA', '/c/en/cat/n', '/c/en/animal', '/d/conceptnet/4/en',
+         [SOURCE], 3.0),
+    edge('/r/Synonym', '/c/fr/chien', '/c/en/dog', '/d/wiktionary/fr',
+         [{'process': '/s/process/wikiparsec/2'}], 1.0),
+    edge('/r/RelatedTo', '/c/en/cat', '/c/en/dog', '/d/conceptnet/4/en',
+         [SOURCE], 2.0),
+]
+
+
+def edge_ids(edges):
+    return [edge['@id'] for edge in edges]
+
+
+@pytest.fixture(scope='module')
+def finder():
+    with TemporaryDirectory(prefix='conceptnet-test') as tmpdir:
+        msgpack_path = os.path.join(tmpdir, 'assertions.msgpack')
+        writer = MsgpackStreamWriter(msgpack_path)
+        for edge in EDGES:
+            writer.write(edge)
+        writer.close()
+
+        store_path = os.path.join(tmpdir, 'embedded')
+        build_embedded_store(msgpack_path, store_path)
+        finder = EmbeddedAssertionFinder(store_path)
+        yield finder
+
+
+def test_lookup_order(finder):
+    # Edges come back by descending weight, with ties in their input order
+    assert edge_ids(finder.lookup('/c/en/dog')) == [
+        EDGES[0]['uri'], EDGES[4]['uri'], EDGES[1]['uri'], EDGES[3]['uri']
+    ]
+    assert edge_ids(finder.lookup('/c/en/cat')) == [EDGES[2]['uri'], EDGES[4]['uri']]
+    assert edge_ids(finder.lookup('/r/IsA')) == [EDGES[2]['uri'], EDGES[0]['uri']]
+    assert finder.lookup('/c/en/unicorn') == []
+
+
+def test_query_criteria(finder):
+    assert edge_ids(finder.query({'start': '/c/en/dog'})) == [
+        EDGES[0]['uri'], EDGES[1]['uri']
+    ]
+    assert edge_ids(finder.query({'end': '/c/en/dog'})) == [
+        EDGES[4]['uri'], EDGES[3]['uri']
+    ]
+    assert edge_ids(finder.query({'node': '/c/en/dog', 'other': '/c/fr'})) == [
+        EDGES[3]['uri']
+    ]
+    assert edge_ids(finder.query({'rel': '/r/IsA', 'end': '/c/en/animal',
+                                  'start': '/c/en/cat'})) == [EDGES[2]['uri']]
+    assert edge_ids(finder.query({'source': '/s/process/wikiparsec'})) == [
+        EDGES[3]['uri']
+    ]
+    assert finder.query({'node': '/c/en/dog', 'rel': '/r/Antonym'}) == []
+
+
+def test_query_page(finder):
+    edges, token = finder.query_page({'dataset': '/d/conceptnet'}, limit=2)
+    assert edge_ids(edges) == [EDGES[2]['uri'], EDGES[0]['uri']]
+    edges, token = finder.query_page({'dataset': '/d/conceptnet'}, limit=2, after=token)
+    assert edge_ids(edges) == [EDGES[4]['uri'], EDGES[1]['uri']]
+    assert token is None
+
+    all_edges, _token = finder.query_page({}, limit=10)
+    assert len(all_edges) == len(EDGES)
+
+
+def test_lookup_assertion(finder):
+    uri = EDGES[1]['uri']
+    assert edge_ids(finder.lookup(uri)) == [uri]
+    assert finder.lookup_assertion('/a/[/r/IsA/,/c/en/dog/,/c/en/cat/]') == []
+
+
+def test_stored_linked_data(finder):
+    # Edges are stored already in the form the API returns, without their
+    # 'features'
+    with open(os.path.join(finder.path, 'edges.jsonl'), encoding='utf-8') as edge_file:
+        assert all('"@id":' in line and '"features"' not in line for line in edge_file)
+    expected = transform_for_linked_data(copy.deepcopy(EDGES[1]))
+    assert finder.lookup(EDGES[1]['uri']) == [expected]
+    assert transform_for_linked_data(expected) is expected
+
+
+def test_build_version(finder):
+    version = finder.build_version()
+    assert version and version == EmbeddedAssertionFinder(finder.path).build_version()
+
+
+def test_lookup_grouped_by_feature(finder):
+    features = finder.lookup_grouped_by_feature('/c/en/dog', limit=1)
+    assert sorted(features) == [
+        (0, '/r/RelatedTo'), (0, '/r/Synonym'), (1, '/r/CapableOf'), (1, '/r/IsA')
+    ]
+    assert edge_ids(features[(0, '/r/RelatedTo')]) == [EDGES[4]['uri']]
+    assert features[(0, '/r/Synonym')][0]['other']['@id'] == '/c/fr/chien'
+
+
+def test_iter_query(finder):
+    for criteria in [{}, {'node': '/c/en/dog'}, {'node': '/c/en/dog', 'other': '/c/fr'},
+                     {'rel': '/r/IsA'}, {'start': '/c/en/unicorn'}]:
+        assert list(finder.iter_query(criteria)) == finder.query(criteria, limit=100)
+
+
+def test_random_edges(finder):
+    all_ids = {edge['uri'] for edge in EDGES}
+    for limit in [1, 3, len(EDGES), 100]:
+        ids = edge_ids(finder.random_edges(limit=limit))
+        assert len(ids) == len(set(ids)) == min(limit, len(EDGES))
+        assert set(ids) <= all_ids
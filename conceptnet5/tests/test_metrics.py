@@ -0,0 +1,47 @@
+from conceptnet5.util.cache import LRUCache
+from conceptnet5.util.metrics import MetricsRegistry, instrument_methods
+
+
+class Adder(object):
+    def add(self, a, b):
+        return a + b
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    histogram = registry.histogram(
+        'request_seconds', 'Time to handle a request', ['route'], buckets=(0.1, 1.)
+    )
+    histogram.observe(['query'], 0.05)
+    histogram.observe(['query'], 0.5)
+    histogram.observe(['query'], 5.)
+    lines = registry.render().splitlines()
+    assert '# TYPE conceptnet_request_seconds histogram' in lines
+    assert 'conceptnet_request_seconds_bucket{route="query",le="0.1"} 1' in lines
+    assert 'conceptnet_request_seconds_bucket{route="query",le="1.0"} 2' in lines
+    assert 'conceptnet_request_seconds_bucket{route="query",le="+Inf"} 3' in lines
+    assert 'conceptnet_request_seconds_sum{route="query"} 5.55' in lines
+    assert 'conceptnet_request_seconds_count{route="query"} 3' in lines
+
+
+def test_instrument_methods():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('adder_seconds', 'Time spent adding', ['method'])
+    adder = Adder()
+    instrument_methods(adder, ['add'], histogram)
+    assert adder.add(2, b=3) == 5
+    assert adder.add.__name__ == 'add'
+    assert 'conceptnet_adder_seconds_count{method="add"} 1' in registry.render()
+
+
+def test_cache_stats():
+    registry = MetricsRegistry()
+    cache = LRUCache()
+    registry.add_cache('vectors', cache)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+    lines = registry.render().splitlines()
+    assert 'conceptnet_cache_hits_total{cache="vectors"} 1' in lines
+    assert 'conceptnet_cache_misses_total{cache="vectors"} 1' in lines
+    assert 'conceptnet_cache_hit_rate{cache="vectors"} 0.5' in lines
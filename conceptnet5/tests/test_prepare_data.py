@@ -0,0 +1,168 @@
+import os
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from conceptnet5.db.prepare_data import (
+    LOAD_STAGES,
+    TABLE_FILENAMES,
+    ChunkReader,
+    assertions_to_sql_csv,
+    msgpack_shard_ranges,
+    read_msgpack_range,
+    sharded_assertions_to_sql_csv,
+)
+from conceptnet5.db.schema import INDEX_STAGES, INDICES, create_indices_parallel
+from conceptnet5.edges import make_edge
+from conceptnet5.formats.msgpack_stream import MsgpackStreamWriter, read_msgpack_stream
+from conceptnet5.uri import Licenses
+
+RELS = ['/r/IsA', '/r/RelatedTo', '/r/Synonym', '/r/PartOf', '/r/AtLocation']
+TERMS = [
+    '/c/en/dog', '/c/en/dog/n', '/c/en/cat', '/c/en/animal', '/c/fr/chien',
+    '/c/en/house', '/c/ja/犬', '/c/en/tail/n/wn/body', '/c/de/hund', '/c/en/pet',
+]
+SOURCES = [
+    {'contributor': '/s/contributor/omcs'},
+    {'process': '/s/process/wikiparsec/2'},
+    {'activity': '/s/activity/omcs/vote', 'contributor': '/s/contributor/omcs/dev'},
+]
+
+
+def make_edges():
+    edges = []
+    for i in range(200):
+        start = TERMS[i % len(TERMS)]
+        end = TERMS[(i * 7 + 3) % len(TERMS)]
+        if start == end:
+            continue
+        edges.append(make_edge(
+            RELS[i % len(RELS)], start, end,
+            dataset='/d/test/{}'.format(i % 3),
+            license=Licenses.cc_attribution,
+            sources=[SOURCES[i % len(SOURCES)]],
+            weight=1.0 + (i % 4) / 2,
+            surfaceText='[[{}]]\twith a tab and a line\nbreak'.format(i),
+        ))
+    # make_edge gives the same URI to edges that differ only in their sources
+    unique = {}
+    for edge in edges:
+        unique.setdefault(edge['uri'], edge)
+    return list(unique.values())
+
+
+@pytest.fixture(scope='module')
+def msgpack_path():
+    with TemporaryDirectory(prefix='conceptnet-test') as tmpdir:
+        path = os.path.join(tmpdir, 'assertions.msgpack')
+        writer = MsgpackStreamWriter(path)
+        for edge in make_edges():
+            writer.write(edge)
+        writer.close()
+        yield path
+
+
+def read_tables(output_dir):
+    tables = {}
+    for table, filename in TABLE_FILENAMES.items():
+        with open(os.path.join(output_dir, filename), 'rb') as infile:
+            tables[table] = infile.read()
+    return tables
+
+
+def test_shard_ranges(msgpack_path):
+    ranges = msgpack_shard_ranges(msgpack_path, 7)
+    assert len(ranges) == 7
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == os.path.getsize(msgpack_path)
+    values = [
+        value for (start, end) in ranges
+        for value in read_msgpack_range(msgpack_path, start, end)
+    ]
+    assert values == list(read_msgpack_stream(msgpack_path))
+
+
+def test_sharded_output_is_identical(msgpack_path):
+    with TemporaryDirectory(prefix='conceptnet-test') as tmpdir:
+        single_dir = os.path.join(tmpdir, 'single')
+        sharded_dir = os.path.join(tmpdir, 'sharded')
+        os.makedirs(single_dir)
+        os.makedirs(sharded_dir)
+        assertions_to_sql_csv(msgpack_path, single_dir)
+        sharded_assertions_to_sql_csv(msgpack_path, sharded_dir, jobs=2, n_shards=5)
+
+        single = read_tables(single_dir)
+        assert single['edges'].count(b'\n') == len(make_edges())
+        assert read_tables(sharded_dir) == single
+        assert sorted(os.listdir(sharded_dir)) == sorted(TABLE_FILENAMES.values())
+
+
+def test_chunk_reader():
+    chunks = [b'abc', b'', b'defgh', b'i']
+    reader = ChunkReader(chunks)
+    pieces = []
+    while True:
+        piece = reader.read(4)
+        if not piece:
+            break
+        assert len(piece) <= 4
+        pieces.append(piece)
+    assert b''.join(pieces) == b'abcdefghi'
+
+
+def test_load_stages(msgpack_path):
+    # Every table is loaded once, from a file that prepare_data writes
+    # (edges_gin.csv is shuffled into edges_gin.shuf.csv by the Snakefile)
+    loaded = [tablename for stage in LOAD_STAGES for (tablename, _filename) in stage]
+    assert sorted(loaded) == sorted(TABLE_FILENAMES)
+    with TemporaryDirectory(prefix='conceptnet-test') as tmpdir:
+        assertions_to_sql_csv(msgpack_path, tmpdir)
+        for stage in LOAD_STAGES:
+            for tablename, filename in stage:
+                if filename == 'edges_gin.shuf.csv':
+                    filename = TABLE_FILENAMES[tablename]
+                assert os.path.exists(os.path.join(tmpdir, filename))
+
+
+def test_index_stages():
+    assert sorted(sum(INDEX_STAGES, [])) == sorted(INDICES)
+
+
+class FakeConnection(object):
+    def __init__(self, log):
+        self.log = log
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, cmd, params=None):
+        self.log.append(cmd % params if params else cmd)
+
+    def close(self):
+        self.closed = True
+
+
+def test_create_indices_parallel():
+    log = []
+    connections = []
+
+    def connect():
+        connections.append(FakeConnection(log))
+        return connections[-1]
+
+    timings = create_indices_parallel(connect, 3, maintenance_work_mem=512)
+    assert len(connections) == 3
+    assert all(conn.closed for conn in connections)
+    assert log[:3] == ["SET maintenance_work_mem = 512MB"] * 3
+    assert sorted(log[3:]) == sorted(INDICES)
+    # The indices on the materialized view are created after the view
+    view_index = [i for (i, cmd) in enumerate(log) if 'MATERIALIZED VIEW' in cmd][0]
+    assert sorted(log[view_index + 1:][-2:]) == sorted(INDEX_STAGES[1])
+    assert sorted(name for (name, seconds) in timings[-2:]) == ['rf_node', 'rf_unique']
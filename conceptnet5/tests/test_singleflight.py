@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from conceptnet5.util.singleflight import SingleFlight
+
+N_THREADS = 8
+
+
+def run_concurrently(func):
+    """
+    Call `func` from several threads at once, and return their results.
+    """
+    results = [None] * N_THREADS
+
+    def run(i):
+        try:
+            results[i] = func()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(N_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+def test_coalesce_concurrent_calls():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    @flight.coalesce
+    def lookup(term, criteria):
+        calls.append(term)
+        # Wait until every other thread is waiting for this call
+        release.wait(timeout=10)
+        return {'@id': term}
+
+    def release_when_coalesced():
+        for _attempt in range(10000):
+            if flight.coalesced >= N_THREADS - 1:
+                break
+            threading.Event().wait(0.001)
+        release.set()
+
+    threading.Thread(target=release_when_coalesced).start()
+    results = run_concurrently(lambda: lookup('/c/en/dog', criteria={'rel': '/r/IsA'}))
+    assert calls == ['/c/en/dog']
+    assert all(result is results[0] for result in results)
+
+    # Once the call is finished, the next one computes a new result
+    assert lookup('/c/en/dog', criteria={'rel': '/r/IsA'}) is not results[0]
+    assert len(calls) == 2
+
+
+def test_coalesce_errors():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('bad query')
+
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 'ok') == 'ok'
@@ -1,11 +1,17 @@
 import os
+from tempfile import TemporaryDirectory
 
 import numpy as np
 import pandas as pd
 import pytest
 
-from conceptnet5.uri import is_term
+from conceptnet5 import api
+from conceptnet5.uri import is_term, split_uri
+from conceptnet5.util.cache import LRUCache
 from conceptnet5.vectors import get_vector
+from conceptnet5.vectors.ann import IVFIndex
+from conceptnet5.vectors.formats import save_mmap
+from conceptnet5.vectors.neighbors import compute_neighbors, save_neighbors
 from conceptnet5.vectors.transforms import (
     l1_normalize_columns,
     l2_normalize_rows,
@@ -157,6 +163,21 @@ def test_load(simple_frame):
     assert '/c/en/Island' in vectors.frame.index  # no case folding
 
 
+def test_load_mmap(simple_frame):
+    vectors = VectorSpaceWrapper(frame=simple_frame)
+    vectors.load()
+    with TemporaryDirectory(prefix='conceptnet-test') as tmpdir:
+        save_mmap(vectors.frame, tmpdir, small_k=vectors.small_k)
+        mapped = VectorSpaceWrapper(tmpdir)
+        mapped.load()
+        assert mapped.frame.equals(vectors.frame)
+        assert mapped.small_frame.equals(vectors.small_frame)
+        assert mapped._index_prefix_range('/c/en/figure') == (3, 6)
+        assert list(mapped.similar_terms('/c/en/figure skating', limit=3).index) == list(
+            vectors.similar_terms('/c/en/figure skating', limit=3).index
+        )
+
+
 def test_englishify(simple_frame):
     vectors = VectorSpaceWrapper(frame=simple_frame)
     assert vectors._englishify('/c/sv/harry_potter') == '/c/en/harry_potter'
@@ -244,3 +265,168 @@ def test_cache_with_oov(multi_ling_frame):
     vectors.load()
     # check the vector of all zeros is returned if the term is not present
     assert not vectors.get_vector('/c/en/test', oov_vector=False).any()
+
+
+@pytest.fixture
+def random_frame():
+    rng = np.random.RandomState(0)
+    index = sorted(
+        '/c/{}/term{}'.format(language, i)
+        for language in ('de', 'en', 'fr')
+        for i in range(400)
+    )
+    return pd.DataFrame(data=rng.normal(size=(len(index), 20)), index=index)
+
+
+def test_ivf_index(random_frame):
+    matrix = random_frame.values
+    index = IVFIndex.build(matrix, n_lists=16)
+    assert index.n_rows == len(matrix)
+    vec = matrix[5]
+    exact = np.argsort(-(matrix @ vec))[:10]
+
+    # Probing every cluster gives exact results
+    assert list(index.search(matrix, vec, 10, n_probe=16)) == list(exact)
+
+    # Probing fewer clusters still finds the query itself
+    assert index.search(matrix, vec, 10, n_probe=2)[0] == 5
+
+    # Searching a range only returns rows in that range
+    found = index.search(matrix, vec, 10, n_probe=2, start=400, end=800)
+    assert len(found) == 10
+    assert all(400 <= row < 800 for row in found)
+
+
+def test_similar_terms_ann(random_frame):
+    vectors = VectorSpaceWrapper(frame=random_frame, n_probe=1000)
+    vectors.load()
+    assert vectors.ann_index is None
+    exact = vectors.similar_terms('/c/en/term7', limit=5)
+    exact_fr = vectors.similar_terms('/c/en/term7', filter='/c/fr', limit=5)
+
+    vectors._load_ann_index()
+    assert vectors.ann_index is not None
+    approx = vectors.similar_terms('/c/en/term7', limit=5)
+    assert list(approx.index) == list(exact.index)
+    approx_fr = vectors.similar_terms('/c/en/term7', filter='/c/fr', limit=5)
+    assert list(approx_fr.index) == list(exact_fr.index)
+    assert all(term.startswith('/c/fr/') for term in approx_fr.index)
+
+
+def test_precomputed_neighbors(random_frame):
+    vectors = VectorSpaceWrapper(frame=random_frame)
+    vectors.load()
+    neighbor_rows, neighbor_scores = compute_neighbors(
+        vectors.matrix, n_neighbors=10, processes=1, block_size=100
+    )
+    pooled_rows, pooled_scores = compute_neighbors(
+        vectors.matrix, n_neighbors=10, processes=2, block_size=100
+    )
+    assert (pooled_rows == neighbor_rows).all()
+    assert (pooled_scores == neighbor_scores).all()
+
+    with TemporaryDirectory(prefix='conceptnet-test') as tmpdir:
+        save_mmap(vectors.frame, tmpdir, small_k=vectors.small_k)
+        save_neighbors(neighbor_rows, neighbor_scores, tmpdir)
+        mapped = VectorSpaceWrapper(tmpdir)
+        found = mapped.precomputed_similar_terms('/c/en/term7', limit=5)
+        exact = vectors.similar_terms('/c/en/term7', limit=5, exact=True)
+        assert list(found.index) == list(exact.index)
+        assert np.allclose(found.values, exact.values, atol=1e-3)
+
+        # Queries the table can't answer are left to `similar_terms`
+        assert mapped.precomputed_similar_terms('/c/en/term7', limit=20) is None
+        assert mapped.precomputed_similar_terms('/c/en/unknown', limit=5) is None
+
+
+def test_relatedness_matrix(multi_ling_frame, monkeypatch):
+    vectors = VectorSpaceWrapper(frame=multi_ling_frame)
+    monkeypatch.setattr(api, 'VECTORS', vectors)
+    nodes_a = ['/c/en/gift', '/c/en/present', '/c/en/gifts']
+    nodes_b = ['/c/en/quiz', '/c/pl/kombinacja']
+    result = api.query_relatedness_matrix(nodes_a, nodes_b)
+    assert result['nodes_a'] == nodes_a
+    assert len(result['value']) == 3
+    for node_a, row in zip(nodes_a, result['value']):
+        for node_b, value in zip(nodes_b, row):
+            assert value == round(float(vectors.get_similarity(node_a, node_b)), 3)
+
+    square = api.query_relatedness_matrix(nodes_a)
+    assert square['value'][1][1] == 1.0
+    assert 'error' in api.query_relatedness_matrix([], nodes_b)
+
+
+def test_vector_cache(multi_ling_frame):
+    vectors = VectorSpaceWrapper(frame=multi_ling_frame)
+    vectors.load()
+    vectors.cache = LRUCache(max_items=3)
+    vec = vectors.get_vector('/c/en/gift')
+    assert vectors.get_vector('/c/en/gift') is vec
+
+    # Getting the vector also cached its expanded terms
+    stats = vectors.cache.stats()
+    assert stats['items'] == 2
+    assert stats['hits'] == 1
+
+    vectors.get_vector('/c/en/present')
+    assert vectors.cache.stats()['items'] == 3
+    assert vectors.cache.stats()['evictions'] == 1
+
+
+def test_similar_terms_batch(random_frame):
+    vectors = VectorSpaceWrapper(frame=random_frame)
+    vectors.load()
+    queries = ['/c/en/term7', '/c/fr/term12', '/c/eo/ekzemplo', [('/c/de/term3', 1.)]]
+    vecs = vectors.get_vectors(queries)
+    assert vecs.shape == (4, 20)
+    for query, vec in zip(queries, vecs):
+        assert np.allclose(vec, vectors.get_vector(query), atol=1e-6)
+
+    for filter in (None, '/c/fr'):
+        batch = vectors.similar_terms_batch(queries, filter=filter, limit=5)
+        for query, similar in zip(queries, batch):
+            expected = vectors.similar_terms(query, filter=filter, limit=5)
+            assert list(similar.index) == list(expected.index)
+
+
+def test_match_prefix_many(random_frame):
+    vectors = VectorSpaceWrapper(frame=random_frame)
+    vectors.load()
+
+    def match_prefix_by_trie(term, prefix_weight):
+        # The straightforward version of `_match_prefix`, which asks the trie
+        # about every prefix
+        while term:
+            if (
+                len(split_uri(term)) < 3
+                or term.endswith('/')
+                or (term[-2] == '/' and term[-1] < chr(0x3000))
+            ):
+                return []
+            prefixed = vectors._terms_with_prefix(term)
+            if prefixed:
+                return [(prefixed_term, prefix_weight / len(prefixed))
+                        for prefixed_term in prefixed]
+            term = term[:-1]
+        return []
+
+    terms = [
+        '/c/en/term12345', '/c/en/term3999', '/c/en/terminal', '/c/en/tea',
+        '/c/fr/term1x', '/c/de/term', '/c/ja/term', '/c/en/', '/c/zz/term1',
+        '/c/en/t', '/c/en/term1/n', '/c/fr/term399/n/wn',
+    ]
+    for term in terms:
+        assert vectors._match_prefix(term, 0.01) == match_prefix_by_trie(term, 0.01)
+
+
+def test_language_ranges(random_frame):
+    vectors = VectorSpaceWrapper(frame=random_frame)
+    vectors.load()
+    assert vectors.language_ranges == {
+        '/c/de/': (0, 400), '/c/en/': (400, 800), '/c/fr/': (800, 1200)
+    }
+    assert vectors._index_prefix_range('/c/fr/') == (800, 1200)
+    assert vectors._index_prefix_range('/c/en/term39') == (
+        vectors.row_index.row('/c/en/term39'), vectors.row_index.row('/c/en/term399') + 1
+    )
+    assert vectors._index_prefix_range('/c/es/') == (0, 0)
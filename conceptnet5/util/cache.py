@@ -0,0 +1,148 @@
+"""
+A bounded, thread-safe cache for long-running processes such as the API.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Marks a missing value, so that None can be cached
+_MISSING = object()
+
+
+def value_size(value):
+    """
+    Estimate how many bytes a cached value takes up. This counts the data in
+    NumPy arrays and the items of lists, tuples, and dictionaries, without
+    trying to be exact about shared objects.
+
+    >>> value_size(np.zeros(300, dtype='f')) >= 1200
+    True
+    """
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) + (0 if value.base is None else value.nbytes)
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(value_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(value_size(key) + value_size(val) for key, val in value.items())
+    return size
+
+
+class LRUCache(object):
+    """
+    A cache that discards the least recently used entries when it has more
+    than `max_items` entries, or when its values take up more than
+    `max_bytes` (as estimated by `value_size`). Either limit can be None.
+
+    If `ttl` is given, entries also expire that many seconds after they were
+    stored.
+
+    The cache counts its hits, misses, evictions, and expirations, which can
+    be read from `stats()` for monitoring.
+
+    >>> cache = LRUCache(max_items=2)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    """
+
+    def __init__(self, max_items=10000, max_bytes=None, ttl=None, clock=time.monotonic):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def get(self, key, default=None, count=True):
+        """
+        Get the value cached for `key`, marking it as recently used, or
+        return `default` if there is none. With `count=False`, the lookup
+        doesn't count as a hit or miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires = entry
+                if expires is not None and expires <= self.clock():
+                    self._remove(key)
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    if count:
+                        self.hits += 1
+                    return value
+            if count:
+                self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Cache `value` for `key`, evicting the least recently used entries if
+        that exceeds the cache's limits. A value that's bigger than
+        `max_bytes` on its own isn't cached.
+        """
+        size = value_size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires)
+            self.n_bytes += size
+            while (self.max_items is not None and len(self._entries) > self.max_items) or (
+                self.max_bytes is not None and self.n_bytes > self.max_bytes
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+
+    def stats(self):
+        """
+        Get a dictionary of the cache's size and counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'items': len(self._entries),
+                'bytes': self.n_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups) if lookups else 0.,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _remove(self, key):
+        _value, size, _expires = self._entries.pop(key)
+        self.n_bytes -= size
@@ -0,0 +1,182 @@
+"""
+Simple in-process metrics for long-running processes such as the API,
+which can be rendered in the Prometheus text format.
+
+Each process keeps its own metrics. When the API runs in several worker
+processes, each scrape of `/metrics` sees the worker that answered it.
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets for durations, in seconds
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.
+)
+
+
+def format_labels(labels):
+    """
+    Format a list of (name, value) pairs as Prometheus labels.
+
+    >>> format_labels([('route', 'query'), ('status', 200)])
+    '{route="query",status="200"}'
+    >>> format_labels([('path', 'a"b\\\\c')])
+    '{path="a\\\\"b\\\\\\\\c"}'
+    """
+    if not labels:
+        return ''
+    escaped = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'),
+        )
+        for (name, value) in labels
+    ]
+    return '{' + ','.join(escaped) + '}'
+
+
+def format_value(value):
+    """
+    >>> format_value(3)
+    '3'
+    >>> format_value(float('inf'))
+    '+Inf'
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+
+class Histogram(object):
+    """
+    A histogram of observed values, such as durations, with a separate
+    series for each combination of values of its labels.
+    """
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # Map each tuple of label values to its count in each bucket, with
+        # an extra bucket at the end for values above the last bound, and
+        # the sum of its values
+        self._counts = {}
+        self._sums = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        label_values = tuple(label_values)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if label_values not in self._counts:
+                self._counts[label_values] = [0] * (len(self.buckets) + 1)
+                self._sums[label_values] = 0.
+            self._counts[label_values][bucket] += 1
+            self._sums[label_values] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """
+        Observe how many seconds a `with` block takes.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(label_values, time.monotonic() - start)
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} histogram'.format(self.name),
+        ]
+        with self._lock:
+            series = sorted(
+                (label_values, list(counts), self._sums[label_values])
+                for (label_values, counts) in self._counts.items()
+            )
+        for label_values, counts, total in series:
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, format_labels(labels + [('le', format_value(bound))]), cumulative
+                ))
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(labels), cumulative))
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+    A collection of histograms, plus caches whose statistics are reported
+    when the metrics are rendered.
+    """
+
+    def __init__(self, prefix='conceptnet'):
+        self.prefix = prefix
+        self.histograms = []
+        self.caches = []
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(
+            '{}_{}'.format(self.prefix, name), description, label_names, buckets
+        )
+        self.histograms.append(histogram)
+        return histogram
+
+    def add_cache(self, name, cache):
+        """
+        Report the statistics of a cache with a `stats()` method, such as an
+        `LRUCache`, labeled with the given name.
+        """
+        self.caches.append((name, cache))
+
+    def render(self):
+        """
+        Get all the metrics in the Prometheus text format.
+        """
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        if self.caches:
+            stats = [(name, cache.stats()) for (name, cache) in self.caches]
+            for stat, metric_type, description in [
+                ('hits', 'counter', 'Lookups that found a cached value'),
+                ('misses', 'counter', "Lookups that didn't find a cached value"),
+                ('evictions', 'counter', 'Values removed to make room for others'),
+                ('items', 'gauge', 'Values in the cache'),
+                ('bytes', 'gauge', 'Estimated size of the values in the cache'),
+                ('hit_rate', 'gauge', 'Fraction of lookups that found a cached value'),
+            ]:
+                name = '{}_cache_{}'.format(self.prefix, stat)
+                if metric_type == 'counter':
+                    name += '_total'
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+                for cache_name, cache_stats in stats:
+                    lines.append('{}{} {}'.format(
+                        name, format_labels([('cache', cache_name)]), cache_stats[stat]
+                    ))
+        return '\n'.join(lines) + '\n'
+
+
+def instrument_methods(obj, method_names, histogram):
+    """
+    Replace methods of the object `obj` with versions that observe how long
+    they take in `histogram`, which should have one label, for the method
+    name.
+    """
+    for method_name in method_names:
+        method = getattr(obj, method_name)
+
+        def timed_method(*args, _method=method, _name=method_name, **kwargs):
+            with histogram.time(_name):
+                return _method(*args, **kwargs)
+
+        setattr(obj, method_name, functools.wraps(method)(timed_method))
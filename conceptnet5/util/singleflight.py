@@ -0,0 +1,88 @@
+"""
+Coalescing of identical concurrent calls, so that when many threads ask for
+the same thing at once, it's only computed once.
+"""
+import functools
+import threading
+
+
+def freeze(value):
+    """
+    Convert a value made of dictionaries and lists into an equivalent
+    hashable value, so it can be part of a key.
+
+    >>> freeze({'node': '/c/en/dog', 'rel': ['/r/IsA']})
+    (('node', '/c/en/dog'), ('rel', ('/r/IsA',)))
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(val)) for (key, val) in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Runs a function at most once at a time for each key. A thread that asks
+    for a key that's already being computed waits for that computation, and
+    gets the same result, or the same exception, instead of starting its own.
+
+    Results aren't kept after the computation finishes: this only combines
+    calls that overlap. The waiting threads share the result object, so it
+    shouldn't be modified.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Get the result of `func(*args, **kwargs)`, sharing it with any other
+        thread that's calling `do` with the same key at the same time.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def coalesce(self, func):
+        """
+        Decorate a function so that concurrent calls with equal arguments are
+        combined. The arguments can include dictionaries and lists.
+        """
+
+        @functools.wraps(func)
+        def coalesced(*args, **kwargs):
+            key = (func.__name__, freeze(args), freeze(kwargs))
+            return self.do(key, func, *args, **kwargs)
+
+        return coalesced
@@ -6,6 +6,7 @@ from sklearn.preprocessing import normalize
 
 from conceptnet5.nodes import standardized_concept_uri
 from conceptnet5.uri import uri_to_label
+from conceptnet5.vectors.engine import dot_rows, top_k, weighted_sum
 
 DOUBLE_DIGIT_RE = re.compile(r'[0-9][0-9]')
 DIGIT_RE = re.compile(r'[0-9]')
@@ -88,22 +89,17 @@ def cosine_similarity(vec1, vec2):
 def similar_to_vec(frame, vec, limit=50):
     # TODO: document the assumptions here
     # - frame and vec should be normalized
-    # - frame should not be made of 8-bit ints
     if vec.dot(vec) == 0.:
         return pd.Series(data=[], index=[], dtype='f')
-    similarity = frame.dot(vec)
-    return similarity.dropna().nlargest(limit)
+    similarity = dot_rows(frame.values, vec)
+    top = top_k(similarity, limit)
+    return pd.Series(data=similarity[top], index=frame.index[top])
 
 
 def weighted_average(frame, weight_series):
     if isinstance(weight_series, list):
         weight_dict = dict(weight_series)
         weight_series = pd.Series(weight_dict)
-    vec = np.zeros(frame.shape[1], dtype='f')
-
-    for i, label in enumerate(weight_series.index):
-        if label in frame.index:
-            val = weight_series[i]
-            vec += val * frame.loc[label].values
-
+    rows = frame.index.get_indexer(weight_series.index)
+    vec = weighted_sum(frame.values, rows, weight_series.values)
     return pd.Series(data=vec, index=frame.columns, dtype='f')
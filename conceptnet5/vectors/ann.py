@@ -0,0 +1,155 @@
+"""
+An approximate nearest-neighbor index for finding similar vectors without
+scanning the whole vocabulary.
+
+The index is an inverted file (IVF): the vectors are clustered with
+spherical k-means, and each cluster keeps a list of the rows that are closest
+to its centroid. A search compares the query to the centroids, and then
+scans only the rows in the `n_probe` closest clusters. Probing more clusters
+finds more of the true nearest neighbors, at the cost of scanning more rows.
+"""
+import numpy as np
+
+from conceptnet5.vectors.engine import normalize_rows, top_k
+
+# The number of clusters to probe when the caller doesn't say
+DEFAULT_N_PROBE = 16
+
+# How many rows to compare to the centroids at a time
+BLOCK_SIZE = 65536
+
+
+def _normalized(matrix):
+    """
+    L2-normalize the rows of a matrix as float32.
+    """
+    return normalize_rows(np.asarray(matrix, dtype=np.float32))
+
+
+def _nearest_centroids(matrix, centroids):
+    """
+    Find the index of the most similar centroid to each row of `matrix`.
+    """
+    nearest = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), BLOCK_SIZE):
+        block = _normalized(matrix[start:start + BLOCK_SIZE])
+        nearest[start:start + BLOCK_SIZE] = np.argmax(block @ centroids.T, axis=1)
+    return nearest
+
+
+class IVFIndex(object):
+    """
+    An inverted-file index over the rows of a matrix. The index doesn't store
+    the vectors themselves, so the matrix has to be passed to `search`.
+
+    The rows of cluster `i` are `list_rows[list_offsets[i]:list_offsets[i + 1]]`,
+    in increasing order.
+    """
+
+    def __init__(self, centroids, list_offsets, list_rows):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @property
+    def n_rows(self):
+        return len(self.list_rows)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix, n_lists=None, n_iter=10, sample_size=100000, seed=0):
+        """
+        Cluster the rows of `matrix` and build an index of them. By default,
+        there are about twice the square root of the number of rows clusters.
+
+        The centroids are trained on a random sample of at most `sample_size`
+        rows, and then every row is assigned to its nearest centroid.
+        """
+        n_rows = len(matrix)
+        if n_lists is None:
+            n_lists = max(1, int(2 * np.sqrt(n_rows)))
+        n_lists = min(n_lists, max(n_rows, 1))
+        rng = np.random.RandomState(seed)
+
+        if n_rows > sample_size:
+            sample_rows = np.sort(rng.choice(n_rows, sample_size, replace=False))
+            sample = _normalized(matrix[sample_rows])
+        else:
+            sample = _normalized(matrix)
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _iteration in range(n_iter):
+            assignments = _nearest_centroids(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=n_lists)
+
+            # Restart clusters that lost all their rows at random rows
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = _normalized(sums)
+
+        assignments = _nearest_centroids(matrix, centroids)
+        list_rows = np.argsort(assignments, kind='stable').astype(np.int32)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        return cls(centroids, list_offsets, list_rows)
+
+    def save(self, filename):
+        """
+        Save the index to a .npz file.
+        """
+        with open(filename, 'wb') as out:
+            np.savez(
+                out,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_rows=self.list_rows,
+            )
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load an index that was saved with `save`.
+        """
+        with np.load(filename) as data:
+            return cls(data['centroids'], data['list_offsets'], data['list_rows'])
+
+    def search(self, matrix, vec, limit, n_probe=DEFAULT_N_PROBE, start=0, end=None):
+        """
+        Find rows of `matrix` that approximately have the highest dot
+        products with `vec`. Returns an array of up to `limit` row numbers,
+        from most to least similar.
+
+        Only rows in the range from `start` to `end` are searched. If the
+        clusters we probe don't have enough rows in that range, we fall back
+        on scanning the whole range.
+        """
+        if end is None:
+            end = self.n_rows
+        if end <= start:
+            return np.zeros(0, dtype=np.int32)
+        vec = np.asarray(vec, dtype=np.float32)
+
+        n_probe = max(1, min(n_probe, self.n_lists))
+        centroid_scores = self.centroids @ vec
+        probed = top_k(centroid_scores, n_probe)
+        if len(probed) == 0:
+            # A NaN query vector has no similar rows
+            return np.zeros(0, dtype=np.int32)
+        rows = np.concatenate(
+            [
+                self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]]
+                for i in probed
+            ]
+        )
+        if start > 0 or end < self.n_rows:
+            rows = rows[(rows >= start) & (rows < end)]
+        if len(rows) < limit < end - start:
+            rows = np.arange(start, end)
+
+        scores = np.asarray(matrix[rows], dtype=np.float32) @ vec
+        return rows[top_k(scores, limit)]
@@ -15,12 +15,15 @@ from .formats import (
     load_hdf,
     save_hdf,
     save_labels,
+    save_mmap,
     save_npy,
 )
 from .merge import merge_intersect
 from .miniaturize import miniaturize
+from .neighbors import N_NEIGHBORS, compute_neighbors, save_neighbors
 from .propagate import sharded_propagate
-from .query import VectorSpaceWrapper
+from .ann import IVFIndex
+from .query import VectorSpaceWrapper, ann_index_filename
 from .retrofit import join_shards, sharded_retrofit
 from .transforms import make_big_frame, make_small_frame
 
@@ -238,7 +241,8 @@ def run_compare_embeddings(input_filenames, output_filename, run_analogies):
     and the results will be saved in an HDF5 file, `output_filename`. This
     file can be used by `comparison_graph`.
 
-    This requires the PostgreSQL database of ConceptNet 5 to be built, because
+    This requires the ConceptNet 5 database to be built -- either in PostgreSQL,
+    or as an embedded store selected with CONCEPTNET_DB_BACKEND -- because
     it finds embeddings of uncommon words on the fly by looking up their
     neighbors in the ConceptNet graph. These embeddings could have been stored
     in the matrix, but this saves memory and download time.
@@ -289,6 +293,56 @@ def run_miniaturize(input_filename, extra_vocab_filename, output_filename, k):
     save_hdf(mini, output_filename)
 
 
+@cli.command(name='export_mmap')
+@click.argument('input_filename', type=click.Path(readable=True, dir_okay=False))
+@click.argument(
+    'output_dir', type=click.Path(writable=True, dir_okay=True, file_okay=False)
+)
+def run_export_mmap(input_filename, output_dir):
+    """
+    Export a vector space as a directory of files that VectorSpaceWrapper
+    can memory-map, instead of reading and processing an HDF5 file when it
+    starts.
+    """
+    vectors = VectorSpaceWrapper(input_filename, use_index=False)
+    vectors.load()
+    save_mmap(vectors.frame, output_dir, small_k=vectors.small_k)
+
+
+@cli.command(name='build_ann')
+@click.argument('input_filename', type=click.Path(readable=True, dir_okay=True))
+@click.option('--n-lists', type=int, default=None, help="Number of clusters")
+def run_build_ann(input_filename, n_lists):
+    """
+    Build the approximate nearest-neighbor index that VectorSpaceWrapper uses
+    to find similar terms, and save it next to the input file, or inside it
+    if it's a directory from `export_mmap`.
+    """
+    vectors = VectorSpaceWrapper(input_filename, use_index=False)
+    vectors.load()
+    index = IVFIndex.build(vectors.small_frame.values, n_lists=n_lists)
+    index.save(ann_index_filename(input_filename))
+
+
+@cli.command(name='precompute_neighbors')
+@click.argument('input_filename', type=click.Path(readable=True, dir_okay=True))
+@click.option('--n-neighbors', type=int, default=N_NEIGHBORS)
+@click.option('--processes', type=int, default=None, help="Number of worker processes")
+def run_precompute_neighbors(input_filename, n_neighbors, processes):
+    """
+    Find the nearest neighbors of every term in a vector space, and save
+    them as a table next to the input file, or inside it if it's a
+    directory from `export_mmap`, so that the API can look up related terms
+    without searching.
+    """
+    vectors = VectorSpaceWrapper(input_filename, use_index=False)
+    vectors.load()
+    neighbor_rows, neighbor_scores = compute_neighbors(
+        vectors.matrix, n_neighbors=n_neighbors, processes=processes
+    )
+    save_neighbors(neighbor_rows, neighbor_scores, input_filename)
+
+
 @cli.command(name='export_background')
 @click.argument('input_filename', type=click.Path(readable=True, dir_okay=False))
 @click.argument('output_dir', type=click.Path(writable=True, dir_okay=True))
@@ -4,6 +4,7 @@ from sklearn import svm
 from sklearn.preprocessing import normalize
 
 from conceptnet5.vectors import normalize_vec, standardized_uri
+from conceptnet5.vectors.engine import weighted_sum
 
 # A list of English words referring to nationalities, nations, ethnicities, and
 # religions. Our goal is to prevent ConceptNet from learning insults and
@@ -387,12 +388,10 @@ def get_weighted_vector(frame, weighted_terms):
 
     A simplified version of VectorSpaceWrapper.get_vector().
     """
-    total = frame.iloc[0] * 0.
-    for term, weight in weighted_terms:
-        if term in frame.index:
-            vec = frame.loc[term]
-            total += vec * weight
-    return normalize_vec(total)
+    terms = [term for term, weight in weighted_terms]
+    weights = [weight for term, weight in weighted_terms]
+    rows = frame.index.get_indexer(terms)
+    return normalize_vec(weighted_sum(frame.values, rows, weights))
 
 
 def get_category_axis(frame, category_examples):
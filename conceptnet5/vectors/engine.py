@@ -0,0 +1,126 @@
+"""
+Tools for looking up vectors by integer row numbers, so that the work of
+answering a query is done by NumPy instead of by pandas indexing.
+
+A `RowIndex` maps labels to row numbers once, and the functions here combine
+and rank rows of a plain NumPy matrix given those row numbers.
+"""
+import numpy as np
+
+
+def weighted_sum(matrix, rows, weights):
+    """
+    Get the sum of the given rows of `matrix`, multiplied by their weights,
+    as a float32 vector. Rows numbered -1, meaning labels that weren't found,
+    are skipped.
+
+    >>> matrix = np.array([[1, 0], [0, 1], [1, 1]], dtype='i1')
+    >>> weighted_sum(matrix, [0, -1, 2], [0.5, 1.0, 2.0])
+    array([2.5, 2. ], dtype=float32)
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    weights = np.asarray(weights, dtype='f')
+    found = rows >= 0
+    if not found.any():
+        return np.zeros(matrix.shape[1], dtype='f')
+    return np.dot(weights[found], np.asarray(matrix[rows[found]], dtype='f'))
+
+
+def dot_rows(matrix, vec, start=0, end=None, block_size=65536):
+    """
+    Get the dot products of `vec` with the rows of `matrix` from `start` to
+    `end`, as float32. The rows are converted to floats a block at a time, so
+    that an 8-bit matrix doesn't have to be copied all at once.
+
+    >>> dot_rows(np.array([[1, 2], [3, 4], [5, 6]], dtype='i1'), np.array([1., 1.]), 1)
+    array([ 7., 11.], dtype=float32)
+    """
+    if end is None:
+        end = len(matrix)
+    vec = np.asarray(vec, dtype='f')
+    scores = np.zeros(max(end - start, 0), dtype='f')
+    for block_start in range(start, end, block_size):
+        block_end = min(block_start + block_size, end)
+        block = np.asarray(matrix[block_start:block_end], dtype='f')
+        scores[block_start - start:block_end - start] = block.dot(vec)
+    return scores
+
+
+def normalize_rows(matrix):
+    """
+    L2-normalize the rows of a float array, leaving rows of zeroes as they
+    are.
+
+    >>> normalize_rows(np.array([[3., 4.], [0., 0.]]))
+    array([[0.6, 0.8],
+           [0. , 0. ]])
+    """
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k(scores, limit):
+    """
+    Get the positions of the `limit` highest scores, from highest to lowest,
+    skipping NaN scores. Equal scores stay in their original order, as they
+    would with pandas' `nlargest`.
+
+    >>> top_k(np.array([0.5, np.nan, 0.9, 0.5, 0.1]), 3)
+    array([2, 0, 3])
+    """
+    positions = np.flatnonzero(~np.isnan(scores))
+    scores = scores[positions]
+    if limit < len(positions):
+        # Include every score that ties with the last one we keep, so that
+        # ties are broken by position, not by the partition
+        threshold = -np.partition(-scores, limit - 1)[limit - 1]
+        keep = scores >= threshold
+        positions = positions[keep]
+        scores = scores[keep]
+    order = np.lexsort((positions, -scores))[:limit]
+    return positions[order]
+
+
+class RowIndex(object):
+    """
+    A mapping from labels to their row numbers in a matrix.
+
+    By default, this is a dictionary built from the list of labels. A vector
+    space that's been exported with `cn5-vectors export_mmap` instead comes
+    with a trie of its labels and an array of the row number for each key
+    ID in the trie, so nothing has to be built when it's loaded.
+    """
+
+    def __init__(self, labels, trie=None, trie_rows=None):
+        self.labels = labels
+        self.trie = trie
+        self.trie_rows = trie_rows
+        if trie is None or trie_rows is None:
+            self._rows = {label: row for (row, label) in enumerate(labels)}
+        else:
+            self._rows = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return self.row(label) >= 0
+
+    def row(self, label):
+        """
+        Get the row number of a label, or -1 if it isn't in the matrix.
+        """
+        if self._rows is not None:
+            return self._rows.get(label, -1)
+        key_id = self.trie.get(label)
+        if key_id is None:
+            return -1
+        return int(self.trie_rows[key_id])
+
+    def rows(self, labels):
+        """
+        Get an array of the row numbers of many labels, with -1 for labels
+        that aren't in the matrix.
+        """
+        return np.array([self.row(label) for label in labels], dtype=np.int64)
@@ -366,7 +366,7 @@ def eval_open_vocab_analogies(vectors, quads, vocab_size=200000, verbose=False):
     test sets.
     """
     vocab = choose_vocab(quads, vocab_size)
-    vecs = np.vstack([vectors.get_vector(word) for word in vocab])
+    vecs = vectors.get_vectors(vocab)
     tframe = pd.DataFrame(vecs, index=vocab)
     total = 0
     correct = 0
@@ -626,15 +626,23 @@ def measure_correlation(correlation_function, vectors, standard, verbose=0):
     computes the spearman correlation between assoc_space's reported word
     correlation and the expected word correlation according to 'standard'.
     """
+    standard = list(standard)
     gold_scores = []
     our_scores = []
 
-    for term1, term2, gold_score, lang1, lang2 in standard:
+    if isinstance(vectors, VectorSpaceWrapper):
+        # Look up all the vectors at once. They're normalized, so their
+        # cosine similarities are their dot products.
+        uris1 = [standardized_uri(lang1, term1) for term1, _, _, lang1, _ in standard]
+        uris2 = [standardized_uri(lang2, term2) for _, term2, _, _, lang2 in standard]
+        vecs1 = vectors.get_vectors(uris1)
+        vecs2 = vectors.get_vectors(uris2)
+        wrapper_scores = np.einsum('ij,ij->i', vecs1, vecs2)
+
+    for i, (term1, term2, gold_score, lang1, lang2) in enumerate(standard):
 
         if isinstance(vectors, VectorSpaceWrapper):
-            uri1 = standardized_uri(lang1, term1)
-            uri2 = standardized_uri(lang2, term2)
-            our_score = vectors.get_similarity(uri1, uri2)
+            our_score = wrapper_scores[i]
 
         else:
             our_score = cosine_similarity(
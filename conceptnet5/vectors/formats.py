@@ -1,7 +1,9 @@
 import gzip
+import os
 import pickle
 import struct
 
+import marisa_trie
 import numpy as np
 import pandas as pd
 
@@ -29,6 +31,60 @@ def save_hdf(table, filename):
     return table.to_hdf(filename, 'mat', mode='w', encoding='utf-8')
 
 
+def save_mmap(frame, dirname, small_k=100):
+    """
+    Save a semantic vector space as a directory of files that can be
+    memory-mapped by `load_mmap`:
+
+    - `vectors.npy`, the matrix
+    - `small.npy`, a contiguous copy of its first `small_k` columns
+    - `labels.txt`, the row labels, one per line
+    - `labels.marisa`, a trie of the row labels
+    - `label_rows.npy`, the row number of each key ID in the trie
+
+    The frame should already be in the form that VectorSpaceWrapper uses,
+    with its index sorted.
+    """
+    os.makedirs(dirname, exist_ok=True)
+    np.save(os.path.join(dirname, 'vectors.npy'), frame.values)
+    np.save(
+        os.path.join(dirname, 'small.npy'),
+        np.ascontiguousarray(frame.values[:, :small_k]),
+    )
+    save_index_as_labels(frame.index, os.path.join(dirname, 'labels.txt'))
+    trie = marisa_trie.Trie(list(frame.index))
+    trie.save(os.path.join(dirname, 'labels.marisa'))
+    label_rows = np.zeros(len(trie), dtype=np.int64)
+    for row, label in enumerate(frame.index):
+        label_rows[trie[label]] = row
+    np.save(os.path.join(dirname, 'label_rows.npy'), label_rows)
+
+
+def load_mmap(dirname):
+    """
+    Load a semantic vector space saved by `save_mmap`. Returns the
+    DataFrames of the full and small matrices, the trie of its labels, and
+    the array of the row number for each key ID in the trie (or None, if
+    that wasn't saved).
+
+    The matrices are memory-mapped read-only, so processes that load the
+    same files share one copy of them in the page cache.
+    """
+    index = load_labels_as_index(os.path.join(dirname, 'labels.txt'))
+    vectors = np.load(os.path.join(dirname, 'vectors.npy'), mmap_mode='r')
+    small = np.load(os.path.join(dirname, 'small.npy'), mmap_mode='r')
+    trie = marisa_trie.Trie()
+    trie.mmap(os.path.join(dirname, 'labels.marisa'))
+    label_rows_path = os.path.join(dirname, 'label_rows.npy')
+    if os.path.exists(label_rows_path):
+        label_rows = np.load(label_rows_path, mmap_mode='r')
+    else:
+        label_rows = None
+    frame = pd.DataFrame(vectors, index=index, copy=False)
+    small_frame = pd.DataFrame(small, index=index, copy=False)
+    return frame, small_frame, trie, label_rows
+
+
 def save_labels(table, vocab_filename):
     save_index_as_labels(table.index, vocab_filename)
 
@@ -0,0 +1,130 @@
+"""
+A precomputed table of the nearest neighbors of every term in a vector space,
+so that the most common query for related terms -- a single term in the
+vocabulary, with no filter -- can be answered by looking up one row.
+
+The table is two arrays with a row for each term: the int32 row numbers of
+its nearest neighbors, from most to least similar, and their cosine
+similarities as float16.
+"""
+import os
+from multiprocessing import Pool
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from conceptnet5.vectors.engine import normalize_rows, top_k
+
+# How many neighbors to keep for each term
+N_NEIGHBORS = 100
+
+# How many rows to compare to the whole matrix at a time. Each block makes a
+# float32 array of this many rows by the number of terms.
+BLOCK_SIZE = 256
+
+# The normalized matrix, in each worker process of `compute_neighbors`
+_worker_matrix = None
+
+
+def block_neighbors(matrix, start, end, n_neighbors):
+    """
+    Find the nearest neighbors of the rows of `matrix` from `start` to `end`,
+    given that the rows of `matrix` are already normalized. Returns an array
+    of their row numbers and an array of their similarities, each with one
+    row per row of the block. A row is its own nearest neighbor.
+
+    Ties are broken by row number, as they are in `similar_terms`.
+    """
+    scores = np.asarray(matrix[start:end]) @ np.asarray(matrix).T
+    n_neighbors = min(n_neighbors, len(matrix))
+    rows = np.zeros((end - start, n_neighbors), dtype=np.int32)
+    similarities = np.zeros((end - start, n_neighbors), dtype=np.float16)
+    for i, row_scores in enumerate(scores):
+        top = top_k(row_scores, n_neighbors)
+        rows[i, : len(top)] = top
+        similarities[i, : len(top)] = row_scores[top]
+    return rows, similarities
+
+
+def _init_worker(matrix_filename):
+    global _worker_matrix
+    _worker_matrix = np.load(matrix_filename, mmap_mode='r')
+
+
+def _worker_block_neighbors(block):
+    start, end, n_neighbors = block
+    return block_neighbors(_worker_matrix, start, end, n_neighbors)
+
+
+def compute_neighbors(matrix, n_neighbors=N_NEIGHBORS, processes=None, block_size=BLOCK_SIZE):
+    """
+    Find the `n_neighbors` nearest neighbors of every row of `matrix` by
+    cosine similarity, returning a table of their row numbers and a table
+    of their similarities.
+
+    The rows are compared to the whole matrix in blocks of `block_size`,
+    which are divided among `processes` worker processes (by default, one
+    per CPU). The workers share one memory-mapped copy of the normalized
+    matrix.
+    """
+    normalized = normalize_rows(np.asarray(matrix, dtype='f'))
+    n_rows = len(normalized)
+    n_neighbors = min(n_neighbors, n_rows)
+    neighbor_rows = np.zeros((n_rows, n_neighbors), dtype=np.int32)
+    neighbor_scores = np.zeros((n_rows, n_neighbors), dtype=np.float16)
+    blocks = [
+        (start, min(start + block_size, n_rows), n_neighbors)
+        for start in range(0, n_rows, block_size)
+    ]
+
+    def store(results):
+        for (start, end, _n), (rows, scores) in zip(blocks, results):
+            neighbor_rows[start:end] = rows
+            neighbor_scores[start:end] = scores
+
+    if processes == 1:
+        store(block_neighbors(normalized, *block) for block in blocks)
+    else:
+        with TemporaryDirectory(prefix='conceptnet-neighbors') as tmpdir:
+            matrix_filename = os.path.join(tmpdir, 'normalized.npy')
+            np.save(matrix_filename, normalized)
+            with Pool(processes, initializer=_init_worker, initargs=(matrix_filename,)) as pool:
+                store(pool.imap(_worker_block_neighbors, blocks))
+    return neighbor_rows, neighbor_scores
+
+
+def neighbor_filenames(vector_filename):
+    """
+    Get the filenames where the neighbor table for a file of vectors is
+    saved, such as `mini.neighbor_rows.npy` and `mini.neighbor_scores.npy`
+    for `mini.h5`. A directory of memory-mapped vectors keeps its table
+    inside the directory.
+    """
+    if os.path.isdir(vector_filename):
+        base = os.path.join(vector_filename, '')
+    else:
+        base = os.path.splitext(vector_filename)[0] + '.'
+    return base + 'neighbor_rows.npy', base + 'neighbor_scores.npy'
+
+
+def save_neighbors(neighbor_rows, neighbor_scores, vector_filename):
+    """
+    Save a neighbor table from `compute_neighbors` for a file of vectors.
+    """
+    rows_filename, scores_filename = neighbor_filenames(vector_filename)
+    np.save(rows_filename, neighbor_rows.astype(np.int32))
+    np.save(scores_filename, neighbor_scores.astype(np.float16))
+
+
+def load_neighbors(vector_filename):
+    """
+    Memory-map the neighbor table for a file of vectors, returning its row
+    numbers and similarities, or None if it hasn't been built.
+    """
+    rows_filename, scores_filename = neighbor_filenames(vector_filename)
+    if not (os.path.exists(rows_filename) and os.path.exists(scores_filename)):
+        return None
+    return (
+        np.load(rows_filename, mmap_mode='r'),
+        np.load(scores_filename, mmap_mode='r'),
+    )
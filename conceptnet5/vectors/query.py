@@ -1,3 +1,5 @@
+import os
+
 import marisa_trie
 import numpy as np
 import pandas as pd
@@ -5,19 +7,35 @@ import pandas as pd
 import wordfreq
 from conceptnet5.uri import get_uri_language, split_uri, uri_prefix
 from conceptnet5.util import get_data_filename
-from conceptnet5.vectors import (
-    cosine_similarity,
-    normalize_vec,
-    similar_to_vec,
-    standardized_uri,
-    weighted_average,
+from conceptnet5.util.cache import LRUCache
+from conceptnet5.vectors import cosine_similarity, normalize_vec, standardized_uri
+from conceptnet5.vectors.ann import DEFAULT_N_PROBE, IVFIndex
+from conceptnet5.vectors.engine import (
+    RowIndex,
+    dot_rows,
+    normalize_rows,
+    top_k,
+    weighted_sum,
 )
-from conceptnet5.vectors.formats import load_hdf
-from conceptnet5.vectors.transforms import l2_normalize_rows
+from conceptnet5.vectors.formats import load_hdf, load_mmap
+from conceptnet5.vectors.neighbors import load_neighbors
 
 # Magnitudes smaller than this tell us that we didn't find anything meaningful
 SMALL = 1e-6
 
+# How many rows of the vector space to compare to a batch of queries at once,
+# and how many queries to re-rank at once, in `similar_terms_batch`
+BATCH_ROW_BLOCK = 65536
+BATCH_QUERY_BLOCK = 64
+
+# Limits on the cache of query vectors and expanded terms
+CACHE_MAX_ITEMS = 100000
+CACHE_MAX_BYTES = 256 * 2 ** 20
+
+# Vector spaces with fewer rows than this are searched exhaustively, because
+# an approximate index wouldn't save much time
+ANN_MIN_ROWS = 50000
+
 
 class MissingVectorSpace(Exception):
     pass
@@ -54,22 +72,43 @@ class VectorSpaceWrapper(object):
     look in default locations for them. They can be specified to replace them
     with toy versions for testing, or to evaluate how other embeddings perform
     while still using ConceptNet for looking up words outside their vocabulary.
+
+    Large vector spaces are searched with an approximate nearest-neighbor
+    index, which is loaded from next to the vector file if it's been built
+    with `cn5-vectors build_ann`, or built when the vectors are loaded
+    otherwise. `n_probe` sets how many of its clusters to search: more
+    clusters give more accurate results more slowly. Set `use_index=False`
+    to always search exhaustively.
+
+    If a table of every term's nearest neighbors has been saved next to the
+    vector file with `cn5-vectors precompute_neighbors`, it's memory-mapped
+    as well, and `precomputed_similar_terms` looks up terms in it.
     """
 
-    def __init__(self, vector_filename=None, frame=None):
+    def __init__(
+        self, vector_filename=None, frame=None, use_index=True, n_probe=DEFAULT_N_PROBE
+    ):
         if frame is None:
             self.frame = None
-            self.vector_filename = vector_filename or get_data_filename(
-                'vectors/mini.h5'
-            )
+            self.vector_filename = vector_filename or default_vector_filename()
         else:
             self.frame = frame
             self.vector_filename = None
         self.small_frame = None
+        self.matrix = None
+        self.small_matrix = None
+        self.sorted_labels = None
+        self.language_ranges = None
+        self.row_index = None
         self.k = None
         self.small_k = None
         self.trie = None
-        self.cache = {}
+        self.cache = LRUCache(max_items=CACHE_MAX_ITEMS, max_bytes=CACHE_MAX_BYTES)
+        self.use_index = use_index
+        self.n_probe = n_probe
+        self.ann_index = None
+        self.neighbor_rows = None
+        self.neighbor_scores = None
 
     def load(self):
         """
@@ -77,6 +116,9 @@ class VectorSpaceWrapper(object):
         """
         if self.small_frame is not None:
             return
+        if self.frame is None and os.path.isdir(self.vector_filename):
+            self._load_mmap()
+            return
         try:
             if self.frame is None:
                 self.frame = load_hdf(self.vector_filename)
@@ -100,6 +142,73 @@ class VectorSpaceWrapper(object):
                 "download it?" % self.vector_filename
             )
         self._build_trie()
+        self._index_rows()
+        if self.use_index and len(self.frame) >= ANN_MIN_ROWS:
+            self._load_ann_index()
+        self._load_neighbors()
+
+    def _index_rows(self, trie_rows=None):
+        """
+        Get the NumPy matrices underlying our DataFrames, and map our labels to
+        their row numbers, so that queries can be answered without pandas
+        indexing.
+        """
+        self.matrix = self.frame.values
+        self.small_matrix = self.small_frame.values
+        self.sorted_labels = self.frame.index.values
+        self._build_language_ranges()
+        self.row_index = RowIndex(self.frame.index, self._trie, trie_rows)
+
+    def _load_mmap(self):
+        """
+        Load a vector space that was exported as a directory of memory-mapped
+        files by `cn5-vectors export_mmap`. These are already in the form we
+        need, so nothing has to be computed or copied.
+        """
+        try:
+            self.frame, small_frame, self._trie, trie_rows = load_mmap(
+                self.vector_filename
+            )
+        except OSError:
+            raise MissingVectorSpace(
+                "Couldn't load the vector space %r. Do you need to build or "
+                "download it?" % self.vector_filename
+            )
+        self.k = self.frame.shape[1]
+        self.small_k = small_frame.shape[1]
+        self.small_frame = small_frame
+        self._index_rows(trie_rows)
+        if self.use_index and len(self.frame) >= ANN_MIN_ROWS:
+            self._load_ann_index()
+        self._load_neighbors()
+
+    def _load_ann_index(self):
+        """
+        Load the approximate nearest-neighbor index over `small_frame`, or
+        build it if it hasn't been saved for this vector space.
+        """
+        if self.vector_filename is not None:
+            index_filename = ann_index_filename(self.vector_filename)
+            if os.path.exists(index_filename):
+                index = IVFIndex.load(index_filename)
+                if (
+                    index.n_rows == len(self.small_frame)
+                    and index.centroids.shape[1] == self.small_k
+                ):
+                    self.ann_index = index
+                    return
+        self.ann_index = IVFIndex.build(self.small_matrix)
+
+    def _load_neighbors(self):
+        """
+        Memory-map the table of precomputed nearest neighbors, if it's been
+        built for this vector space.
+        """
+        if self.vector_filename is None:
+            return
+        table = load_neighbors(self.vector_filename)
+        if table is not None and len(table[0]) == len(self.frame):
+            self.neighbor_rows, self.neighbor_scores = table
 
     def _build_trie(self):
         """
@@ -129,7 +238,17 @@ class VectorSpaceWrapper(object):
             return englishified
 
     def _match_prefix(self, term, prefix_weight):
+        """
+        Find the terms in the vocabulary that start with the longest possible
+        prefix of `term`, giving them equal shares of `prefix_weight`.
+
+        We shorten the term a character at a time until it's too general to
+        be useful. Instead of asking the trie whether each of these prefixes
+        has any completions, we work out in advance how long a prefix can be
+        and still have completions, and only list the completions once.
+        """
         results = []
+        longest = self._longest_completed_prefix(term)
         while term:
             # Skip excessively general lookups, for either an entire
             # language, or all terms starting with a single
@@ -140,8 +259,8 @@ class VectorSpaceWrapper(object):
                 or (term[-2] == '/' and term[-1] < chr(0x3000))
             ):
                 break
-            prefixed = self._terms_with_prefix(term)
-            if prefixed:
+            if len(term) <= longest:
+                prefixed = self._terms_with_prefix(term)
                 n_prefixed = len(prefixed)
                 for prefixed_term in prefixed:
                     results.append((prefixed_term, prefix_weight / n_prefixed))
@@ -158,10 +277,21 @@ class VectorSpaceWrapper(object):
         This helps increase the recall power of the vector space, because it means
         you can find terms that are too infrequent to have their own vector, getting
         a reasonable guess at the vector they might have.
+
+        The results are cached, because finding terms by their prefixes can
+        take many lookups in the trie.
         """
+        cache_key = ('expand_terms', tuple(terms), oov_vector)
+        expanded = self.cache.get(cache_key)
+        if expanded is None:
+            expanded = self._expand_terms(terms, oov_vector)
+            self.cache.put(cache_key, expanded)
+        return list(expanded)
+
+    def _expand_terms(self, terms, oov_vector):
         expanded = terms[:]
         for term, weight in terms:
-            if oov_vector and term not in self.frame.index:
+            if oov_vector and term not in self.row_index:
                 prefix_weight = 0.01
                 if get_uri_language(term) != 'en':
                     englishified = self._englishify(term)
@@ -188,10 +318,12 @@ class VectorSpaceWrapper(object):
         - The vectors for equivalently spelled terms in the English vocabulary
         - The vectors for terms that share a sufficiently-long prefix with
           any terms in this list that are out-of-vocabulary
+
+        The vector is returned as a NumPy array.
         """
-        return weighted_average(
-            self.frame, self.expand_terms(terms, oov_vector)
-        )
+        weights = dict(self.expand_terms(terms, oov_vector))
+        rows = self.row_index.rows(weights.keys())
+        return weighted_sum(self.matrix, rows, list(weights.values()))
 
     def text_to_vector(self, language, text):
         """
@@ -227,17 +359,18 @@ class VectorSpaceWrapper(object):
         else:
             raise ValueError("Can't make a query out of type %s" % type(query))
 
-        cache_key = tuple(terms + [oov_vector])
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        cache_key = ('vector', tuple(terms), oov_vector)
+        vec = self.cache.get(cache_key)
+        if vec is not None:
+            return vec
 
         oov_vector = oov_vector and (len(terms) <= 5)
 
-        vec = self.expanded_vector(terms, oov_vector=oov_vector)
-        self.cache[cache_key] = normalize_vec(vec)
-        return self.cache[cache_key]
+        vec = normalize_vec(self.expanded_vector(terms, oov_vector=oov_vector))
+        self.cache.put(cache_key, vec)
+        return vec
 
-    def similar_terms(self, query, filter=None, limit=20):
+    def similar_terms(self, query, filter=None, limit=20, exact=False, n_probe=None):
         """
         Get a Series of terms ranked by their similarity to the query.
         The query can be:
@@ -251,39 +384,190 @@ class VectorSpaceWrapper(object):
 
         If the query contains 5 or fewer terms, it will be expanded using the
         out-of-vocab strategy.
+
+        The candidates are found using the approximate nearest-neighbor
+        index, if there is one, probing `n_probe` of its clusters. Set
+        `exact=True` to compare the query to every term instead.
         """
         self.load()
         vec = self.get_vector(query)
         small_vec = vec[: self.small_k]
-        search_frame = self.small_frame
-        # TODO: document filter
-        if filter:
-            exact_only = filter.count('/') >= 3
-            if filter.endswith('/.'):
-                filter = filter[:-2]
-                exact_only = True
-            if exact_only:
-                if filter in search_frame.index:
-                    idx = search_frame.index.get_loc(filter)
-                    search_frame = search_frame[idx : idx + 1]
-                else:
-                    search_frame = search_frame.iloc[0:0]
-            else:
-                start_idx, end_idx = self._index_prefix_range(filter + '/')
-                search_frame = search_frame.iloc[start_idx:end_idx]
-        similar_sloppy = similar_to_vec(search_frame, small_vec, limit=limit * 50)
-        similar_choices = l2_normalize_rows(
-            self.frame.loc[similar_sloppy.index].astype('f')
+        if small_vec.dot(small_vec) == 0.:
+            return empty_series()
+        start_idx, end_idx = self._filter_range(filter)
+        n_candidates = limit * 50
+        if exact or self.ann_index is None:
+            scores = dot_rows(self.small_matrix, small_vec, start_idx, end_idx)
+            rows = start_idx + top_k(scores, n_candidates)
+        else:
+            rows = self.ann_index.search(
+                self.small_matrix,
+                small_vec,
+                n_candidates,
+                n_probe=(n_probe or self.n_probe),
+                start=start_idx,
+                end=end_idx,
+            )
+
+        # Re-rank the candidates by their similarity using the full vectors
+        choices = normalize_rows(np.asarray(self.matrix[rows], dtype='f'))
+        scores = choices.dot(vec)
+        top = top_k(scores, limit)
+        return pd.Series(
+            data=scores[top], index=self.frame.index[rows[top]], dtype='f'
         )
 
-        similar = similar_to_vec(similar_choices, vec, limit=limit)
-        return similar
+    def precomputed_similar_terms(self, term, limit=20):
+        """
+        Look up the terms most similar to a single term in the table of
+        precomputed nearest neighbors, as a Series like the one from
+        `similar_terms`. The similarities are only as precise as float16.
+
+        Returns None if the table can't answer this query, because there is no
+        table, the term isn't in the vocabulary, or `limit` is more than the
+        number of neighbors it keeps.
+        """
+        self.load()
+        if self.neighbor_rows is None or limit > self.neighbor_rows.shape[1]:
+            return None
+        row = self.row_index.row(term)
+        if row < 0:
+            return None
+        rows = self.neighbor_rows[row, :limit]
+        scores = self.neighbor_scores[row, :limit]
+        return pd.Series(data=scores.astype('f'), index=self.frame.index[rows])
+
+    def _filter_range(self, filter):
+        """
+        Get the range of indices on the DataFrame we're wrapping that match a
+        `filter` for `similar_terms`, as a (start, end) pair like the ones
+        from `_index_prefix_range`.
+
+        A filter is a URI prefix, such as `/c/en`, which matches terms that
+        start with it. Filters with more than two pieces, such as
+        `/c/en/dog`, or that end with `/.`, only match that exact term.
+        """
+        if not filter:
+            return 0, len(self.row_index)
+        exact_only = filter.count('/') >= 3
+        if filter.endswith('/.'):
+            filter = filter[:-2]
+            exact_only = True
+        if exact_only:
+            idx = self.row_index.row(filter)
+            if idx >= 0:
+                return idx, idx + 1
+            else:
+                return 0, 0
+        else:
+            return self._index_prefix_range(filter + '/')
+
+    def get_vectors(self, queries, oov_vector=True):
+        """
+        Get the vectors for many queries at once, as the rows of a 2-D array.
+        Each row is what `get_vector` would return for that query.
+
+        Queries that are single terms in the vocabulary are looked up all at
+        once, without going through `get_vector`.
+        """
+        self.load()
+        vecs = np.zeros((len(queries), self.k), dtype='f')
+        in_vocab = [
+            i
+            for (i, query) in enumerate(queries)
+            if isinstance(query, str) and query in self.row_index
+        ]
+        if in_vocab:
+            # As in `expand_terms`, a term is represented by its prefix with
+            # at most three pieces, which has no vector if it's not in the
+            # vocabulary
+            rows = self.row_index.rows([uri_prefix(queries[i]) for i in in_vocab])
+            found = rows >= 0
+            found_vecs = np.asarray(self.matrix[rows[found]], dtype='f')
+            vecs[np.asarray(in_vocab)[found]] = normalize_rows(found_vecs)
+        in_vocab_set = set(in_vocab)
+        for i, query in enumerate(queries):
+            if i not in in_vocab_set:
+                vecs[i] = self.get_vector(query, oov_vector=oov_vector)
+        return vecs
+
+    def similar_terms_batch(self, queries, filter=None, limit=20):
+        """
+        Get the results of `similar_terms` for many queries, as a list of
+        Series. This searches exhaustively, like `similar_terms` with
+        `exact=True`, but compares all the queries to each block of the
+        vector space with one matrix product.
+        """
+        self.load()
+        vecs = self.get_vectors(queries)
+        small_vecs = vecs[:, : self.small_k]
+        start_idx, end_idx = self._filter_range(filter)
+        n_candidates = min(limit * 50, end_idx - start_idx)
+        if n_candidates <= 0:
+            return [empty_series() for query in queries]
+
+        # Find the best candidates for each query in `small_frame`, keeping
+        # the `n_candidates` best rows and their scores as we go through it
+        # a block at a time. These arrays have one column per query.
+        best_rows = np.zeros((0, len(queries)), dtype=np.int64)
+        best_scores = np.zeros((0, len(queries)), dtype='f')
+        for block_start in range(start_idx, end_idx, BATCH_ROW_BLOCK):
+            block_end = min(block_start + BATCH_ROW_BLOCK, end_idx)
+            block = np.asarray(self.small_matrix[block_start:block_end], dtype='f')
+            block_scores = block @ small_vecs.T
+            block_rows = np.arange(block_start, block_end)[:, np.newaxis].repeat(
+                len(queries), axis=1
+            )
+            scores = np.concatenate([best_scores, block_scores])
+            rows = np.concatenate([best_rows, block_rows])
+            if len(scores) > n_candidates:
+                keep = np.argpartition(-scores, n_candidates - 1, axis=0)[:n_candidates]
+                scores = np.take_along_axis(scores, keep, axis=0)
+                rows = np.take_along_axis(rows, keep, axis=0)
+            best_scores, best_rows = scores, rows
+
+        # Re-rank the candidates using their full, normalized vectors
+        results = []
+        for query_start in range(0, len(queries), BATCH_QUERY_BLOCK):
+            query_end = query_start + BATCH_QUERY_BLOCK
+            candidate_rows = best_rows[:, query_start:query_end].T
+            candidates = normalize_rows(
+                np.asarray(self.matrix[candidate_rows], dtype='f')
+            )
+            full_scores = np.einsum('qck,qk->qc', candidates, vecs[query_start:query_end])
+            for rows, scores, vec in zip(
+                candidate_rows, full_scores, vecs[query_start:query_end]
+            ):
+                if vec.dot(vec) == 0.:
+                    results.append(empty_series())
+                    continue
+                top = top_k(scores, limit)
+                results.append(
+                    pd.Series(data=scores[top], index=self.frame.index[rows[top]])
+                )
+        return results
 
     def get_similarity(self, query1, query2):
         vec1 = self.get_vector(query1)
         vec2 = self.get_vector(query2)
         return cosine_similarity(vec1, vec2)
 
+    def _longest_completed_prefix(self, term):
+        """
+        Get the length of the longest prefix of `term` that some term in the
+        vocabulary starts with.
+
+        In the sorted list of terms, the terms that share the longest prefix
+        with `term` include one of the two that `term` would be inserted
+        between, so that's all we have to check.
+        """
+        labels = self.sorted_labels
+        pos = int(np.searchsorted(labels, term))
+        neighbors = labels[max(pos - 1, 0):pos + 1]
+        return max(
+            [len(os.path.commonprefix([term, label])) for label in neighbors], default=0
+        )
+
     def _terms_with_prefix(self, prefix):
         """
         Get a list of terms whose URI begins with the given prefix. The list
@@ -302,13 +586,81 @@ class VectorSpaceWrapper(object):
 
         Returns the empty range (0, 0) if no terms begin with this prefix.
         """
-        # Use the trie to find all terms with the given prefix. Then sort them,
-        # because the range will span from our first prefix in sorted
-        # order to just after our last.
-        terms = sorted(self._terms_with_prefix(prefix))
-        if not terms:
+        if prefix in self.language_ranges:
+            return self.language_ranges[prefix]
+
+        # The terms are sorted, so the ones with the prefix are the ones from
+        # the prefix itself up to the first string that sorts after all of
+        # them
+        labels = self.sorted_labels
+        start_loc = int(np.searchsorted(labels, prefix, side='left'))
+        end_loc = int(np.searchsorted(labels, prefix_upper_bound(prefix), side='left'))
+        if start_loc == end_loc:
             return (0, 0)
-
-        start_loc = self.frame.index.get_loc(terms[0])
-        end_loc = self.frame.index.get_loc(terms[-1]) + 1
         return start_loc, end_loc
+
+    def _build_language_ranges(self):
+        """
+        Find the range of rows for each language, such as '/c/en/', so that
+        filtering by language is a dictionary lookup. Because the terms are
+        sorted, we can jump from each language to the next with a binary
+        search.
+        """
+        labels = self.sorted_labels
+        self.language_ranges = {}
+        start_loc = 0
+        while start_loc < len(labels):
+            pieces = labels[start_loc].split('/', 3)
+            if len(pieces) < 4 or pieces[0]:
+                # This label isn't a term with a language, so skip it
+                start_loc += 1
+                continue
+            prefix = '/'.join(pieces[:3]) + '/'
+            end_loc = int(
+                np.searchsorted(labels, prefix_upper_bound(prefix), side='left')
+            )
+            self.language_ranges[prefix] = (start_loc, end_loc)
+            start_loc = end_loc
+
+
+def prefix_upper_bound(prefix):
+    """
+    Get a string that sorts after every string that starts with `prefix`,
+    and before every other string that sorts after `prefix`, by incrementing
+    its last character. (This assumes the prefix doesn't end with U+10FFFF,
+    which would never appear in a URI.)
+
+    >>> prefix_upper_bound('/c/fr/')
+    '/c/fr0'
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def empty_series():
+    """
+    Get an empty Series, which is what `similar_terms` finds when there's
+    nothing to compare to.
+    """
+    return pd.Series(data=[], index=[], dtype='f')
+
+
+def default_vector_filename():
+    """
+    Get the path of the vectors that the API uses: the memory-mapped
+    directory `vectors/mini` if it has been exported, or `vectors/mini.h5`.
+    """
+    mmap_dirname = get_data_filename('vectors/mini')
+    if os.path.isdir(mmap_dirname):
+        return mmap_dirname
+    return get_data_filename('vectors/mini.h5')
+
+
+def ann_index_filename(vector_filename):
+    """
+    Get the filename where the approximate nearest-neighbor index for a file
+    of vectors is saved, such as `mini.ivf.npz` for `mini.h5`. A directory of
+    memory-mapped vectors keeps its index inside the directory.
+    """
+    if os.path.isdir(vector_filename):
+        return os.path.join(vector_filename, 'ann.ivf.npz')
+    return os.path.splitext(vector_filename)[0] + '.ivf.npz'
@@ -12,7 +12,16 @@ from conceptnet5.api import VALID_KEYS, error
 from conceptnet5.nodes import standardized_concept_uri
 from conceptnet_web.error_logging import try_configuring_sentry
 from conceptnet_web.filters import FILTERS
+from conceptnet_web import json_rendering
 from conceptnet_web.json_rendering import jsonify
+from conceptnet_web.metrics import configure_metrics
+from conceptnet_web.response_cache import ResponseCache
+
+try:
+    import uwsgidecorators
+except ImportError:
+    # We're not running under uWSGI
+    uwsgidecorators = None
 
 # Configuration
 
@@ -28,6 +37,7 @@ def app_path(path):
 
 
 app.config['RATELIMIT_ENABLED'] = os.environ.get('CONCEPTNET_RATE_LIMITING') == '1'
+METRICS_ENABLED = os.environ.get('CONCEPTNET_METRICS') == '1'
 
 app.config.update({
     'JSON_AS_ASCII': False
@@ -42,6 +52,33 @@ CORS(app)
 try_configuring_sentry(app)
 application = app  # for uWSGI
 
+# Cache responses until a new build of the data is loaded. Set
+# CONCEPTNET_RESPONSE_CACHE=0 to turn this off, or set
+# CONCEPTNET_RESPONSE_CACHE_DIR to also share cached responses between
+# processes on disk.
+RESPONSE_CACHE = ResponseCache(
+    responses.build_version,
+    max_items=10000,
+    max_bytes=128 * 2 ** 20,
+    disk_path=os.environ.get('CONCEPTNET_RESPONSE_CACHE_DIR'),
+    enabled=os.environ.get('CONCEPTNET_RESPONSE_CACHE') != '0',
+)
+
+# Record how long requests take, and where the time goes, at /metrics
+if METRICS_ENABLED:
+    configure_metrics(app, limiter, RESPONSE_CACHE)
+
+# With CONCEPTNET_PRELOAD=1, load the vectors and assertions as soon as the app
+# is imported. Under uWSGI (without lazy-apps), that happens in the master
+# process, so the workers it forks share one copy of the loaded data, and
+# each worker only has to open its own database connections.
+if os.environ.get('CONCEPTNET_PRELOAD') == '1':
+    if uwsgidecorators is None:
+        responses.warm_up()
+    else:
+        responses.warm_up(before_fork=True)
+        uwsgidecorators.postfork(responses.connect_after_fork)
+
 
 def get_int(args, key, default, minimum, maximum):
     strvalue = args.get(key, default)
@@ -54,11 +91,13 @@ def get_int(args, key, default, minimum, maximum):
 
 # Lookup: match any path starting with /a/, /c/, /d/, /r/, or /s/
 @app.route('/<any(a, c, d, r, s):top>/<path:query>')
+@RESPONSE_CACHE.cached
 def query_node(top, query):
     req_args = flask.request.args
     path = '/%s/%s' % (top, query.strip('/'))
     offset = get_int(req_args, 'offset', 0, 0, 100000)
     limit = get_int(req_args, 'limit', 20, 0, 1000)
+    after = req_args.get('after')
     grouped = req_args.get('grouped', 'false').lower() == 'true'
     if grouped:
         limit = min(limit, 100)
@@ -66,21 +105,90 @@ def query_node(top, query):
     elif path.startswith('/a/'):
         results = responses.lookup_single_assertion(path)
     else:
-        results = responses.lookup_paginated(path, offset=offset, limit=limit)
+        results = responses.lookup_paginated(
+            path, offset=offset, limit=limit, after=after
+        )
     return jsonify(results)
 
 
 @app.route('/search')
 @app.route('/query')
+@RESPONSE_CACHE.cached
 def query():
     req_args = flask.request.args
     criteria = {}
     offset = get_int(req_args, 'offset', 0, 0, 100000)
     limit = get_int(req_args, 'limit', 50, 0, 1000)
+    after = req_args.get('after')
     for key in flask.request.args:
         if key in VALID_KEYS:
             criteria[key] = flask.request.args[key]
-    results = responses.query_paginated(criteria, offset=offset, limit=limit)
+    results = responses.query_paginated(
+        criteria, offset=offset, limit=limit, after=after
+    )
+    return jsonify(results)
+
+
+# How many edges the /export endpoint writes at a time
+EXPORT_CHUNK_SIZE = 100
+
+
+@app.route('/export')
+@limiter.limit("10 per minute")
+def export():
+    """
+    Stream every edge that matches the query criteria as newline-delimited
+    JSON, with no limit or paging. The edges are read from the database as
+    fast as the client reads the response.
+    """
+    criteria = {
+        key: value for (key, value) in flask.request.args.items() if key in VALID_KEYS
+    }
+    edges = responses.export_edges(criteria)
+
+    # Get the first edge now, so that a bad query is an error response
+    # instead of a broken stream
+    try:
+        first_edge = next(edges, None)
+    except ValueError as e:
+        return render_error(400, str(e))
+
+    def generate():
+        if first_edge is None:
+            return
+        # Look up `encode_json` through its module, where the metrics
+        # replace it with a timed version
+        encode_json = json_rendering.encode_json
+        # If the client disconnects, closing `edges` gives its database
+        # connection back to the pool
+        try:
+            lines = [encode_json(first_edge)]
+            for edge in edges:
+                lines.append(encode_json(edge))
+                if len(lines) >= EXPORT_CHUNK_SIZE:
+                    yield b'\n'.join(lines) + b'\n'
+                    lines = []
+            if lines:
+                yield b'\n'.join(lines) + b'\n'
+        finally:
+            edges.close()
+
+    return flask.Response(
+        flask.stream_with_context(generate()), mimetype='application/x-ndjson'
+    )
+
+
+@app.route('/batch', methods=['POST'])
+@limiter.limit("60 per minute")
+def query_batch():
+    """
+    Answer a JSON list of lookups and queries in one response. See
+    `conceptnet5.api.batch` for the form of each request.
+    """
+    requests = flask.request.get_json(force=True, silent=True)
+    if requests is None:
+        return render_error(400, "The request body should be a JSON list of requests.")
+    results = responses.batch(requests)
     return jsonify(results)
 
 
@@ -117,6 +225,7 @@ def see_documentation():
 
 @app.route('/related/<path:uri>')
 @limiter.limit("60 per minute")
+@RESPONSE_CACHE.cached
 def query_top_related(uri):
     req_args = flask.request.args
     uri = '/' + uri.rstrip('/ ')
@@ -128,6 +237,7 @@ def query_top_related(uri):
 
 @app.route('/relatedness')
 @limiter.limit("60 per minute")
+@RESPONSE_CACHE.cached
 def query_relatedness():
     req_args = flask.request.args
     node1 = req_args.get('node1')
@@ -136,6 +246,44 @@ def query_relatedness():
     return jsonify(result)
 
 
+@app.route('/relatedness/matrix', methods=['GET', 'POST'])
+@limiter.limit("60 per minute")
+@RESPONSE_CACHE.cached
+def query_relatedness_matrix():
+    """
+    Get the relatedness of every node in `nodes_a` to every node in
+    `nodes_b`. The nodes can be given as comma-separated lists in the query
+    string, or as JSON lists in a POST body.
+    """
+    if flask.request.method == 'POST':
+        body = flask.request.get_json(force=True, silent=True)
+        if not isinstance(body, dict):
+            return render_error(
+                400, "The request body should be a JSON object with nodes_a and nodes_b."
+            )
+        nodes_a = body.get('nodes_a')
+        nodes_b = body.get('nodes_b')
+    else:
+        req_args = flask.request.args
+        nodes_a = req_args.get('nodes_a')
+        nodes_b = req_args.get('nodes_b')
+        nodes_a = nodes_a and nodes_a.split(',')
+        nodes_b = nodes_b and nodes_b.split(',')
+    if not (isinstance(nodes_a, list) and (nodes_b is None or isinstance(nodes_b, list))):
+        return render_error(400, "Arguments should be called nodes_a and nodes_b.")
+    result = responses.query_relatedness_matrix(nodes_a, nodes_b)
+    return jsonify(result)
+
+
+# A load balancer can poll this to avoid sending requests to a worker that
+# hasn't finished loading. It responds with 503 until the worker is ready.
+@app.route('/health/ready')
+@limiter.exempt
+def health_ready():
+    result = responses.readiness()
+    return jsonify(result, status=200 if result['ready'] else 503)
+
+
 @app.errorhandler(IOError)
 @app.errorhandler(MemoryError)
 def error_data_unavailable(e):
@@ -1,4 +1,6 @@
+import hashlib
 import json
+import os
 import re
 
 import flask
@@ -7,6 +9,53 @@ from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import get_lexer_by_name
 
+from conceptnet5.util.cache import LRUCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_json_stdlib(obj, indent=False):
+    """
+    Encode an object as UTF-8 JSON with sorted keys, using Python's `json`
+    module.
+    """
+    text = json.dumps(obj, ensure_ascii=False, sort_keys=True, indent=(2 if indent else None))
+    return text.encode('utf-8')
+
+
+def encode_json_orjson(obj, indent=False):
+    """
+    Encode an object as UTF-8 JSON with sorted keys, using the much faster
+    `orjson` package. The output decodes to the same values as the output of
+    `encode_json_stdlib`, but the whitespace and the formatting of some
+    numbers (such as 1e-7 instead of 1e-07) can differ. NaN and infinite
+    floats are the exception: `orjson` writes them as `null`, where the
+    `json` module writes the non-standard `NaN` and `Infinity`.
+
+    Objects that `orjson` can't encode, such as dictionaries with non-string
+    keys, are encoded with the `json` module instead.
+    """
+    option = orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    try:
+        return orjson.dumps(obj, option=option)
+    except TypeError:
+        return encode_json_stdlib(obj, indent)
+
+
+JSON_BACKENDS = {'json': encode_json_stdlib}
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = encode_json_orjson
+
+# Use orjson if it's installed, unless CONCEPTNET_JSON_BACKEND says otherwise
+encode_json = JSON_BACKENDS[
+    os.environ.get('CONCEPTNET_JSON_BACKEND', 'orjson' if orjson is not None else 'json')
+]
+
 
 def request_wants_json():
     """
@@ -52,14 +101,45 @@ linker = regex_replacement_stack([
 LEXER = get_lexer_by_name('json')
 FORMATTER = HtmlFormatter()
 
+# JSON that's longer than this many characters is shown without highlighting
+# or links, because highlighting it would take too long
+HIGHLIGHT_MAX_LENGTH = 256 * 1024
+
+# Highlighted HTML, keyed by a hash of the JSON it came from
+HIGHLIGHT_CACHE = LRUCache(max_items=1000, max_bytes=64 * 2 ** 20)
+
 
 def highlight_and_link_json(content):
     """
     Given JSON text, syntax-highlight it and convert URLs to links.
+
+    The results are cached. JSON that's longer than `HIGHLIGHT_MAX_LENGTH`
+    is just escaped and shown as it is.
+    """
+    if len(content) > HIGHLIGHT_MAX_LENGTH:
+        return Markup('<div class="highlight"><pre>%s</pre></div>') % content
+    key = hashlib.sha256(content.encode('utf-8')).digest()
+    html = HIGHLIGHT_CACHE.get(key)
+    if html is None:
+        html = Markup(linker(highlight(content, LEXER, FORMATTER)))
+        HIGHLIGHT_CACHE.put(key, html)
+    return html
+
+
+def script_safe_json(encoded):
+    """
+    Make encoded JSON safe to include in a <script> tag, by escaping the
+    characters that could end the tag, as Jinja's `tojson` filter does.
+
+    >>> print(script_safe_json(b'{"a": "</script>"}'))
+    {"a": "\\u003c/script\\u003e"}
     """
-    html = highlight(content, LEXER, FORMATTER)
-    urlized_html = linker(html)
-    return Markup(urlized_html)
+    text = encoded.decode('utf-8')
+    for char, escaped in (
+        ('<', '\\u003c'), ('>', '\\u003e'), ('&', '\\u0026'), ("'", '\\u0027')
+    ):
+        text = text.replace(char, escaped)
+    return Markup(text)
 
 
 def jsonify(obj, status=200):
@@ -70,14 +150,14 @@ def jsonify(obj, status=200):
     """
     if flask.request is None or request_wants_json():
         return flask.Response(
-            json.dumps(obj, ensure_ascii=False, sort_keys=True),
+            encode_json(obj),
             status=status,
             mimetype='application/json'
         )
     else:
-        pretty_json = json.dumps(obj, ensure_ascii=False, sort_keys=True, indent=2)
+        pretty_json = encode_json(obj, indent=True).decode('utf-8')
         return flask.render_template(
             'json.html',
             json=pretty_json,
-            raw_object=obj
+            raw_json=script_safe_json(encode_json(obj))
         ), status
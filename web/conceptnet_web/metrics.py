@@ -0,0 +1,83 @@
+"""
+Instrumentation for the API, which is turned on by setting
+CONCEPTNET_METRICS=1. It records how long each route takes, and how much of
+that time is spent in the assertion finder, in vector operations, and in
+encoding JSON, along with the hit rates of the caches. The metrics are
+served at /metrics in the Prometheus text format.
+"""
+import time
+
+import flask
+
+from conceptnet5 import api as responses
+from conceptnet5.util.metrics import MetricsRegistry, instrument_methods
+from conceptnet_web import json_rendering
+
+FINDER_METHODS = [
+    'lookup', 'lookup_page', 'lookup_grouped_by_feature', 'lookup_grouped_by_feature_many',
+    'lookup_many', 'lookup_assertion', 'random_edges', 'query', 'query_page',
+    'build_version',
+]
+VECTOR_METHODS = [
+    'load', 'similar_terms', 'similar_terms_batch', 'precomputed_similar_terms',
+    'get_similarity', 'get_vectors',
+]
+
+
+def configure_metrics(app, limiter, response_cache):
+    """
+    Instrument the API served by `app`, and add the /metrics route to it.
+    Returns the MetricsRegistry.
+    """
+    registry = MetricsRegistry()
+    request_seconds = registry.histogram(
+        'request_seconds', 'Time to handle a request', ['route', 'method', 'status']
+    )
+    finder_seconds = registry.histogram(
+        'assertion_finder_seconds', 'Time spent in AssertionFinder methods', ['method']
+    )
+    vector_seconds = registry.histogram(
+        'vectors_seconds', 'Time spent in VectorSpaceWrapper methods', ['method']
+    )
+    encode_seconds = registry.histogram(
+        'json_encode_seconds', 'Time spent encoding responses as JSON'
+    )
+
+    instrument_methods(responses.FINDER, FINDER_METHODS, finder_seconds)
+    instrument_methods(responses.VECTORS, VECTOR_METHODS, vector_seconds)
+    encode_json = json_rendering.encode_json
+
+    def timed_encode_json(obj, indent=False):
+        with encode_seconds.time():
+            return encode_json(obj, indent)
+
+    # Modules that use `encode_json` look it up as `json_rendering.encode_json`
+    # when they call it, so they get this version
+    json_rendering.encode_json = timed_encode_json
+
+    registry.add_cache('vectors', responses.VECTORS.cache)
+    registry.add_cache('responses', response_cache.memory)
+    registry.add_cache('highlighting', json_rendering.HIGHLIGHT_CACHE)
+
+    @app.before_request
+    def start_request_timer():
+        flask.g.request_start = time.monotonic()
+
+    @app.after_request
+    def record_request_time(response):
+        start = flask.g.get('request_start')
+        if start is not None:
+            label_values = (
+                flask.request.endpoint or 'none',
+                flask.request.method,
+                response.status_code,
+            )
+            request_seconds.observe(label_values, time.monotonic() - start)
+        return response
+
+    @app.route('/metrics')
+    @limiter.exempt
+    def metrics():
+        return flask.Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    return registry
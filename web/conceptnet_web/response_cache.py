@@ -0,0 +1,202 @@
+"""
+A cache of rendered API responses. ConceptNet's data doesn't change between
+builds, so a response can be reused until `cn5-db load_data` loads a new
+build, which the cache notices by checking the build version.
+
+Responses are kept in an in-process LRU cache, and optionally in a directory
+of files that several worker processes can share. Cached responses have
+strong ETags, so clients that send `If-None-Match` get a 304 when nothing
+has changed.
+"""
+import functools
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+
+import flask
+
+from conceptnet5.util.cache import LRUCache
+from conceptnet_web.json_rendering import request_wants_json
+
+# How often to check whether a new build of the data has been loaded, in
+# seconds
+VERSION_CHECK_INTERVAL = 30.
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'mimetype', 'etag'])
+
+
+def request_key(request):
+    """
+    Get the cache key for a GET request: its path, its query arguments in a
+    consistent order, and whether it's asking for JSON or for HTML.
+    """
+    args = tuple(sorted(request.args.items(multi=True)))
+    return (request.path, args, request_wants_json())
+
+
+def _digest(value):
+    return hashlib.sha256(repr(value).encode('utf-8')).hexdigest()
+
+
+class DiskCache(object):
+    """
+    Cached responses stored as files under `path`, which can be shared by
+    several processes. Each build version has its own subdirectory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _filename(self, version, key):
+        digest = _digest(key)
+        return os.path.join(self.path, _digest(version)[:16], digest[:2], digest)
+
+    def get(self, version, key):
+        try:
+            with open(self._filename(version, key), 'rb') as infile:
+                data = infile.read()
+        except FileNotFoundError:
+            return None
+        mimetype, etag, body = data.split(b'\n', 2)
+        return CachedResponse(body, mimetype.decode('utf-8'), etag.decode('utf-8'))
+
+    def put(self, version, key, entry):
+        filename = self._filename(version, key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        # Write to a temporary file and rename it, so that other processes
+        # never see a partly-written file
+        tmp_filename = '{}.{}.{}.tmp'.format(
+            filename, os.getpid(), threading.get_ident()
+        )
+        with open(tmp_filename, 'wb') as out:
+            out.write(entry.mimetype.encode('utf-8') + b'\n')
+            out.write(entry.etag.encode('utf-8') + b'\n')
+            out.write(entry.body)
+        os.replace(tmp_filename, filename)
+
+    def remove_other_versions(self, version):
+        """
+        Delete the responses that were cached for any other build version.
+        """
+        if not os.path.isdir(self.path):
+            return
+        keep = _digest(version)[:16]
+        for name in os.listdir(self.path):
+            if name != keep:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+
+class ResponseCache(object):
+    """
+    A cache of the responses to GET requests, for Flask views that are
+    wrapped with the `cached` decorator.
+
+    `version_func` returns the version of the data being served. It's called
+    at most once every `check_interval` seconds, and when its value changes,
+    everything cached for the previous version is thrown away.
+    """
+
+    def __init__(
+        self,
+        version_func,
+        max_items=10000,
+        max_bytes=None,
+        disk_path=None,
+        check_interval=VERSION_CHECK_INTERVAL,
+        clock=time.monotonic,
+        enabled=True,
+    ):
+        self.version_func = version_func
+        self.memory = LRUCache(max_items=max_items, max_bytes=max_bytes)
+        self.disk = DiskCache(disk_path) if disk_path else None
+        self.check_interval = check_interval
+        self.clock = clock
+        self.enabled = enabled
+        self.version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current_version(self):
+        """
+        Get the version of the data, checking it again if it hasn't been
+        checked recently.
+
+        `version_func` is called without holding the lock, so that requests
+        don't wait in line behind a slow check. If it fails, such as when
+        the database is unavailable, the last known version is used until
+        the next check.
+        """
+        with self._lock:
+            now = self.clock()
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return self.version
+            # Other threads keep using the known version while we check
+            self._checked_at = now
+            known_version = self.version
+
+        try:
+            version = self.version_func()
+        except Exception:
+            if known_version is None:
+                # We've never found out the version, so check again on
+                # the next request
+                with self._lock:
+                    self._checked_at = None
+            return known_version
+
+        with self._lock:
+            if version != self.version:
+                self.memory.clear()
+                if self.disk is not None:
+                    self.disk.remove_other_versions(version)
+                self.version = version
+            return self.version
+
+    def get(self, version, key):
+        entry = self.memory.get((version, key))
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(version, key)
+            if entry is not None:
+                self.memory.put((version, key), entry)
+        return entry
+
+    def put(self, version, key, entry):
+        self.memory.put((version, key), entry)
+        if self.disk is not None:
+            self.disk.put(version, key, entry)
+
+    def cached(self, view):
+        """
+        Decorate a Flask view so that its successful responses to GET requests
+        are cached, and come with ETags.
+        """
+
+        @functools.wraps(view)
+        def cached_view(*args, **kwargs):
+            request = flask.request
+            if not self.enabled or request.method != 'GET':
+                return view(*args, **kwargs)
+            version = self.current_version()
+            key = request_key(request)
+            entry = self.get(version, key)
+            if entry is None:
+                response = flask.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                entry = CachedResponse(
+                    body, response.mimetype, hashlib.sha256(body).hexdigest()[:32]
+                )
+                self.put(version, key, entry)
+
+            response = flask.Response(entry.body, mimetype=entry.mimetype)
+            response.set_etag(entry.etag)
+            # The same URL can be rendered as JSON or as HTML
+            response.vary.add('Accept')
+            return response.make_conditional(request)
+
+        return cached_view
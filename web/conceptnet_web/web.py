@@ -7,6 +7,7 @@ import flask
 from flask_limiter import Limiter
 
 from conceptnet5 import api as responses
+from conceptnet5.db.query import decode_page_token
 from conceptnet5.languages import COMMON_LANGUAGES, LANGUAGE_NAMES
 from conceptnet5.nodes import standardized_concept_uri
 from conceptnet5.uri import split_uri
@@ -44,6 +45,21 @@ def get_int(args, key, default, minimum, maximum):
     return max(minimum, min(maximum, value))
 
 
+def get_page_position(args):
+    """
+    Get the 'after' continuation token from the request, if there is a valid
+    one, and the offset of the page it refers to, so that we can show which
+    results are on the page.
+    """
+    after = args.get('after')
+    if after is not None:
+        try:
+            return after, decode_page_token(after)[2]
+        except ValueError:
+            pass
+    return None, get_int(args, 'offset', 0, 0, 100000)
+
+
 # Lookup: match any path starting with /a/, /c/, /d/, /r/, or /s/
 # @app.route('/<any(a, c, d, r, s):top>/<path:query>')
 @app.route('/')
@@ -74,7 +90,7 @@ def browse_concept(uri):
     limit = get_int(req_args, 'limit', 20, 0, 1000)
 
     # Offset is not used when grouping by features
-    offset = get_int(req_args, 'offset', 0, 0, 10000)
+    after, offset = get_page_position(req_args)
 
     filters = {}
     for key in responses.VALID_KEYS:
@@ -84,7 +100,7 @@ def browse_concept(uri):
     if filters:
         filters['node'] = concept
         limit = get_int(req_args, 'limit', 100, 0, 1000)
-        return edge_list_query(filters, offset=offset, limit=limit)
+        return edge_list_query(filters, offset=offset, limit=limit, after=after)
     else:
         results = responses.lookup_grouped_by_feature(concept, filters, feature_limit=limit)
         sources = []
@@ -106,7 +122,9 @@ def browse_concept(uri):
                 feat_label = label_choices[0]
             else:
                 feat_label = label_choices[1]
-            feature['label'] = feat_label.format(results['label'])
+            # The results may be shared with other requests that asked for
+            # the same thing at once, so label a copy of the feature
+            feature = dict(feature, label=feat_label.format(results['label']))
             for edge in feature['edges']:
                 sources.extend(edge['sources'])
 
@@ -128,9 +146,9 @@ def browse_node(top, query):
     # TODO: can we make this work with edge_list_query?
     req_args = flask.request.args
     path = '/%s/%s' % (top, query.strip('/'))
-    offset = get_int(req_args, 'offset', 0, 0, 100000)
+    after, offset = get_page_position(req_args)
     limit = get_int(req_args, 'limit', 100, 0, 1000)
-    results = responses.lookup_paginated(path, offset=offset, limit=limit)
+    results = responses.lookup_paginated(path, offset=offset, limit=limit, after=after)
     sources = []
     pageStart = offset + 1
     pageEnd = offset + max(1, min(limit, len(results['edges'])))
@@ -147,16 +165,18 @@ def browse_node(top, query):
 def query():
     req_args = flask.request.args
     criteria = {}
-    offset = get_int(req_args, 'offset', 0, 0, 100000)
+    after, offset = get_page_position(req_args)
     limit = get_int(req_args, 'limit', 100, 0, 1000)
     for key in flask.request.args:
         if key in responses.VALID_KEYS:
             criteria[key] = flask.request.args[key]
-    return edge_list_query(criteria, offset=offset, limit=limit)
+    return edge_list_query(criteria, offset=offset, limit=limit, after=after)
 
 
-def edge_list_query(criteria, offset=0, limit=50):
-    results = responses.query_paginated(criteria, offset=offset, limit=limit)
+def edge_list_query(criteria, offset=0, limit=50, after=None):
+    results = responses.query_paginated(
+        criteria, offset=offset, limit=limit, after=after
+    )
     sources = []
     pageStart = offset + 1
     pageEnd = offset + max(1, min(limit, len(results['edges'])))
@@ -26,5 +26,9 @@ setup(
         'limits', 'flask >= 0.12.3', 'flask-cors', 'flask-limiter',
         'langcodes >= 1.4.1', 'jinja2-highlight', 'pygments', 'raven[flask] >= 6.6'
     ],
+    extras_require={
+        # A faster JSON encoder, which is used if it's installed
+        'fast': ['orjson'],
+    },
     license = 'Apache License 2.0',
 )